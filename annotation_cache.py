@@ -0,0 +1,134 @@
+import os
+import uuid
+import numpy as np
+import pandas as pd
+from key_index import KeyIndex
+from source_cache import instructions_fingerprint
+from table_buffers import TableBuffers
+
+
+class AnnotationCache:
+    """
+    Memoizes annotation values per distinct input tuple.
+
+    Annotations that declare their input columns ("inputs" in the annotation instructions)
+    are evaluated once per distinct combination of input values and the results are
+    broadcast back to all rows. Results are shared across sources and, when a cache
+    directory is given, across runs. Entries are keyed by the fingerprint of the annotation
+    instructions, so changing a compute_function invalidates its memoized values.
+
+    Memoized values are appended to column buffers and indexed incrementally, and every
+    batch of new values is persisted as its own file, so memoizing a batch costs time in
+    the batch size. An annotation memoizes at most max_entries input tuples, further inputs
+    are computed without being memoized. Frames whose inputs are nearly all distinct (more
+    than max_distinct_ratio of the rows) are computed directly, as memoizing them would
+    mostly store values that are never reused.
+    """
+    def __init__(self, cache_dir: str | None = None, max_entries: int = 5_000_000, max_distinct_ratio: float = 0.9) -> None:
+        """
+        Initializes an annotation cache.
+
+        :param cache_dir: Directory used to persist memoized values, or None to keep them in memory only.
+        :param max_entries: Maximum number of input tuples memoized per annotation.
+        :param max_distinct_ratio: Ratio of distinct inputs to rows above which a frame is computed without memoization.
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_distinct_ratio = max_distinct_ratio
+        self._memos: dict[str, tuple[KeyIndex, TableBuffers]] = {}
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def compute(self, ann_col: str, annotation: dict[str, any], df: pd.DataFrame) -> None:
+        """
+        Computes the output columns of an annotation in place, calling its compute_function
+        only on input tuples that have not been memoized yet.
+
+        :param ann_col: The annotation name, also its output column unless "outputs" is given.
+        :param annotation: The annotation instructions, with "inputs" and "compute_function".
+        :param df: The DataFrame to annotate.
+        """
+        inputs: list[str] = annotation["inputs"]
+        outputs: list[str] = annotation.get("outputs", [ann_col])
+
+        # Hash each row's inputs and reduce them to the distinct input tuples. Without
+        # inputs, every row shares the same (empty) input tuple.
+        if inputs:
+            input_hashes = pd.util.hash_pandas_object(df[inputs].infer_objects(), index=False).to_numpy()
+        else:
+            input_hashes = np.zeros(len(df), dtype=np.uint64)
+        codes, distinct_hashes = pd.factorize(input_hashes)
+        if len(distinct_hashes) > 1 and len(distinct_hashes) > self.max_distinct_ratio * len(df):
+            input_df = df[inputs].reset_index(drop=True)
+            annotation["compute_function"](input_df)
+            for col in outputs:
+                df[col] = input_df[col].to_numpy()
+            return
+
+        memo_key = f"{ann_col}-{instructions_fingerprint(annotation)[:16]}"
+        index, values = self._get_memo(memo_key, outputs)
+        found = index.lookup(distinct_hashes)
+
+        missing = np.flatnonzero(found < 0)
+        computed = None
+        if len(missing) > 0:
+            # Evaluate the compute function once on a frame of the missing distinct inputs.
+            first_rows = np.flatnonzero(~pd.Series(codes).duplicated().to_numpy())
+            distinct_df = df[inputs].iloc[first_rows[missing]].reset_index(drop=True)
+            annotation["compute_function"](distinct_df)
+            computed = pd.DataFrame({col: distinct_df[col].to_numpy() for col in outputs})
+            stored = min(len(missing), max(self.max_entries - len(index), 0))
+            if stored > 0:
+                found[missing[:stored]] = index.append(distinct_hashes[missing[:stored]])
+                values.append(computed.iloc[:stored])
+                self._save_batch(memo_key, distinct_hashes[missing[:stored]], computed.iloc[:stored])
+
+        # Broadcast the values of the distinct inputs back to every row, taking the values
+        # that could not be memoized from the computed frame.
+        unstored = np.flatnonzero(found < 0)
+        for col in outputs:
+            if len(unstored) == 0:
+                column = values.data[col][:len(values)][found]
+            else:
+                computed_values = computed[col].to_numpy()
+                stored_rows = np.flatnonzero(found >= 0)
+                dtype = (np.result_type(values.data[col].dtype, computed_values.dtype) if len(stored_rows) > 0
+                         else computed_values.dtype)
+                column = np.empty(len(found), dtype=dtype)
+                column[stored_rows] = values.data[col][found[stored_rows]]
+                column[unstored] = computed_values[np.searchsorted(missing, unstored)]
+            df[col] = column[codes]
+
+    def _get_memo(self, memo_key: str, outputs: list[str]) -> tuple[KeyIndex, TableBuffers]:
+        """
+        Returns the index of the memoized input hashes of an annotation and the buffers of
+        their values, loading the batches persisted in the cache directory.
+        """
+        if memo_key not in self._memos:
+            index, values = KeyIndex([]), TableBuffers()
+            values.sync(pd.DataFrame(columns=outputs))
+            memo_dir = self._get_dir(memo_key)
+            if memo_dir is not None and os.path.isdir(memo_dir):
+                for name in sorted(os.listdir(memo_dir)):
+                    if not name.endswith(".pkl") or len(index) >= self.max_entries:
+                        continue
+                    batch = pd.read_pickle(os.path.join(memo_dir, name)).iloc[:self.max_entries - len(index)]
+                    index.append(batch.index.to_numpy(dtype=np.uint64))
+                    values.append(batch.reset_index(drop=True))
+            self._memos[memo_key] = (index, values)
+        return self._memos[memo_key]
+
+    def _save_batch(self, memo_key: str, hashes: np.ndarray, batch: pd.DataFrame) -> None:
+        """
+        Persists a batch of new memoized values when a cache directory is set.
+        """
+        memo_dir = self._get_dir(memo_key)
+        if memo_dir is not None:
+            os.makedirs(memo_dir, exist_ok=True)
+            # Write atomically, as several build processes may share the cache directory.
+            path = os.path.join(memo_dir, f"{uuid.uuid4().hex}.pkl")
+            batch.set_axis(pd.Index(hashes, dtype=np.uint64)).to_pickle(f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+
+    def _get_dir(self, memo_key: str) -> str | None:
+        return os.path.join(self.cache_dir, memo_key) if self.cache_dir is not None else None
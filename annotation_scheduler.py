@@ -0,0 +1,159 @@
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from annotation_cache import AnnotationCache
+from instrumentation import NULL_TRACER, Tracer
+
+
+class AnnotationScheduler:
+    """
+    Runs annotation compute functions in dependency order.
+
+    Annotations may declare the columns they read ("inputs") and write ("outputs",
+    defaulting to the annotation name). An annotation depends on every annotation whose
+    outputs it reads. Annotations without declared inputs may read anything, so they run
+    serially in their listed order, after every declared annotation that does not read
+    their outputs or the outputs of a later undeclared annotation, directly or through
+    other annotations. Annotations whose outputs are neither requested nor needed by a
+    requested annotation are skipped.
+
+    Independent annotations of the same dependency level run concurrently on a thread pool,
+    each on its own copy of its input columns, and their outputs are written back to the
+    annotated frame once the level is done.
+
+    Every annotation is recorded as an "annotation" span, and its compute function is
+    profiled when the tracer profiles.
+    """
+    def __init__(self, workers: int = 1, cache: AnnotationCache | None = None, tracer: Tracer | None = None) -> None:
+        """
+        Initializes an annotation scheduler.
+
+        :param workers: Number of threads used to run independent annotations.
+        :param cache: Cache used for annotations that declare their inputs.
+        :param tracer: Tracer recording the annotation spans.
+        """
+        self.workers = workers
+        self.cache = cache if cache is not None else AnnotationCache()
+        self.tracer = tracer if tracer is not None else NULL_TRACER
+
+    def plan(self, annotations: dict[str, dict], requested: list[str]) -> list[list[str]]:
+        """
+        Returns the annotations needed for the requested ones, grouped into levels that can
+        each run concurrently once the previous levels are done.
+
+        :param annotations: The "annotations" instructions of a db.
+        :param requested: The requested annotation names, in table column order.
+        """
+        order = [name for name in requested if name in annotations]
+        order += [name for name in annotations if name not in order]
+        producers = {output: name for name in order for output in get_outputs(name, annotations[name])}
+
+        # Build the dependency graph over all known annotations.
+        depends_on: dict[str, set[str]] = {name: set() for name in order}
+        for name in order:
+            inputs = annotations[name].get("inputs")
+            if inputs is not None:
+                depends_on[name].update(producers[col] for col in inputs if col in producers and producers[col] != name)
+        undeclared = [name for name in order if annotations[name].get("inputs") is None]
+        for i, name in enumerate(undeclared):
+            depends_on[name].update(undeclared[:i])
+            # The later undeclared annotations run after this one, so it must not wait for
+            # anything that depends on them either.
+            dependents = set().union(*(get_dependents(later, depends_on) for later in undeclared[i:]))
+            depends_on[name].update(other for other in order
+                                    if other not in undeclared and other not in dependents)
+
+        # Keep only the requested annotations and what they (transitively) depend on.
+        needed: set[str] = set()
+        stack = [name for name in requested if name in annotations]
+        missing = [name for name in requested if name not in annotations]
+        if missing:
+            raise KeyError(f"Annotations {missing} are not defined in the instructions.")
+        while stack:
+            name = stack.pop()
+            if name not in needed:
+                needed.add(name)
+                stack.extend(depends_on[name])
+
+        # Group the needed annotations into levels (Kahn's algorithm).
+        levels: list[list[str]] = []
+        done: set[str] = set()
+        remaining = [name for name in order if name in needed]
+        while remaining:
+            level = [name for name in remaining if depends_on[name] & needed <= done]
+            if not level:
+                raise ValueError(f"Annotations {remaining} have cyclic dependencies.")
+            levels.append(level)
+            done.update(level)
+            remaining = [name for name in remaining if name not in done]
+        return levels
+
+    def get_input_cols(self, annotations: dict[str, dict], requested: list[str]) -> list[str]:
+        """
+        Returns the declared input columns of the needed annotations that are not produced
+        by another annotation, i.e. the columns that must come from the db itself.
+        """
+        needed = [name for level in self.plan(annotations, requested) for name in level]
+        produced = {output for name in needed for output in get_outputs(name, annotations[name])}
+        input_cols: list[str] = []
+        for name in needed:
+            for col in annotations[name].get("inputs", []):
+                if col not in produced and col not in input_cols:
+                    input_cols.append(col)
+        return input_cols
+
+    def run(self, annotations: dict[str, dict], requested: list[str], df: pd.DataFrame) -> None:
+        """
+        Computes the requested annotations (and the annotations they depend on) in place.
+
+        :param annotations: The "annotations" instructions of a db.
+        :param requested: The requested annotation names.
+        :param df: The DataFrame to annotate.
+        """
+        tags = self.tracer.get_tags()
+        for level in self.plan(annotations, requested):
+            if len(level) == 1 or self.workers <= 1:
+                for name in level:
+                    self._run_one(name, annotations[name], df, tags)
+                continue
+            frames = {name: df[annotations[name]["inputs"]].copy() for name in level}
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(level))) as executor:
+                futures = [executor.submit(self._run_one, name, annotations[name], frames[name], tags) for name in level]
+                for future in futures:
+                    future.result()
+            for name in level:
+                for output in get_outputs(name, annotations[name]):
+                    df[output] = frames[name][output].to_numpy()
+
+    def _run_one(self, name: str, annotation: dict[str, any], df: pd.DataFrame, tags: dict[str, any]) -> None:
+        """
+        Computes one annotation in place, through the cache when its inputs are declared.
+        """
+        profile_name = "-".join(str(value) for value in [*tags.values(), name])
+        with self.tracer.span("annotation", **{**tags, "annotation": name}) as span, self.tracer.profile(profile_name):
+            span.rows_in = span.rows_out = len(df)
+            if annotation.get("inputs") is not None:
+                self.cache.compute(name, annotation, df)
+            else:
+                annotation["compute_function"](df)
+
+
+def get_dependents(name: str, depends_on: dict[str, set[str]]) -> set[str]:
+    """
+    Returns the annotations that depend on an annotation, directly or transitively.
+    """
+    dependents: set[str] = set()
+    stack = [name]
+    while stack:
+        current = stack.pop()
+        for other, dependencies in depends_on.items():
+            if current in dependencies and other not in dependents:
+                dependents.add(other)
+                stack.append(other)
+    return dependents
+
+
+def get_outputs(name: str, annotation: dict[str, any]) -> list[str]:
+    """
+    Returns the output columns of an annotation, defaulting to its name.
+    """
+    return annotation.get("outputs", [name])
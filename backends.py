@@ -0,0 +1,304 @@
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+import numpy as np
+import pandas as pd
+from db import Db, ValidationDb, VariantsDb, evaluate_rules, get_rule_columns
+
+
+class ExecutionBackend(ABC):
+    """
+    Abstract base class for the engines that run the merge, validation and export of an
+    ExtendedTable.
+    """
+    @abstractmethod
+    def merge_db(self, table, db: Db) -> None:
+        """
+        Merges a VariantsDb into the table.
+        """
+
+    @abstractmethod
+    def merge_all_dbs(self, table) -> None:
+        """
+        Merges all registered VariantsDbs into the table.
+        """
+
+    @abstractmethod
+    def validate_table(self, table) -> None:
+        """
+        Validates the table against the registered validation databases.
+        """
+
+    @abstractmethod
+    def save_table(self, table, file_path: str, file_format: str) -> None:
+        """
+        Saves the table to a file in the specified format.
+        """
+
+    def check_format(self, file_format: str) -> None:
+        """
+        Raises a ValueError if the backend cannot save tables in a format. Called before
+        the build, so an unsupported format does not fail after the whole build.
+        """
+
+    def close(self) -> None:
+        """
+        Releases the resources of the backend (e.g. local files).
+        """
+
+
+class PandasBackend(ExecutionBackend):
+    """
+    Runs everything in memory with pandas, on ExtendedTable.table.
+    """
+    def merge_db(self, table, db: Db) -> None:
+        table.pandas_merge_db(db)
+
+    def merge_all_dbs(self, table) -> None:
+        table.pandas_merge_all_dbs()
+
+    def validate_table(self, table) -> None:
+        table.pandas_validate_table()
+
+    def save_table(self, table, file_path: str, file_format: str) -> None:
+        table.pandas_save_table(file_path, file_format)
+
+
+class DuckDBBackend(ExecutionBackend):
+    """
+    Out-of-core backend on an embedded DuckDB database that spills to local disk.
+
+    merge_db and validate_table only stage the pre-processed keys (and annotation inputs
+    or rule attributes) of every db, chunk by chunk, into on-disk DuckDB tables.
+    save_table then runs the key union, indicator aggregation and validation joins as one
+    query and streams its result in batches: each batch is annotated with the compute
+    functions of the db that introduced its variants and appended to the output file.
+    The union table is never held in memory, so ExtendedTable.table stays empty.
+
+    Only rule-based validation dbs are supported, and the output formats are csv, tsv and
+    parquet.
+    """
+    SAVE_FORMATS = ["csv", "tsv", "parquet"]
+
+    def __init__(self, temp_directory: str | None = None, memory_limit: str | None = None, threads: int | None = None, batch_size: int = 100_000) -> None:
+        """
+        Initializes a DuckDB backend.
+
+        :param temp_directory: Local directory for the database file and spilled data (defaults to a new temporary directory).
+        :param memory_limit: DuckDB memory limit, e.g. "8GB".
+        :param threads: Number of DuckDB threads.
+        :param batch_size: Number of rows per streamed output batch.
+        """
+        try:
+            import duckdb
+        except ImportError as e:
+            raise ImportError("The duckdb backend requires the 'duckdb' package.") from e
+
+        self.work_dir = tempfile.mkdtemp(prefix="duckdb-", dir=temp_directory)
+        self.batch_size = batch_size
+        self.con = duckdb.connect(os.path.join(self.work_dir, "build.duckdb"))
+        self.con.execute(f"SET temp_directory = '{self.work_dir}'")
+        self.con.execute("SET preserve_insertion_order = false")
+        if memory_limit is not None:
+            self.con.execute(f"SET memory_limit = '{memory_limit}'")
+        if threads is not None:
+            self.con.execute(f"SET threads = {int(threads)}")
+        # Staged dbs, as (db, DuckDB table name, staged columns).
+        self.variant_sources: list[tuple[VariantsDb, str, list[str]]] = []
+        self.validation_sources: list[tuple[ValidationDb, str, list[str]]] = []
+        self.next_seq = 0
+
+    def merge_db(self, table, db: Db) -> None:
+        if not isinstance(db, VariantsDb):
+            raise ValueError("Only VariantsDb can be merged into the extended table.")
+        columns = table.get_input_cols(db)
+        table_name = f"variants_{len(self.variant_sources)}"
+        with table.tracer.span("merge_db", db=db.name) as span:
+            rows = span.rows_in = self._stage(db, table_name, columns)
+        self.variant_sources.append((db, table_name, columns))
+        print(f"Database '{db.name}' staged: {rows} variants.")
+
+    def merge_all_dbs(self, table) -> None:
+        for db in table.variant_dbs:
+            self.merge_db(table, db)
+
+    def validate_table(self, table) -> None:
+        for db in table.validation_dbs:
+            if db.rules is None:
+                raise ValueError(f"Validation database '{db.name}' has no rules. The duckdb backend only supports rule-based validation.")
+            columns = list(dict.fromkeys(db.key_cols + get_rule_columns(db.rules)))
+            table_name = f"validation_{len(self.validation_sources)}"
+            with table.tracer.span("validate", db=db.name) as span:
+                rows = span.rows_in = self._stage(db, table_name, columns)
+            self.validation_sources.append((db, table_name, columns))
+            print(f"Validation database '{db.name}' staged: {rows} variants.")
+
+    def check_format(self, file_format: str) -> None:
+        if file_format not in self.SAVE_FORMATS:
+            raise ValueError(f"Unsupported file format for the duckdb backend. Supported formats are: {', '.join(self.SAVE_FORMATS)}.")
+
+    def save_table(self, table, file_path: str, file_format: str) -> None:
+        self.check_format(file_format)
+
+        out_cols = (table.key_cols + [db.name for db in table.variant_dbs]
+                    + [db.name for db in table.validation_dbs] + table.ann_cols)
+        reader = self.con.execute(self._build_query(table)).fetch_record_batch(self.batch_size)
+        writer = None
+        rows = 0
+        try:
+            for batch in reader:
+                with table.tracer.span("save_batch") as span:
+                    df = self._finish_batch(table, batch.to_pandas(), out_cols)
+                    writer = self._write_batch(writer, df, file_path, file_format)
+                    span.rows_out = len(df)
+                rows += len(df)
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is None:
+            # Nothing was merged: still write the header (or schema).
+            self._write_batch(None, pd.DataFrame(columns=out_cols), file_path, file_format).close()
+        print(f"Table saved to {file_path} in {file_format} format: {rows} variants.")
+
+    def close(self) -> None:
+        """
+        Closes the DuckDB connection and removes its local files.
+        """
+        self.con.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def _stage(self, db: Db, table_name: str, columns: list[str]) -> int:
+        """
+        Appends the pre-processed rows of a db, chunk by chunk, to a DuckDB table with a
+        global "_seq" column recording the order in which rows were staged.
+        """
+        rows = 0
+        for chunk in self._iter_frames(db):
+            chunk = chunk[columns].reset_index(drop=True)
+            chunk["_seq"] = np.arange(self.next_seq, self.next_seq + len(chunk), dtype=np.int64)
+            self.next_seq += len(chunk)
+            self.con.register("staged_chunk", chunk)
+            if rows == 0:
+                self.con.execute(f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM staged_chunk")
+            else:
+                self.con.execute(f"INSERT INTO {table_name} SELECT * FROM staged_chunk")
+            self.con.unregister("staged_chunk")
+            rows += len(chunk)
+        if rows == 0:
+            column_defs = ", ".join(f"{quote(col)} VARCHAR" for col in columns)
+            self.con.execute(f"CREATE OR REPLACE TABLE {table_name} ({column_defs}, _seq BIGINT)")
+        return rows
+
+    def _iter_frames(self, db: Db) -> Iterator[pd.DataFrame]:
+        """
+        Yields the pre-processed db in chunks when it is streamed, or as one frame.
+        """
+        if db.df is None and db.chunk_size is not None:
+            yield from db.iter_chunks()
+            return
+        if db.df is None:
+            db.upload_pre_processed()
+        elif not db.pre_processed:
+            db.pre_process()
+        df = db.df
+        db.clear()
+        yield df
+
+    def _build_query(self, table) -> str:
+        """
+        Builds the query that unions the staged keys, aggregates the indicator columns,
+        joins the validation dbs and orders the variants by first appearance.
+        """
+        keys = [quote(col) for col in table.key_cols]
+        extra_cols = list(dict.fromkeys(col for _, _, columns in self.variant_sources
+                                        for col in columns if col not in table.key_cols))
+        union_parts = []
+        for source_id, (_, table_name, columns) in enumerate(self.variant_sources):
+            extras = [quote(col) if col in columns else f"NULL AS {quote(col)}" for col in extra_cols]
+            union_parts.append(f"SELECT {', '.join(keys + extras)}, {source_id} AS _src, _seq FROM {table_name}")
+
+        aggregates = ["min(_seq) AS _first_seq", "arg_min(_src, _seq) AS _first_src"]
+        aggregates += [f"arg_min({quote(col)}, _seq) AS {quote(col)}" for col in extra_cols]
+        aggregates += [f"max(CASE WHEN _src = {source_id} THEN 1 ELSE 0 END)::UTINYINT AS {quote(db.name)}"
+                       for source_id, (db, _, _) in enumerate(self.variant_sources)]
+        query = (f"WITH all_keys AS ({' UNION ALL '.join(union_parts)}), "
+                 f"merged AS (SELECT {', '.join(keys + aggregates)} FROM all_keys GROUP BY {', '.join(keys)}) ")
+
+        selects = ["m.*"]
+        joins = []
+        for i, (db, table_name, columns) in enumerate(self.validation_sources):
+            db_keys = [quote(col) for col in db.key_cols]
+            attributes = [f"arg_min({quote(col)}, _seq) AS {quote(f'_v{i}_{col}')}" for col in get_rule_columns(db.rules)]
+            joins.append(f"LEFT JOIN (SELECT {', '.join(db_keys + ['true AS _hit'] + attributes)} "
+                         f"FROM {table_name} GROUP BY {', '.join(db_keys)}) v{i} ON "
+                         + " AND ".join(f"m.{key} = v{i}.{db_key}" for key, db_key in zip(keys, db_keys)))
+            selects.append(f"coalesce(v{i}._hit, false) AS _v{i}_hit")
+            selects += [f"v{i}.{quote(f'_v{i}_{col}')}" for col in get_rule_columns(db.rules)]
+        return query + f"SELECT {', '.join(selects)} FROM merged m {' '.join(joins)} ORDER BY m._first_seq"
+
+    def _finish_batch(self, table, df: pd.DataFrame, out_cols: list[str]) -> pd.DataFrame:
+        """
+        Annotates a batch of merged variants with the db that introduced them and
+        evaluates the validation rules on it.
+        """
+        first_sources = df["_first_src"].to_numpy()
+        annotated = []
+        for source_id, (db, _, _) in enumerate(self.variant_sources):
+            source_df = df[first_sources == source_id].copy()
+            if source_df.empty:
+                continue
+            table.annotate(db, source_df)
+            annotated.append(source_df)
+        df = pd.concat(annotated).sort_index() if annotated else df
+        for i, (db, _, _) in enumerate(self.validation_sources):
+            found = df[f"_v{i}_hit"].to_numpy(dtype=bool)
+            result = evaluate_rules(db, df, found, lambda column: df[f"_v{i}_{column}"])
+            df[db.name] = result.astype(np.uint8)
+        return df.reindex(columns=out_cols, fill_value=0).reset_index(drop=True)
+
+    def _write_batch(self, writer, df: pd.DataFrame, file_path: str, file_format: str):
+        """
+        Appends a batch to the output file, opening the writer on the first batch.
+        """
+        if file_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            if writer is None:
+                arrow_table = pa.Table.from_pandas(df, preserve_index=False)
+                writer = pq.ParquetWriter(file_path, arrow_table.schema)
+            else:
+                arrow_table = pa.Table.from_pandas(df, schema=writer.schema, preserve_index=False)
+            writer.write_table(arrow_table)
+            return writer
+        first = writer is None
+        if first:
+            writer = open(file_path, "w", newline="")
+        df.to_csv(writer, sep="\t" if file_format == "tsv" else ",", index=False, header=first)
+        return writer
+
+
+def quote(identifier: str) -> str:
+    """
+    Quotes a column name for use in a DuckDB query.
+    """
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+
+BACKENDS = ["pandas", "duckdb"]
+
+
+def create_backend(name: str, **options) -> ExecutionBackend:
+    """
+    Creates an execution backend by name.
+
+    :param name: One of BACKENDS.
+    :param options: Backend-specific options (see DuckDBBackend).
+    """
+    if name == "pandas":
+        return PandasBackend()
+    elif name == "duckdb":
+        return DuckDBBackend(**options)
+    raise ValueError(f"Unsupported backend '{name}'. Supported backends are: {', '.join(BACKENDS)}.")
@@ -0,0 +1,386 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+BASES = np.array(["A", "C", "G", "T"])
+CHROMOSOMES = np.array([f"chr{i}" for i in range(1, 23)])
+
+DEFAULT_INSTRUCTIONS = '''import pandas as pd
+
+
+def pre_processor(df):
+    return df
+
+{functions}
+
+instructions = {{
+    "name": "default",
+    "key_cols": ["chrom", "pos", "ref", "alt"],
+    "pre_processor": pre_processor,
+    "annotations": {{
+{annotations}
+    }},
+}}
+'''
+
+ANNOTATION_FUNCTIONS = {
+    # Annotations of the alleles only: few distinct inputs, so they are memoized.
+    "alleles": '''def annotation_{k}(df):
+    df["ann_{k}"] = ((df["ref"] == "{ref}") & (df["alt"] == "{alt}")).astype(int)
+''',
+    # Annotations of the position: one distinct input per variant.
+    "position": '''def annotation_{k}(df):
+    df["ann_{k}"] = (df["pos"] % {modulo} == 0).astype(int)
+''',
+}
+
+DEFAULT_VALIDATION_INSTRUCTIONS = '''def pre_processor(df):
+    return df
+
+
+def validator(db, df):
+    return df
+
+
+instructions = {
+    "name": "default",
+    "key_cols": ["chrom", "pos", "ref", "alt"],
+    "pre_processor": pre_processor,
+    "validator": validator,
+}
+'''
+
+
+def generate_dbs(root: str, sources: int = 3, rows: int = 100_000, overlap: float = 0.5, annotations: int = 2, validation_rows: int | None = None, seed: int = 0) -> str:
+    """
+    Generates a synthetic dbs directory in the layout expected by check_dbs_dir_structure:
+    "variants/default/instructions.py" defining the key columns and the annotations,
+    one "variants/src_<i>" directory per source and one rule-based "validation/truth" db.
+
+    Every source has `rows` variants. A fraction `overlap` of them is shared by all
+    sources and the rest is unique to the source. Half of the annotations read the
+    alleles and half the position, so both memoized and per-variant annotations are
+    exercised.
+
+    :param root: The directory to create.
+    :param sources: Number of variant sources.
+    :param rows: Number of variants per source.
+    :param overlap: Fraction of each source's variants shared with the other sources.
+    :param annotations: Number of annotation columns.
+    :param validation_rows: Number of variants in the validation db (defaults to rows, 0 for none).
+    :param seed: Seed of the random generator.
+    """
+    if not 0 <= overlap <= 1:
+        raise ValueError("Overlap must be between 0 and 1.")
+    rng = np.random.default_rng(seed)
+    shared = int(rows * overlap)
+    unique = rows - shared
+
+    # Default instructions.
+    functions, entries = [], []
+    for k in range(annotations):
+        if k % 2 == 0:
+            ref = BASES[k // 2 % 4]
+            functions.append(ANNOTATION_FUNCTIONS["alleles"].format(k=k, ref=ref, alt=BASES[(k // 2 + 1) % 4]))
+            inputs = ["ref", "alt"]
+        else:
+            functions.append(ANNOTATION_FUNCTIONS["position"].format(k=k, modulo=k + 2))
+            inputs = ["pos"]
+        entries.append(f'        "ann_{k}": {{"compute_function": annotation_{k}, "inputs": {inputs}}},')
+    write_instructions(os.path.join(root, "variants", "default"),
+                       DEFAULT_INSTRUCTIONS.format(functions="\n\n".join(functions), annotations="\n".join(entries)))
+
+    # Variant sources: the shared variants have ids [0, shared), and source i owns the
+    # ids [shared + i * unique, shared + (i + 1) * unique).
+    all_ids = []
+    for i in range(sources):
+        ids = np.r_[np.arange(shared), shared + i * unique + np.arange(unique)]
+        ids = rng.permutation(ids)
+        all_ids.append(ids)
+        db_dir = os.path.join(root, "variants", f"src_{i}")
+        write_instructions(db_dir, f'instructions = {{"name": "src_{i}"}}\n')
+        df = get_variants(ids)
+        df["qual"] = rng.random(len(df)).round(3)
+        df.to_csv(os.path.join(db_dir, "variants_table.csv"), index=False)
+
+    # Validation db, sampled from the union of the sources.
+    write_instructions(os.path.join(root, "validation", "default"), DEFAULT_VALIDATION_INSTRUCTIONS)
+    validation_rows = rows if validation_rows is None else validation_rows
+    if validation_rows > 0:
+        union = np.unique(np.concatenate(all_ids))
+        ids = rng.choice(union, size=min(validation_rows, len(union)), replace=False)
+        db_dir = os.path.join(root, "validation", "truth")
+        write_instructions(db_dir, 'instructions = {"name": "truth", "rules": [{"type": "membership"}, '
+                                   '{"type": "isin", "column": "clnsig", "values": ["P", "LP"]}]}\n')
+        df = get_variants(ids)
+        df["clnsig"] = rng.choice(["P", "LP", "B", "VUS"], size=len(df))
+        df.to_csv(os.path.join(db_dir, "variants_table.csv"), index=False)
+    print(f"Synthetic databases generated in {root}: {sources} sources of {rows} variants.")
+    return root
+
+
+def get_variants(ids: np.ndarray) -> pd.DataFrame:
+    """
+    Returns the key columns of synthetic variant ids. The mapping is deterministic, so a
+    variant id has the same key in every source.
+    """
+    ref = ids % 4
+    alt = (ref + 1 + ids // 4 % 3) % 4
+    return pd.DataFrame({
+        "chrom": CHROMOSOMES[ids % len(CHROMOSOMES)],
+        "pos": ids // len(CHROMOSOMES) * 10 + 1,
+        "ref": BASES[ref],
+        "alt": BASES[alt],
+    })
+
+
+def write_instructions(db_dir: str, source: str) -> None:
+    os.makedirs(db_dir, exist_ok=True)
+    with open(os.path.join(db_dir, "instructions.py"), "w") as f:
+        f.write(source)
+
+
+def reset_peak_rss() -> None:
+    """
+    Resets the peak resident set size of the process where the OS allows it (Linux),
+    so that the peak of every stage can be measured separately.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def get_peak_rss() -> int:
+    """
+    Returns the peak resident set size of the process in bytes, since the last
+    reset_peak_rss when supported.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class StageTimer:
+    """
+    Accumulates the wall time, number of calls and peak RSS of named build stages.
+    """
+    def __init__(self) -> None:
+        self.stages: dict[str, dict[str, any]] = {}
+
+    def _add(self, name: str, seconds: float) -> dict[str, any]:
+        stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+        stage["seconds"] += seconds
+        stage["calls"] += 1
+        return stage
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Times a top-level stage and records its peak RSS.
+        """
+        reset_peak_rss()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stage = self._add(name, time.perf_counter() - start)
+            stage["peak_rss_bytes"] = max(stage.get("peak_rss_bytes", 0), get_peak_rss())
+
+    def wrap(self, obj: any, method_name: str, name: str) -> None:
+        """
+        Replaces a method of an object with a timed version that adds to a stage.
+        """
+        method = getattr(obj, method_name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._add(name, time.perf_counter() - start)
+
+        setattr(obj, method_name, timed)
+
+
+def run_benchmark(dbs_dir: str, output_dir: str, workers: int = 1, backend: str = "pandas", output_format: str = "tsv") -> dict[str, any]:
+    """
+    Builds, validates and saves the extended table of a dbs directory, timing every
+    stage. upload_db, pre_process and annotations are nested in the merge stage and are
+    only timed in this process (so not for upload_db and pre_process when workers > 1).
+
+    :param dbs_dir: The dbs directory, e.g. from generate_dbs.
+    :param output_dir: Directory the table is saved to.
+    :param workers: Number of processes used to load the variant dbs.
+    :param backend: The execution backend.
+    :param output_format: The format of the saved table.
+    """
+    from instructions_provider import InstructionsProvider
+    from extended_table import ExtendedTable
+
+    timer = StageTimer()
+    reset_peak_rss()
+    start = time.perf_counter()
+    provider = InstructionsProvider(dbs_dir)
+    variant_dbs = [provider.create_db_instance(name) for name in sorted(provider.get_dbs_names())]
+    validation_dbs = [provider.create_db_instance(name, "validation") for name in sorted(provider.get_dbs_names("validation"))]
+    table = ExtendedTable(provider.get_key_columns(), provider, variant_dbs, validation_dbs,
+                          provider.get_annotations_names(), workers=workers, backend=backend)
+    # Db instances are sent to the worker processes, so they are only wrapped when loaded here.
+    for db in validation_dbs + (variant_dbs if workers <= 1 else []):
+        timer.wrap(db, "upload_db", "upload_db")
+        timer.wrap(db, "pre_process", "pre_process")
+    timer.wrap(table, "annotate", "annotations")
+
+    try:
+        table.backend.check_format(output_format)
+        with timer.stage("merge"):
+            table.merge_all_dbs()
+        with timer.stage("validate_table"):
+            table.validate_table()
+        os.makedirs(output_dir, exist_ok=True)
+        with timer.stage("save_table"):
+            table.save_table(os.path.join(output_dir, f"extended_table.{output_format}"), output_format)
+    finally:
+        table.backend.close()
+    total = time.perf_counter() - start
+
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {
+        "stages": timer.stages,
+        "total_seconds": total,
+        "rows": len(table.table) if backend == "pandas" else None,
+        "peak_rss_bytes": max(stage.get("peak_rss_bytes", 0) for stage in timer.stages.values()),
+        "children_peak_rss_bytes": children_rss if sys.platform == "darwin" else children_rss * 1024,
+    }
+
+
+def get_environment() -> dict[str, any]:
+    """
+    Returns the git commit and the versions the benchmark ran with.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "pandas": pd.__version__,
+            "numpy": np.__version__, "platform": platform.platform()}
+
+
+def compare_results(baseline: dict[str, any], current: dict[str, any], threshold: float = 0.1, min_seconds: float = 0.05) -> list[str]:
+    """
+    Prints the change of every stage time and peak RSS between two result files and
+    returns the regressions: stages that became more than `threshold` slower (and at
+    least min_seconds slower), and peak RSS that grew by more than `threshold`.
+    """
+    regressions = []
+    print(f"{'stage':<16}{'baseline':>12}{'current':>12}{'change':>10}")
+    names = list(baseline["stages"]) + [name for name in current["stages"] if name not in baseline["stages"]]
+    for name in names:
+        if name not in baseline["stages"] or name not in current["stages"]:
+            print(f"{name:<16}{'-':>12}{'-':>12}{'':>10}")
+            continue
+        before, after = baseline["stages"][name]["seconds"], current["stages"][name]["seconds"]
+        change = after / before - 1 if before > 0 else 0.0
+        print(f"{name:<16}{before:>11.3f}s{after:>11.3f}s{change:>+10.1%}")
+        if change > threshold and after - before >= min_seconds:
+            regressions.append(f"{name} time {change:+.1%}")
+    before, after = baseline["peak_rss_bytes"], current["peak_rss_bytes"]
+    change = after / before - 1 if before > 0 else 0.0
+    print(f"{'peak RSS':<16}{before / 1024 ** 2:>10.1f}MB{after / 1024 ** 2:>10.1f}MB{change:>+10.1%}")
+    if change > threshold:
+        regressions.append(f"peak RSS {change:+.1%}")
+    return regressions
+
+
+def add_generator_args(parser: argparse.ArgumentParser) -> None:
+    """
+    Adds the size options of the synthetic databases to a parser.
+    """
+    parser.add_argument("--sources", type=int, default=3, help="Number of synthetic variant sources.")
+    parser.add_argument("--rows", type=int, default=100_000, help="Number of variants per synthetic source.")
+    parser.add_argument("--overlap", type=float, default=0.5, help="Fraction of each source's variants shared by all sources.")
+    parser.add_argument("--annotations", type=int, default=2, help="Number of synthetic annotation columns.")
+    parser.add_argument("--validation-rows", type=int, default=None, help="Number of variants in the synthetic validation db.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic databases.")
+
+
+def parse_args():
+    """
+    Parses the command line options of the benchmark.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the extended table build on synthetic databases.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="Generate databases (unless --dbs-dir is given), build the table and write the results.")
+    run.add_argument("--dbs-dir", default=None, help="Existing dbs directory to benchmark instead of synthetic databases.")
+    add_generator_args(run)
+    run.add_argument("--workers", type=int, default=1, help="Number of processes used to load the variant databases.")
+    run.add_argument("--backend", default="pandas", help="Execution backend of the build.")
+    run.add_argument("--output-format", default="tsv", help="Format of the saved table.")
+    run.add_argument("--output", default="benchmark.json", help="File the JSON results are written to.")
+
+    generate = subparsers.add_parser("generate", help="Only generate synthetic databases.")
+    generate.add_argument("dbs_dir", help="The directory to create.")
+    add_generator_args(generate)
+
+    compare = subparsers.add_parser("compare", help="Compare two result files. Exits with status 1 on regressions.")
+    compare.add_argument("baseline", help="Results of the reference commit.")
+    compare.add_argument("current", help="Results to check.")
+    compare.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown or memory growth reported as a regression.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "generate":
+        generate_dbs(args.dbs_dir, args.sources, args.rows, args.overlap, args.annotations, args.validation_rows, args.seed)
+    elif args.command == "run":
+        with tempfile.TemporaryDirectory(prefix="benchmark-") as work_dir:
+            params = {"workers": args.workers, "backend": args.backend, "output_format": args.output_format}
+            if args.dbs_dir is None:
+                dbs_dir = generate_dbs(os.path.join(work_dir, "dbs"), args.sources, args.rows, args.overlap,
+                                       args.annotations, args.validation_rows, args.seed)
+                params.update(sources=args.sources, rows=args.rows, overlap=args.overlap,
+                              annotations=args.annotations, validation_rows=args.validation_rows, seed=args.seed)
+            else:
+                dbs_dir = params["dbs_dir"] = args.dbs_dir
+            results = run_benchmark(dbs_dir, os.path.join(work_dir, "output"), args.workers, args.backend, args.output_format)
+        results = {"environment": get_environment(), "params": params, **results}
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        for name, stage in results["stages"].items():
+            print(f"{name}: {stage['seconds']:.3f}s ({stage['calls']} calls)")
+        print(f"Peak RSS: {results['peak_rss_bytes'] / 1024 ** 2:.1f}MB. Results written to {args.output}.")
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare_results(baseline, current, args.threshold)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+        print("No regressions.")
+
+
+if __name__ == "__main__":
+    main()
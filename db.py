@@ -1,5 +1,11 @@
+import os
+import numpy as np
 import pandas as pd
 from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterator
+from instrumentation import NULL_TRACER, Tracer
+from key_encoding import KeyEncoder
+from key_index import KeyIndex
 
 class Db(ABC):
     """
@@ -23,7 +29,11 @@ class Db(ABC):
         self.key_cols = instructions.get("key_cols")
         self.description = instructions.get("description", None)
         self.pre_processor = instructions.get("pre_processor")
+        self.chunk_size = instructions.get("chunk_size")
         self.df = None
+        self.pre_processed = False
+        self.cache = None
+        self.tracer: Tracer = NULL_TRACER
 
     def pre_process(self) -> pd.DataFrame:
         """
@@ -34,7 +44,11 @@ class Db(ABC):
         
         if not callable(self.pre_processor):
             raise ValueError("Pre-processor is not callable.")
-        self.df = self.pre_processor(self.df)
+        with self.tracer.span("pre_process", db=self.name) as span:
+            span.rows_in = len(self.df)
+            self.df = self.pre_processor(self.df)
+            span.rows_out = len(self.df)
+        self.pre_processed = True
         return self.df
 
     def get_name(self) -> str:
@@ -50,10 +64,105 @@ class Db(ABC):
         return self.description
     
     def upload_db(self) -> None:
-        if self.instructions.get("upload_function") is None:
-            self.df = pd.read_csv(self.db_path)
+        with self.tracer.span("upload_db", db=self.name) as span:
+            if self.instructions.get("upload_function") is None:
+                self.df = pd.read_csv(self.db_path, compression=get_compression(self.db_path))
+            else:
+                self.df = self.instructions["upload_function"](self.db_path)
+            span.rows_out = len(self.df)
+            span.bytes_read = os.path.getsize(self.db_path)
+        self.pre_processed = False
+
+    def upload_pre_processed(self) -> None:
+        """
+        Uploads and pre-processes the database. When a source cache is set, the
+        pre-processed frame is read from it if present and written to it otherwise.
+        """
+        if self.cache is not None:
+            df = self.cache.get(self)
+            if df is not None:
+                self.df = df
+                self.pre_processed = True
+                return
+        self.upload_db()
+        self.pre_process()
+        if self.cache is not None:
+            self.cache.put(self, self.df)
+
+    def iter_chunks(self) -> Iterator[pd.DataFrame]:
+        """
+        Streams the database as pre-processed chunks of at most chunk_size rows, so that
+        only one chunk has to be held in memory at a time.
+
+        A custom "chunk_upload_function" (called with the path and the chunk size and
+        returning an iterator of DataFrames) is used when given. Otherwise, the default
+        CSV reader is streamed, and a custom "upload_function" is loaded whole and sliced.
+        """
+        if self.chunk_size is None:
+            raise ValueError("Chunk size is not set.")
+        if not callable(self.pre_processor):
+            raise ValueError("Pre-processor is not callable.")
+
+        if self.instructions.get("chunk_upload_function") is not None:
+            chunks = self.instructions["chunk_upload_function"](self.db_path, self.chunk_size)
+        elif self.instructions.get("upload_function") is None:
+            chunks = pd.read_csv(self.db_path, chunksize=self.chunk_size, compression=get_compression(self.db_path))
         else:
-            self.df = self.instructions["upload_function"](self.db_path)
+            df = self.instructions["upload_function"](self.db_path)
+            chunks = (df.iloc[start:start + self.chunk_size] for start in range(0, len(df), self.chunk_size))
+
+        # Every chunk is read and pre-processed in its own spans, so that the spans do not
+        # stay open while the caller consumes the chunk.
+        chunks = iter(chunks)
+        bytes_read = os.path.getsize(self.db_path)
+        while True:
+            with self.tracer.span("upload_db", db=self.name) as span:
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    span.rows_out = len(chunk)
+                    span.bytes_read, bytes_read = bytes_read, 0
+            if chunk is None:
+                return
+            with self.tracer.span("pre_process", db=self.name) as span:
+                span.rows_in = len(chunk)
+                chunk = self.pre_processor(chunk)
+                span.rows_out = len(chunk)
+            yield chunk
+
+    def load_columns(self, columns: list[str] | None = None) -> pd.DataFrame:
+        """
+        Returns the given columns of the pre-processed database, uploading it (or streaming
+        it chunk by chunk when a chunk size is set) if needed. The loaded DataFrame is
+        cleared afterwards. Streamed databases bypass the source cache.
+
+        :param columns: The columns to return, or None for all columns.
+        """
+        if self.df is None and self.chunk_size is not None:
+            parts = [chunk if columns is None else chunk[columns] for chunk in self.iter_chunks()]
+            df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=columns)
+        else:
+            if self.df is None:
+                self.upload_pre_processed()
+            elif not self.pre_processed:
+                self.pre_process()
+            df = (self.df if columns is None else self.df[columns]).reset_index(drop=True)
+        self.clear()
+        return df
+
+    def clear(self) -> None:
+        """
+        Drops the loaded DataFrame to free up memory.
+        """
+        self.df = None
+        self.pre_processed = False
+
+    def set_columns(self, columns: dict[str, tuple]) -> None:
+        """
+        Sets the DataFrame from compact column arrays (see encode_columns), marking it
+        as already pre-processed.
+        """
+        self.df = decode_columns(columns)
+        self.pre_processed = True
 
     
     def get_instructions(self) -> dict[str, any]:
@@ -87,6 +196,9 @@ class ValidationDb(Db):
         """
         super().__init__(db_path, instructions)
         self.validator = instructions.get("validator", None)
+        self.rules = instructions.get("rules", None)
+        self.key_index: KeyIndex | None = None
+        self.attributes: pd.DataFrame | None = None
 
     def get_validator(self) -> dict[str, any]:
         """
@@ -110,4 +222,177 @@ class ValidationDb(Db):
         if not callable(self.validator):
             raise ValueError("Validator is not callable.")
         
-        return self.validator(self, df)
\ No newline at end of file
+        return self.validator(self, df)
+
+    def load_index(self, encoder: KeyEncoder | None = None) -> None:
+        """
+        Loads the database once into a key index, keeping only the attribute columns
+        used by its rules. Keys that appear more than once resolve to their first row.
+
+        :param encoder: The key encoder of the table, or None to hash the keys. The index is reloaded when it was built with another encoder.
+        """
+        if self.key_index is not None and self.key_index.encoder is encoder:
+            return
+        attribute_cols = get_rule_columns(self.rules)
+        df = self.load_columns(list(dict.fromkeys(self.key_cols + attribute_cols)))
+        self.key_index = KeyIndex(self.key_cols, encoder)
+        self.key_index.append(self.key_index.encode_keys(df))
+        self.attributes = df[attribute_cols]
+
+    def lookup(self, codes: np.ndarray, encoder: KeyEncoder | None = None) -> np.ndarray:
+        """
+        Returns the row of every key code in the database, or -1 for missing keys.
+
+        :param codes: Key codes of the table.
+        :param encoder: The key encoder that produced the codes, or None if they are key hashes.
+        """
+        self.load_index(encoder)
+        return self.key_index.lookup(codes)
+
+    def get_attribute(self, column: str, positions: np.ndarray) -> pd.Series:
+        """
+        Returns the values of an attribute column at the given rows, NaN where the
+        position is -1.
+
+        :param column: The attribute column.
+        :param positions: Rows as returned by lookup.
+        """
+        values = self.attributes[column].reindex(positions)
+        return values.reset_index(drop=True)
+
+
+class ValidationEngine:
+    """
+    Validates the extended table against rule-based ValidationDbs in one pass.
+
+    Rules are declared in the "rules" list of a validation db's instructions. Every rule
+    is a dict with a "type":
+    - "membership": the variant is present in the validation db.
+    - "equals": the validation db's "column" equals the table's "table_column"
+      (defaults to the same name) for the variant.
+    - "isin": the validation db's "column" is one of "values" for the variant.
+    A variant passes when it passes all rules, and the result (1 or 0) is written to the
+    validation db's indicator column. Dbs without rules fall back to their validator.
+    """
+    def __init__(self, key_index: KeyIndex) -> None:
+        """
+        Initializes a validation engine.
+
+        :param key_index: The key index of the table, whose key encoder is shared with the validation dbs.
+        """
+        self.key_index = key_index
+
+    def validate(self, table: pd.DataFrame, validation_dbs: list[ValidationDb]) -> None:
+        """
+        Validates the table against all validation dbs, writing the results in place.
+
+        :param table: The extended table, aligned with the key index.
+        :param validation_dbs: The validation dbs to check.
+        """
+        table_codes = self.key_index.get_codes()
+        for db in validation_dbs:
+            if db.rules is None:
+                db.validate(table)
+                continue
+            positions = db.lookup(table_codes, self.key_index.encoder)
+            table[db.name] = self.evaluate(db, table, positions).astype(np.uint8)
+
+    def evaluate(self, db: ValidationDb, table: pd.DataFrame, positions: np.ndarray) -> np.ndarray:
+        """
+        Evaluates the rules of a validation db for every table row.
+
+        :param db: The validation db.
+        :param table: The extended table.
+        :param positions: Row of every table variant in the validation db, -1 if missing.
+        """
+        return evaluate_rules(db, table, positions >= 0, lambda column: db.get_attribute(column, positions))
+
+
+def get_compression(db_path: str) -> str:
+    """
+    Returns the compression of a db file for pd.read_csv. bgzip files are gzip streams,
+    so ".bgz" files are read as gzip. Other extensions (".gz", ".bz2", ".zst", ...) are
+    inferred by pandas.
+    """
+    return "gzip" if db_path.endswith((".bgz", ".bgzf")) else "infer"
+
+
+def evaluate_rules(db: ValidationDb, table: pd.DataFrame, found: np.ndarray, get_attribute: Callable[[str], pd.Series]) -> np.ndarray:
+    """
+    Evaluates the rules of a validation db for every table row.
+
+    :param db: The validation db.
+    :param table: The (part of the) extended table to validate.
+    :param found: Whether every table variant is present in the validation db.
+    :param get_attribute: Returns an attribute column of the validation db, aligned with the table rows.
+    """
+    result = found.copy()
+    for rule in db.rules:
+        rule_type = rule.get("type")
+        if rule_type == "membership":
+            continue
+        elif rule_type == "equals":
+            values = get_attribute(rule["column"])
+            table_values = table[rule.get("table_column", rule["column"])].reset_index(drop=True)
+            result &= (values.reset_index(drop=True) == table_values).to_numpy()
+        elif rule_type == "isin":
+            values = get_attribute(rule["column"])
+            result &= values.isin(rule["values"]).to_numpy()
+        else:
+            raise ValueError(f"Unsupported validation rule type '{rule_type}' in '{db.name}'.")
+    return result & found
+
+
+def get_rule_columns(rules: list[dict[str, any]]) -> list[str]:
+    """
+    Returns the validation db attribute columns used by a list of rules.
+    """
+    return list(dict.fromkeys(rule["column"] for rule in rules if "column" in rule))
+
+
+def encode_columns(df: pd.DataFrame, columns: list[str]) -> dict[str, tuple]:
+    """
+    Encodes DataFrame columns into compact NumPy arrays for transfer between processes.
+    Numeric columns are kept as plain arrays, all other columns are dictionary encoded
+    into integer codes and their distinct values.
+
+    :param df: The DataFrame to encode.
+    :param columns: The columns to encode.
+    """
+    encoded = {}
+    for col in columns:
+        series = df[col]
+        if pd.api.types.is_numeric_dtype(series.dtype) and not isinstance(series.dtype, pd.CategoricalDtype):
+            encoded[col] = ("values", series.to_numpy())
+        else:
+            codes, uniques = pd.factorize(series, use_na_sentinel=False)
+            codes = codes.astype(np.min_scalar_type(max(len(uniques) - 1, 0)))
+            encoded[col] = ("codes", codes, np.asarray(uniques, dtype=object))
+    return encoded
+
+
+def decode_columns(encoded: dict[str, tuple]) -> pd.DataFrame:
+    """
+    Rebuilds a DataFrame from the output of encode_columns.
+
+    :param encoded: The encoded columns.
+    """
+    data = {}
+    for col, value in encoded.items():
+        if value[0] == "values":
+            data[col] = value[1]
+        else:
+            data[col] = value[2].take(value[1])
+    return pd.DataFrame(data)
+
+
+def load_db_columns(db: Db, columns: list[str]) -> dict[str, tuple]:
+    """
+    Uploads and pre-processes a database and returns the requested columns encoded with
+    encode_columns. Used as the process pool entry point, so only compact arrays are
+    sent back to the parent process.
+
+    :param db: The database to load.
+    :param columns: The columns to return.
+    """
+    return encode_columns(db.load_columns(columns), columns)
@@ -0,0 +1,511 @@
+import argparse
+import copy
+import multiprocessing
+import os
+import secrets
+import shutil
+import socket
+import tempfile
+import threading
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from multiprocessing.connection import Client, Connection, Listener
+import numpy as np
+import pandas as pd
+from annotation_cache import AnnotationCache
+from db import VariantsDb
+from extended_table import ExtendedTable
+from instructions_provider import InstructionsProvider
+from key_encoding import KeyEncoder, can_encode_keys
+from key_index import KeyIndex
+from sharded_build import get_shard_col, get_shard_ids
+from source_cache import SourceCache
+
+# Environment variable holding the key that workers authenticate to the coordinator with.
+AUTHKEY_ENV = "VARIANT_TABLE_AUTHKEY"
+
+
+def get_buckets(df: pd.DataFrame, shard_col: str, pos_col: str, bin_size: int | None, shards: int) -> np.ndarray:
+    """
+    Returns the shard bucket of every row: the shard id (see get_shard_ids) hashed into
+    one of `shards` buckets. The hash is stable across processes and machines, so every
+    worker puts a variant in the same bucket.
+    """
+    codes, shard_ids = pd.factorize(get_shard_ids(df, shard_col, pos_col, bin_size))
+    buckets = pd.util.hash_pandas_object(pd.Series(shard_ids, dtype=object), index=False).to_numpy() % np.uint64(shards)
+    return buckets.astype(np.int64)[codes]
+
+
+def write_atomic(df: pd.DataFrame, path: str) -> None:
+    """
+    Pickles a DataFrame through a temporary file, so that a worker that dies while
+    writing never leaves a partial file behind.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{socket.gethostname()}-{os.getpid()}.tmp"
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+
+
+class DistributedWorker:
+    """
+    Runs the work units of a distributed build, on any machine that sees the dbs
+    directory and the shared work directory under the same (or a given) path.
+
+    - A "map" unit (source, bucket) merges the rows of one variant db that fall into one
+      shard bucket into a partial table: the keys, the db's indicator and the annotations
+      of its new variants. The last loaded db is kept, so consecutive units of the same
+      db read it only once.
+    - A "reduce" unit (bucket) merges the partial tables of a bucket in db order (the
+      first db of a variant annotates it, the indicators of all dbs are kept), validates
+      the result and writes the shard table.
+    """
+    def __init__(self, job: dict[str, any], dbs_dir: str | None = None) -> None:
+        """
+        Initializes a worker for a build.
+
+        :param job: The build description sent by the coordinator.
+        :param dbs_dir: Path of the dbs directory on this machine, if it differs from the coordinator's.
+        """
+        self.job = job
+        self.instructions_provider = InstructionsProvider(dbs_dir if dbs_dir is not None else job["dbs_dir"])
+        source_cache = SourceCache(job["cache_dir"], job["cache_max_bytes"]) if job["cache_dir"] is not None else None
+        self.variant_dbs = [self.instructions_provider.create_db_instance(name) for name in job["sources"]]
+        self.validation_dbs = [self.instructions_provider.create_db_instance(name, "validation") for name in job["validation_sources"]]
+        for db in self.variant_dbs + self.validation_dbs:
+            if db is None:
+                raise ValueError("A database of the build could not be created on this worker.")
+            db.cache = source_cache
+        # Shared by the shard tables of this worker, so validation dbs are indexed once.
+        self.key_encoder = (KeyEncoder(job["key_cols"], job["chrom_col"], job["pos_col"])
+                            if can_encode_keys(job["key_cols"], job["chrom_col"], job["pos_col"]) else None)
+        self.loaded: tuple[int, pd.DataFrame] | None = None
+
+    def run_unit(self, unit: tuple, payload: any) -> str | None:
+        """
+        Runs a work unit and returns the path of the table it wrote, or None when the
+        unit has no rows.
+        """
+        if unit[0] == "map":
+            return self.run_map(unit[1], unit[2])
+        elif unit[0] == "reduce":
+            return self.run_reduce(unit[1], payload)
+        raise ValueError(f"Unsupported work unit {unit}.")
+
+    def create_table(self, variant_dbs: list[VariantsDb], validation_dbs: list, compact: bool) -> ExtendedTable:
+        return ExtendedTable(
+            key_cols=self.job["key_cols"],
+            instructions_provider=self.instructions_provider,
+            variant_dbs=variant_dbs,
+            validation_dbs=validation_dbs,
+            ann_cols=self.job["ann_cols"],
+            annotation_cache=AnnotationCache(self.job["annotation_cache_dir"]),
+            compact=compact,
+            chrom_col=self.job["chrom_col"],
+            pos_col=self.job["pos_col"],
+        )
+
+    def load_source(self, source: int) -> pd.DataFrame:
+        """
+        Returns the pre-processed input columns of a variant db with a "_bucket" column.
+        """
+        if self.loaded is None or self.loaded[0] != source:
+            self.loaded = None
+            db = self.variant_dbs[source]
+            df = db.load_columns(self.create_table([db], [], False).get_input_cols(db))
+            df["_bucket"] = get_buckets(df, self.job["shard_col"], self.job["pos_col"], self.job["bin_size"], self.job["shards"])
+            self.loaded = (source, df)
+        return self.loaded[1]
+
+    def run_map(self, source: int, bucket: int) -> str | None:
+        db = self.variant_dbs[source]
+        df = self.load_source(source)
+        rows = df[df["_bucket"].to_numpy() == bucket]
+        if rows.empty:
+            return None
+        unit_db = copy.copy(db)
+        unit_db.df = rows.drop(columns=["_bucket"]).reset_index(drop=True)
+        unit_db.pre_processed = True
+        partial_table = self.create_table([unit_db], [], False)
+        partial_table.merge_all_dbs()
+        path = os.path.join(self.job["work_dir"], f"bucket-{bucket}", f"variants-{source}.pkl")
+        write_atomic(partial_table.table, path)
+        return path
+
+    def run_reduce(self, bucket: int, partial_paths: list[str | None]) -> str | None:
+        key_cols, ann_cols = self.job["key_cols"], self.job["ann_cols"]
+        frames = [(source, pd.read_pickle(path)) for source, path in enumerate(partial_paths) if path is not None]
+        if not frames:
+            return None
+        all_rows = pd.concat([df.reindex(columns=key_cols + ann_cols) for _, df in frames], ignore_index=True)
+        source_ids = np.repeat([source for source, _ in frames], [len(df) for _, df in frames])
+        del frames
+
+        # Deduplicate the keys: the first row of a key (in db order) keeps its annotations
+        # and every db the key appears in sets its indicator.
+        key_index = KeyIndex(key_cols, self.key_encoder)
+        row_ids, _ = pd.factorize(key_index.encode_keys(all_rows))
+        first_rows = np.flatnonzero(~pd.Series(row_ids).duplicated().to_numpy())
+        indicators = np.zeros((len(first_rows), len(self.variant_dbs)), dtype=np.uint8)
+        indicators[row_ids, source_ids] = 1
+        table = all_rows.iloc[first_rows].reset_index(drop=True)
+        for source, db in enumerate(self.variant_dbs):
+            table[db.name] = indicators[:, source]
+        for db in self.validation_dbs:
+            table[db.name] = 0
+
+        shard_table = self.create_table(self.variant_dbs, self.validation_dbs, self.job["compact"])
+        shard_table.key_index = KeyIndex(key_cols, self.key_encoder)
+        shard_table.table = table[key_cols + [db.name for db in self.variant_dbs + self.validation_dbs] + ann_cols]
+        shard_table.key_index.rebuild(shard_table.table)
+        if self.job["compact"]:
+            shard_table.compact_table()
+        shard_table.validate_table()
+        if self.job["output_dir"] is not None:
+            path = os.path.join(self.job["output_dir"], f"bucket-{bucket}.{self.job['output_format']}")
+            shard_table.save_table(path, self.job["output_format"])
+        else:
+            path = os.path.join(self.job["work_dir"], f"bucket-{bucket}", "table.pkl")
+            write_atomic(shard_table.table, path)
+        return path
+
+
+class Coordinator:
+    """
+    Hands the work units of a distributed build to workers over authenticated
+    multiprocessing connections (TCP sockets carrying pickled messages).
+
+    Protocol, per worker connection:
+    - worker: ("hello", name), coordinator: ("config", job), worker: ("ready",)
+    - then repeatedly coordinator: ("unit", unit, payload) and worker: ("done", unit, path)
+      or ("failed", unit, traceback), with ("heartbeat",) messages while the unit runs,
+    - until coordinator: ("stop",).
+
+    A unit whose worker disconnects or stops sending heartbeats for heartbeat_timeout
+    seconds is handed to another worker, as is a failed unit, up to max_attempts times.
+    The reduce unit of a bucket becomes ready when all its map units are done.
+    """
+    def __init__(self, job: dict[str, any], authkey: bytes, heartbeat_timeout: float = 60.0, max_attempts: int = 3) -> None:
+        """
+        Initializes a coordinator.
+
+        :param job: The build description sent to the workers.
+        :param authkey: The key workers must authenticate with.
+        :param heartbeat_timeout: Seconds without a message after which a worker running a unit is considered lost.
+        :param max_attempts: Number of times a unit is tried before the build fails.
+        """
+        self.job = job
+        self.authkey = authkey
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = max_attempts
+        sources, buckets = len(job["sources"]), job["shards"]
+        self.pending: deque = deque(("map", source, bucket) for source in range(sources) for bucket in range(buckets))
+        self.attempts: dict[tuple, int] = {}
+        self.partials: dict[int, list[str | None]] = {bucket: [None] * sources for bucket in range(buckets)}
+        self.maps_left: dict[int, int] = {bucket: sources for bucket in range(buckets)}
+        self.results: dict[int, str | None] = {}
+        self.error: str | None = None
+        self.condition = threading.Condition()
+        self.listener: Listener | None = None
+        if sources == 0:
+            self.pending.extend(("reduce", bucket) for bucket in range(buckets))
+
+    @property
+    def finished(self) -> bool:
+        return len(self.results) == self.job["shards"]
+
+    def start(self, address: tuple[str, int]) -> tuple[str, int]:
+        """
+        Starts listening for workers in the background and returns the bound address.
+        """
+        self.listener = Listener(address, family="AF_INET", authkey=self.authkey)
+        threading.Thread(target=self._accept, name="coordinator-accept", daemon=True).start()
+        return self.listener.address
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """
+        Waits until the build is finished or failed (raising RuntimeError). Returns False
+        if the timeout elapsed first.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.finished or self.error is not None, timeout)
+            if self.error is not None:
+                raise RuntimeError(self.error)
+            return self.finished
+
+    def close(self) -> None:
+        with self.condition:
+            if not self.finished and self.error is None:
+                self.error = "The coordinator was closed."
+            self.condition.notify_all()
+        if self.listener is not None:
+            self.listener.close()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                return
+            except Exception as e:
+                # e.g. a client with the wrong key.
+                print(f"Rejected a worker connection: {e}")
+                continue
+            threading.Thread(target=self._serve, args=(conn,), name="coordinator-worker", daemon=True).start()
+
+    def _next_unit(self, last_source: int | None) -> tuple | None:
+        """
+        Waits for a ready unit, preferring map units of the db the worker loaded last.
+        Returns None once the build is finished or failed.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending or self.finished or self.error is not None)
+            if self.finished or self.error is not None:
+                return None
+            unit = next((unit for unit in self.pending if unit[0] == "map" and unit[1] == last_source), self.pending[0])
+            self.pending.remove(unit)
+            self.attempts[unit] = self.attempts.get(unit, 0) + 1
+            return unit
+
+    def _complete(self, unit: tuple, path: str | None) -> None:
+        with self.condition:
+            if unit[0] == "map":
+                _, source, bucket = unit
+                self.partials[bucket][source] = path
+                self.maps_left[bucket] -= 1
+                if self.maps_left[bucket] == 0:
+                    self.pending.append(("reduce", bucket))
+            else:
+                self.results[unit[1]] = path
+            self.condition.notify_all()
+
+    def _retry(self, unit: tuple, reason: str) -> None:
+        with self.condition:
+            if self.attempts[unit] >= self.max_attempts:
+                self.error = f"Work unit {unit} failed {self.attempts[unit]} times. Last error: {reason}"
+            else:
+                print(f"Work unit {unit} is reassigned: {reason}")
+                self.pending.appendleft(unit)
+            self.condition.notify_all()
+
+    def _serve(self, conn: Connection) -> None:
+        name, unit, last_source = "unknown", None, None
+        try:
+            _, name = conn.recv()
+            conn.send(("config", self.job))
+            conn.recv()
+            print(f"Worker '{name}' connected.")
+            while True:
+                unit = self._next_unit(last_source)
+                if unit is None:
+                    conn.send(("stop",))
+                    return
+                payload = self.partials[unit[1]] if unit[0] == "reduce" else None
+                conn.send(("unit", unit, payload))
+                while True:
+                    if not conn.poll(self.heartbeat_timeout):
+                        raise TimeoutError(f"no heartbeat for {self.heartbeat_timeout} seconds")
+                    message = conn.recv()
+                    if message[0] != "heartbeat":
+                        break
+                if message[0] == "done":
+                    self._complete(unit, message[2])
+                    last_source = unit[1] if unit[0] == "map" else last_source
+                else:
+                    self._retry(unit, f"worker '{name}' raised:\n{message[2]}")
+                unit = None
+        except (EOFError, OSError, TimeoutError) as e:
+            if unit is not None:
+                self._retry(unit, f"worker '{name}' was lost ({str(e) or type(e).__name__}).")
+        finally:
+            conn.close()
+
+
+@contextmanager
+def send_heartbeats(conn: Connection, lock: threading.Lock, interval: float):
+    """
+    Sends heartbeat messages on a connection from a background thread while a block runs.
+    """
+    stop = threading.Event()
+
+    def beat() -> None:
+        while not stop.wait(interval):
+            try:
+                with lock:
+                    conn.send(("heartbeat",))
+            except OSError:
+                return
+
+    thread = threading.Thread(target=beat, name="worker-heartbeat", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_worker(address: tuple[str, int], authkey: bytes, dbs_dir: str | None = None, name: str | None = None) -> None:
+    """
+    Connects to a coordinator and runs the work units it assigns until it stops the worker.
+
+    :param address: The coordinator's (host, port).
+    :param authkey: The coordinator's key.
+    :param dbs_dir: Path of the dbs directory on this machine, if it differs from the coordinator's.
+    :param name: Name of the worker in the coordinator's messages.
+    """
+    conn = Client(address, family="AF_INET", authkey=authkey)
+    lock = threading.Lock()
+    try:
+        conn.send(("hello", name if name is not None else f"{socket.gethostname()}:{os.getpid()}"))
+        _, job = conn.recv()
+        worker = DistributedWorker(job, dbs_dir)
+        conn.send(("ready",))
+        while True:
+            message = conn.recv()
+            if message[0] == "stop":
+                return
+            _, unit, payload = message
+            with send_heartbeats(conn, lock, job["heartbeat_interval"]):
+                try:
+                    reply = ("done", unit, worker.run_unit(unit, payload))
+                except Exception:
+                    reply = ("failed", unit, traceback.format_exc())
+            with lock:
+                conn.send(reply)
+    except EOFError:
+        print("The coordinator closed the connection.")
+    finally:
+        conn.close()
+
+
+def build_distributed(extended_table: ExtendedTable, local_workers: int = 1, address: tuple[str, int] = ("localhost", 0), authkey: bytes | None = None, shards: int | None = None, shard_col: str | None = None, bin_size: int | None = None, work_dir: str | None = None, output_dir: str | None = None, output_format: str = "tsv", heartbeat_timeout: float = 60.0, max_attempts: int = 3) -> None:
+    """
+    Builds the extended table with a coordinator in this process and workers in local
+    processes and/or on other machines (see run_worker and the "worker" command of this
+    module).
+
+    Variants are split into shard buckets by a stable hash of their shard id (chromosome,
+    or chromosome and position bin). Every (db, bucket) pair is a map unit and every
+    bucket a reduce unit, see DistributedWorker. Remote workers need the dbs directory
+    and the work directory (and output_dir) on a shared filesystem. Local workers that
+    crash are restarted, and the units of lost workers are handed to other workers.
+    When output_dir is given, every bucket is saved there as
+    "bucket-<i>.<output_format>"; otherwise the buckets are concatenated into
+    extended_table.table.
+
+    :param extended_table: The table to build, with its dbs registered.
+    :param local_workers: Number of worker processes started on this machine.
+    :param address: Address the coordinator listens on. Use ("0.0.0.0", port) for remote workers.
+    :param authkey: Key of the worker connections (defaults to the VARIANT_TABLE_AUTHKEY environment variable, or a random key for local workers only).
+    :param shards: Number of shard buckets (defaults to 4 per local worker).
+    :param shard_col: The column to shard by (defaults to the chromosome column).
+    :param bin_size: Optional position bin size, to split chromosomes further.
+    :param work_dir: Shared directory for the partial tables (defaults to a new temporary directory).
+    :param output_dir: Directory for the bucket outputs, or None to concatenate them.
+    :param output_format: Format of the bucket outputs, one of the save_table formats.
+    :param heartbeat_timeout: Seconds without news from a worker running a unit before the unit is reassigned.
+    :param max_attempts: Number of times a unit is tried before the build fails.
+    """
+    shard_col = get_shard_col(extended_table, shard_col, bin_size)
+    if authkey is None:
+        authkey = os.environ[AUTHKEY_ENV].encode() if AUTHKEY_ENV in os.environ else secrets.token_bytes(32)
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    own_work_dir = work_dir is None
+    work_dir = tempfile.mkdtemp(prefix="distributed-", dir=output_dir) if own_work_dir else work_dir
+    source_cache = extended_table.variant_dbs[0].cache if extended_table.variant_dbs else None
+    job = {
+        "dbs_dir": os.path.abspath(extended_table.instructions_provider.dbs_path),
+        "sources": [db.name for db in extended_table.variant_dbs],
+        "validation_sources": [db.name for db in extended_table.validation_dbs],
+        "key_cols": extended_table.key_cols,
+        "ann_cols": extended_table.ann_cols,
+        "compact": extended_table.compact,
+        "chrom_col": extended_table.chrom_col,
+        "pos_col": extended_table.pos_col,
+        "shard_col": shard_col,
+        "bin_size": bin_size,
+        "shards": shards if shards is not None else 4 * max(local_workers, 1),
+        "work_dir": os.path.abspath(work_dir),
+        "output_dir": os.path.abspath(output_dir) if output_dir is not None else None,
+        "output_format": output_format,
+        "annotation_cache_dir": extended_table.annotation_cache.cache_dir,
+        "cache_dir": source_cache.cache_dir if source_cache is not None else None,
+        "cache_max_bytes": source_cache.max_bytes if source_cache is not None else None,
+        "heartbeat_interval": heartbeat_timeout / 4,
+    }
+
+    coordinator = Coordinator(job, authkey, heartbeat_timeout, max_attempts)
+    processes: list[multiprocessing.Process] = []
+    try:
+        bound_address = coordinator.start(address)
+        print(f"Coordinator listening on {bound_address[0]}:{bound_address[1]} with {job['shards']} shard buckets.")
+        connect_address = ("localhost", bound_address[1])
+        for i in range(local_workers):
+            processes.append(multiprocessing.Process(target=run_worker, args=(connect_address, authkey, None, f"local-{i}")))
+            processes[-1].start()
+        restarts = 0
+        while not coordinator.wait(timeout=1.0):
+            # Replace local workers that died without being stopped.
+            for i, process in enumerate(processes):
+                if not process.is_alive() and process.exitcode != 0:
+                    restarts += 1
+                    if restarts > max_attempts * local_workers:
+                        raise RuntimeError(f"Local workers crashed {restarts} times, the last one with exit code {process.exitcode}.")
+                    print(f"Local worker {i} exited with code {process.exitcode}, restarting it.")
+                    processes[i] = multiprocessing.Process(target=run_worker, args=(connect_address, authkey, None, f"local-{i}"))
+                    processes[i].start()
+        for process in processes:
+            process.join()
+
+        paths = [coordinator.results[bucket] for bucket in range(job["shards"]) if coordinator.results[bucket] is not None]
+        if output_dir is None:
+            tables = [pd.read_pickle(path) for path in paths]
+            extended_table.table = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+            if extended_table.table.empty:
+                extended_table.create_basic_table()
+            extended_table.key_index.rebuild(extended_table.table)
+            if extended_table.compact:
+                extended_table.compact_table()
+            for db in extended_table.variant_dbs:
+                extended_table.record_source(db)
+            print(f"Distributed build finished: {len(extended_table.table)} variants in {len(paths)} shard buckets.")
+        else:
+            print(f"Distributed build finished: {len(paths)} shard buckets saved to {output_dir}.")
+    finally:
+        coordinator.close()
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        if own_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    """
+    Parses a "host:port" address.
+    """
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Invalid address '{address}'. Expected host:port.")
+    return host, int(port)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Worker of a distributed extended table build. The key is read from the VARIANT_TABLE_AUTHKEY environment variable.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    worker_parser = subparsers.add_parser("worker", help="Run work units for a coordinator.")
+    worker_parser.add_argument("address", help="The coordinator's host:port.")
+    worker_parser.add_argument("--dbs-dir", default=None,
+                               help="Path of the dbs directory on this machine, if it differs from the coordinator's.")
+    worker_parser.add_argument("--name", default=None, help="Name of the worker in the coordinator's messages.")
+    args = parser.parse_args()
+    if AUTHKEY_ENV not in os.environ:
+        parser.error(f"The {AUTHKEY_ENV} environment variable is not set.")
+    run_worker(parse_address(args.address), os.environ[AUTHKEY_ENV].encode(), args.dbs_dir, args.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,71 @@
+import json
+import os
+import numpy as np
 import pandas as pd
-from db import Db, VariantsDb, ValidationDb
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from db import Db, VariantsDb, ValidationDb, ValidationEngine, load_db_columns
 from instructions_provider import InstructionsProvider
+from instrumentation import Tracer
+from annotation_cache import AnnotationCache
+from annotation_scheduler import AnnotationScheduler
+from backends import ExecutionBackend, create_backend
+from key_encoding import KeyEncoder, can_encode_keys
+from key_index import KeyIndex
+from prefetch import prefetch_dbs, prefetch_iter
+from source_cache import SourceCache, source_fingerprint
+from table_buffers import TableBuffers
+from table_io import TableStore, write_arrow, write_bgzip_tsv, write_parquet
+
+SAVE_FORMATS = ["csv", "tsv", "xlsx", "tsv.bgz", "parquet", "arrow"]
+# Formats sorted (and partitioned) by region, which need the chromosome and position columns.
+REGION_FORMATS = ["tsv.bgz", "parquet", "arrow"]
+# Excel sheets hold at most 1,048,576 rows, including the header row.
+EXCEL_MAX_ROWS = 1_048_576
 
 
 class ExtendedTable:
-    def __init__(self ,key_cols: list[str], instructions_provider: InstructionsProvider, variant_dbs: list[VariantsDb] | None = None, validation_dbs: list[ValidationDb] | None = None, ann_cols: list[str] | None = None) -> None:
+    def __init__(self ,key_cols: list[str], instructions_provider: InstructionsProvider, variant_dbs: list[VariantsDb] | None = None, validation_dbs: list[ValidationDb] | None = None, ann_cols: list[str] | None = None, merge_strategy: str = "sequential", workers: int = 1, source_cache: SourceCache | None = None, annotation_cache: AnnotationCache | None = None, annotation_workers: int = 1, compact: bool = True, chrom_col: str | None = None, pos_col: str | None = None, backend: ExecutionBackend | str = "pandas", tracer: Tracer | None = None, prefetch: int = 0) -> None:
         self.table: pd.DataFrame = pd.DataFrame()
         self.key_cols: list[str] = key_cols
         self.instructions_provider: InstructionsProvider = instructions_provider
         self.variant_dbs: list[VariantsDb] = variant_dbs if variant_dbs is not None else []
         self.validation_dbs: list[ValidationDb] = validation_dbs if validation_dbs is not None else []
         self.ann_cols: list[str] = ann_cols if ann_cols is not None else []
+        self.merge_strategy: str = merge_strategy
+        self.workers: int = workers
+        # Number of sources (or chunks of a streamed source) read ahead of the merge.
+        self.prefetch: int = prefetch
+        self.source_cache: SourceCache | None = source_cache
+        self.manifest: dict[str, any] = self._new_manifest()
+        self.tracer: Tracer = tracer if tracer is not None else Tracer()
+        self.annotation_cache: AnnotationCache = annotation_cache if annotation_cache is not None else AnnotationCache()
+        self.annotation_scheduler: AnnotationScheduler = AnnotationScheduler(annotation_workers, self.annotation_cache, self.tracer)
+        self.compact: bool = compact
+        # Region columns used by the sorted/partitioned output formats, found by name unless
+        # given. Without them, keys are hashed and region formats are not available.
+        self.chrom_col: str | None = chrom_col if chrom_col is not None else ("chrom" if "chrom" in key_cols else None)
+        self.pos_col: str | None = pos_col if pos_col is not None else ("pos" if "pos" in key_cols else None)
+        # chrom/pos/ref/alt keys are packed into exact integer codes, other keys are hashed.
+        encoder = KeyEncoder(key_cols, self.chrom_col, self.pos_col) if can_encode_keys(key_cols, self.chrom_col, self.pos_col) else None
+        self.key_index: KeyIndex = KeyIndex(key_cols, encoder)
+        self.store: TableStore | None = None
+        self.buffers: TableBuffers | None = None
+        self.backend: ExecutionBackend = create_backend(backend) if isinstance(backend, str) else backend
+        for db in self.variant_dbs + self.validation_dbs:
+            db.tracer = self.tracer
+            if source_cache is not None:
+                db.cache = source_cache
 
     def upload_table(self, file_path: str) -> None:
         """
         Uploads a table from a file path.
         """
         self.table = pd.read_csv(file_path)
+        self.key_index.rebuild(self.table)
+        self.manifest = self._new_manifest()
+        if self.compact:
+            self.compact_table()
         print(f"Table uploaded from {file_path}.")
 
     def create_basic_table(self) -> None:
@@ -26,6 +75,8 @@ class ExtendedTable:
         variants_dbs_names = list(map(lambda x: x.name, self.variant_dbs))
         validation_dbs_names = list(map(lambda x: x.name, self.validation_dbs))
         self.table = pd.DataFrame(columns=self.key_cols + variants_dbs_names + validation_dbs_names + self.ann_cols)
+        self.key_index.rebuild(self.table)
+        self.manifest = self._new_manifest()
         print("Basic table created with key columns.")
         print(f"Table columns: {self.table.columns}")
 
@@ -34,6 +85,9 @@ class ExtendedTable:
         """
         Adds a database to the list of databases.
         """
+        if self.source_cache is not None:
+            db.cache = self.source_cache
+        db.tracer = self.tracer
         if isinstance(db, VariantsDb):
             self.variant_dbs.append(db)
             print(f"Variant database {db.name} added.")
@@ -45,7 +99,13 @@ class ExtendedTable:
         
     def merge_db(self, db: Db) -> None:
         """
-        Merges a VariantsDb into the extended table by splitting its variants into:
+        Merges a VariantsDb into the extended table using the execution backend.
+        """
+        self.backend.merge_db(self, db)
+
+    def pandas_merge_db(self, db: Db) -> None:
+        """
+        Merges a VariantsDb into the in-memory extended table by splitting its variants into:
         - Existing variants: those already in the extended table.
         - New variants: those not present in the extended table.
         
@@ -55,13 +115,6 @@ class ExtendedTable:
         if not isinstance(db, VariantsDb):
             raise ValueError("Only VariantsDb can be merged into the extended table.")
         
-
-        if db.df is None:
-            db.upload_db()
-        
-        # Pre-process the db to get a standardized DataFrame.
-        db.pre_process()
-        
         # Define the indicator column name for this database.
         indicator_col: str = db.name
         
@@ -69,80 +122,479 @@ class ExtendedTable:
         # If the extended table is empty, then all rows from db.df are new.
         if self.table.empty:
             self.create_basic_table()
-            
-        # Ensure the indicator column exists in the extended table.
-        if indicator_col not in self.table.columns:
-            self.table[indicator_col] = 0
-
-        # Use a left merge (with indicator) to identify which rows in db.df are already present.
-        merge_df = pd.merge(
-            db.df[db.key_cols],
-            self.table[self.key_cols],
-            on=self.key_cols,
-            how='left',
-            indicator=True
-        )
-        
-        # 'both' indicates rows already in self.table; 'left_only' are new variants.
-        existing_df = merge_df[merge_df['_merge'] == 'both']
-        new_df = merge_df[merge_df['_merge'] == 'left_only'].drop(columns=['_merge'])
-        
-        # Update the indicator column for existing variants.
-        # Build a set of keys (tuples) for the existing variants.
-        existing_keys = {tuple(row) for row in existing_df[self.key_cols].to_numpy()}
-        # Create a boolean mask for self.table rows whose key is in the existing_keys set.
-        mask = self.table[self.key_cols].apply(lambda row: tuple(row) in existing_keys, axis=1)
-        self.table.loc[mask, indicator_col] = 1
-        
+
+        with self.tracer.span("merge_db", db=db.name) as span:
+            # New rows are appended into the table buffers, which hold the table with spare
+            # capacity, so the table is not copied by every merge.
+            buffers = self.get_buffers()
+            table_rows = len(buffers)
+            # Ensure the indicator column exists in the extended table.
+            if indicator_col not in buffers:
+                buffers.add_column(indicator_col)
+
+            # Streaming dbs are consumed chunk by chunk, all others as one pre-processed
+            # frame of the key and annotation input columns, which frees the db frame.
+            if db.df is None and db.chunk_size is not None:
+                frames = prefetch_iter(db.iter_chunks(), self.prefetch) if self.prefetch > 0 else db.iter_chunks()
+            else:
+                frames = [db.load_columns(self.get_input_cols(db))]
+
+            existing_count = 0
+            span.rows_in = 0
+            for df in frames:
+                span.rows_in += len(df)
+                existing_count += self._merge_frame(db, df, table_rows)
+                del df
+            new_count = len(buffers) - table_rows
+            self.table = buffers.to_frame()
+
+            span.rows_out = new_count
+            self.record_source(db)
+            print(f"Database '{db.name}' merged: {existing_count} existing variants updated and {new_count} new variants added.")
+        # Clear the DataFrame in the db instance to free up memory.
+        db.clear()
+
+    def get_buffers(self) -> TableBuffers:
+        """
+        Returns the table buffers, synchronized with self.table: columns that were
+        replaced or changed since the buffers last produced self.table are copied in again.
+        """
+        if self.buffers is None:
+            indicator_cols = [db.name for db in self.variant_dbs + self.validation_dbs]
+            self.buffers = (TableBuffers(self.key_cols, indicator_cols, downcast=True) if self.compact
+                            else TableBuffers())
+        self.buffers.sync(self.table)
+        return self.buffers
+
+    def _merge_frame(self, db: VariantsDb, df: pd.DataFrame, table_rows: int) -> int:
+        """
+        Merges a (chunk of a) pre-processed db frame into the table buffers: sets the
+        indicator of the variants already in the table and appends the annotated new ones.
+        Returns the number of variants that were in the table before the db was merged.
+
+        The keys of the new variants are added to the key index right away, so later chunks
+        of the same db see them as existing.
+
+        :param table_rows: Number of table rows before the db was merged.
+        """
+        indicator_col: str = db.name
+
+        # Look up every db key in the persistent key index (-1 marks keys not in the table).
+        db_codes = self.key_index.encode_keys(df)
+        positions = self.key_index.lookup(db_codes)
+        is_existing = positions >= 0
+
+        # Update the indicator column for existing variants. Rows added by earlier chunks
+        # of this db already have it set.
+        existing_positions = positions[is_existing]
+        self.buffers.set_values(indicator_col, existing_positions, 1)
+
+        # New variants are deduplicated, so every key is appended to the table only once.
+        new_codes = pd.Series(db_codes[~is_existing])
+        is_first = ~new_codes.duplicated().to_numpy()
+        new_df = df.loc[~is_existing, self.get_input_cols(db)][is_first].reset_index(drop=True)
+        self.key_index.append(new_codes.to_numpy()[is_first])
+
         # For new variants, compute annotation values and set the indicator.
         new_df[indicator_col] = 1
 
-        for ann_col in self.ann_cols:
-            db.instructions["annotations"][ann_col]["compute_function"](new_df)
-        
-        # Align new_df with self.table (ensuring all expected columns are present).
-        new_df = new_df.reindex(columns=self.table.columns, fill_value=0)
-        
-        # Append the new variants to the extended table.
-        self.table = pd.concat([self.table, new_df], ignore_index=True)
-        
-        print(f"Database '{db.name}' merged: {len(existing_df)} existing variants updated and {len(new_df)} new variants added.")
-        # Clear the DataFrame in the db instance to free up memory.
-        db.df = None
+        self.annotate(db, new_df)
+        self.buffers.append(new_df)
+        return int(np.count_nonzero(existing_positions < table_rows))
+
+    def get_input_cols(self, db: VariantsDb) -> list[str]:
+        """
+        Returns the db columns needed to merge and annotate its variants: the key columns
+        followed by any other input columns declared by the annotations.
+        """
+        input_cols = list(self.key_cols)
+        for col in self.annotation_scheduler.get_input_cols(db.instructions["annotations"], self.ann_cols):
+            if col not in input_cols:
+                input_cols.append(col)
+        return input_cols
+
+    def annotate(self, db: VariantsDb, new_df: pd.DataFrame) -> None:
+        """
+        Computes the annotation columns for new variants in place, using the
+        compute functions from the instructions of the db that introduced them.
+        Annotations run in dependency order through the annotation scheduler, and the
+        ones that declare their "inputs" are computed once per distinct input tuple.
+        """
+        with self.tracer.span("annotate", db=db.name) as span:
+            span.rows_in = span.rows_out = len(new_df)
+            self.annotation_scheduler.run(db.instructions["annotations"], self.ann_cols, new_df)
+
+    def load_all_dbs(self) -> None:
+        """
+        Uploads and pre-processes all registered VariantsDbs concurrently on a process pool
+        with self.workers workers. Workers send back only the key and annotation input
+        columns as compact arrays, which are set on each db so that the (serial) merge step
+        can consume them. Dbs with a chunk_size are left to be streamed by the merge, so
+        they are never held in memory whole.
+        """
+        pending = [db for db in self.variant_dbs if db.df is None and db.chunk_size is None]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(load_db_columns, db, self.get_input_cols(db)) for db in pending]
+            for db, future in zip(pending, futures):
+                # Spans of the worker processes are not collected, so record the wait.
+                with self.tracer.span("load_db", db=db.name) as span:
+                    db.set_columns(future.result())
+                    span.rows_out = len(db.df)
+                print(f"Database '{db.name}' loaded and pre-processed.")
+
+    def iter_loaded_dbs(self) -> Iterator[VariantsDb]:
+        """
+        Yields the registered VariantsDbs in order. With prefetch > 0, the next sources are
+        read, decompressed and pre-processed on background threads while the current one
+        is merged, with at most self.prefetch sources loaded ahead.
+        """
+        if self.prefetch > 0:
+            yield from prefetch_dbs(self.variant_dbs, self.prefetch)
+        else:
+            yield from self.variant_dbs
 
     def merge_all_dbs(self) -> None:
         """
-        Merges all registered VariantsDbs into the extended table.
+        Merges all registered VariantsDbs into the extended table using the execution backend.
         """
-        for db in self.variant_dbs:
-            self.merge_db(db)
+        with self.tracer.span("merge_all_dbs") as span:
+            self.backend.merge_all_dbs(self)
+            span.rows_out = len(self.table)
         print("All databases merged into the extended table.")
 
+    def pandas_merge_all_dbs(self) -> None:
+        """
+        Merges all registered VariantsDbs into the in-memory extended table, using the
+        configured merge strategy ("sequential" or "single_pass").
+        """
+        if self.workers > 1:
+            self.load_all_dbs()
+        if self.merge_strategy == "sequential":
+            for db in self.iter_loaded_dbs():
+                self.pandas_merge_db(db)
+        elif self.merge_strategy == "single_pass":
+            self.merge_all_dbs_single_pass()
+        else:
+            raise ValueError(f"Unsupported merge strategy '{self.merge_strategy}'. Supported strategies are: sequential, single_pass.")
+
+    def merge_all_dbs_single_pass(self) -> None:
+        """
+        Merges all registered VariantsDbs in a single pass.
+
+        The key frames of all sources are collected first, the union of keys and the
+        per-source indicator matrix are built from them at once, and the final table is
+        materialized with a single concat. Rows already in the table keep their positions,
+        and new variants are annotated by the first db that contains them, exactly like
+        repeated merge_db calls would do.
+        """
+        if any(not isinstance(db, VariantsDb) for db in self.variant_dbs):
+            raise ValueError("Only VariantsDb can be merged into the extended table.")
+        if self.table.empty:
+            self.create_basic_table()
+
+        indicator_cols: list[str] = [db.name for db in self.variant_dbs]
+        for indicator_col in indicator_cols:
+            if indicator_col not in self.table.columns:
+                self.table[indicator_col] = 0
+
+        # Collect the pre-processed key frames and their key codes from every source.
+        # Only the keys and annotation inputs are kept, each db frame is cleared as soon
+        # as they are extracted.
+        key_frames: list[pd.DataFrame] = []
+        code_arrays: list[np.ndarray] = []
+        for db in self.iter_loaded_dbs():
+            keys = db.load_columns(self.get_input_cols(db))
+            key_frames.append(keys)
+            code_arrays.append(self.key_index.encode_keys(keys))
+
+        all_codes = np.concatenate(code_arrays) if code_arrays else np.empty(0, dtype=np.uint64)
+        source_ids = np.repeat(np.arange(len(self.variant_dbs)), [len(c) for c in code_arrays])
+
+        # Resolve every input row to its row in the final table: existing rows keep their
+        # position and new keys are numbered in order of first appearance.
+        existing_count = len(self.table)
+        row_positions = self.key_index.lookup(all_codes)
+        is_new = row_positions < 0
+        new_ids, new_codes = pd.factorize(all_codes[is_new])
+        row_positions[is_new] = existing_count + new_ids
+
+        # Per-source indicator matrix over the union of keys.
+        indicators = np.zeros((existing_count + len(new_codes), len(self.variant_dbs)), dtype=np.uint8)
+        indicators[row_positions, source_ids] = 1
+
+        # The first occurrence of each new key provides its key values and annotating db.
+        new_rows = np.flatnonzero(is_new)[~pd.Series(new_ids).duplicated().to_numpy()]
+        first_sources = source_ids[new_rows]
+        all_keys = pd.concat(key_frames, ignore_index=True) if key_frames else pd.DataFrame(columns=self.key_cols)
+        new_df = all_keys.iloc[new_rows].reset_index(drop=True)
+        del all_keys, key_frames
+
+        for col_pos, indicator_col in enumerate(indicator_cols):
+            new_df[indicator_col] = indicators[existing_count:, col_pos]
+
+        annotated: list[pd.DataFrame] = []
+        for source_id, db in enumerate(self.variant_dbs):
+            source_df = new_df[first_sources == source_id].copy()
+            if source_df.empty:
+                continue
+            self.annotate(db, source_df)
+            annotated.append(source_df)
+        if annotated:
+            new_df = pd.concat(annotated).sort_index()
+        new_df = new_df.reindex(columns=self.table.columns, fill_value=0)
+
+        # Set the indicators of existing rows, then materialize the final table once.
+        for col_pos, indicator_col in enumerate(indicator_cols):
+            hits = np.flatnonzero(indicators[:existing_count, col_pos])
+            self.table.iloc[hits, self.table.columns.get_loc(indicator_col)] = 1
+        self.table = pd.concat([self.table, new_df], ignore_index=True)
+        self.key_index.append(new_codes)
+        if self.compact:
+            self.compact_table()
+
+        for db in self.variant_dbs:
+            self.record_source(db)
+            print(f"Database '{db.name}' merged.")
+        print(f"Single-pass merge added {len(new_df)} new variants from {len(self.variant_dbs)} databases.")
+
     
 
+    def _new_manifest(self) -> dict[str, any]:
+        """
+        Returns an empty build manifest.
+        """
+        return {"key_cols": self.key_cols, "ann_cols": self.ann_cols, "sources": {}}
+
+    def record_source(self, db: VariantsDb) -> None:
+        """
+        Records in the build manifest that a db has been merged into the table.
+        """
+        self.manifest["sources"][db.name] = {
+            "db_path": db.db_path,
+            "version": db.instructions.get("version"),
+            "fingerprint": source_fingerprint(db.db_path, db.instructions),
+        }
+
+    def save_state(self, state_dir: str) -> None:
+        """
+        Persists the table, its key index and the build manifest to a directory, so that a
+        later run can refresh the table with rebuild_incremental instead of rebuilding it.
+        """
+        os.makedirs(state_dir, exist_ok=True)
+        self.table.infer_objects().reset_index(drop=True).to_feather(os.path.join(state_dir, "table.feather"))
+        self.key_index.save(os.path.join(state_dir, "key_index.npy"))
+        with open(os.path.join(state_dir, "manifest.json"), "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        print(f"Table state saved to {state_dir}.")
+
+    def load_state(self, state_dir: str) -> None:
+        """
+        Loads the table, key index and build manifest written by save_state.
+        """
+        with open(os.path.join(state_dir, "manifest.json")) as f:
+            manifest = json.load(f)
+        if manifest["key_cols"] != self.key_cols:
+            raise ValueError(f"Saved table key columns {manifest['key_cols']} do not match {self.key_cols}.")
+        self.table = pd.read_feather(os.path.join(state_dir, "table.feather"))
+        try:
+            self.key_index.load(os.path.join(state_dir, "key_index.npy"))
+        except ValueError as e:
+            # States saved with another key encoding are re-indexed from the table.
+            print(f"{e} Rebuilding the key index.")
+            self.key_index.rebuild(self.table)
+        self.manifest = manifest
+        if self.compact:
+            self.compact_table()
+        print(f"Table state loaded from {state_dir}.")
+
+    def rebuild_incremental(self) -> None:
+        """
+        Refreshes a table loaded with load_state against the registered VariantsDbs.
+
+        Sources whose file or instructions are unchanged since they were recorded in the
+        manifest are skipped. A changed source has its indicator bits dropped and is merged
+        again, so rows it still contains keep their annotations. Sources that are no longer
+        registered lose their indicator column. Variants left without any source are then
+        removed from the table.
+        """
+        recorded = self.manifest["sources"]
+        registered = {db.name for db in self.variant_dbs}
+
+        # Rows that may lose their last source, checked once all sources are merged.
+        candidates: list[np.ndarray] = []
+        for name in [name for name in recorded if name not in registered]:
+            if name in self.table.columns:
+                candidates.append(np.flatnonzero(self.table[name].to_numpy() == 1))
+                self.table = self.table.drop(columns=[name])
+            del recorded[name]
+            print(f"Database '{name}' removed from the table.")
+
+        for db in self.variant_dbs:
+            fingerprint = source_fingerprint(db.db_path, db.instructions)
+            if recorded.get(db.name, {}).get("fingerprint") == fingerprint:
+                print(f"Database '{db.name}' is up to date.")
+                continue
+            if db.name in self.table.columns:
+                indicator = self.table[db.name].to_numpy()
+                candidates.append(np.flatnonzero(indicator == 1))
+                self.table.iloc[candidates[-1], self.table.columns.get_loc(db.name)] = 0
+            self.pandas_merge_db(db)
+
+        if candidates:
+            self.collect_garbage(np.unique(np.concatenate(candidates)))
+        if self.compact:
+            self.compact_table()
+
+    def collect_garbage(self, candidates: np.ndarray | None = None) -> None:
+        """
+        Removes variants that are not present in any registered VariantsDb.
+
+        :param candidates: Row positions to check, or None to check the whole table.
+        """
+        indicator_cols = [db.name for db in self.variant_dbs if db.name in self.table.columns]
+        if candidates is None:
+            candidates = np.arange(len(self.table))
+        if indicator_cols:
+            orphaned = candidates[(self.table.iloc[candidates][indicator_cols].to_numpy() == 0).all(axis=1)]
+        else:
+            orphaned = candidates
+        if len(orphaned) == 0:
+            return
+        keep = np.ones(len(self.table), dtype=bool)
+        keep[orphaned] = False
+        self.table = self.table[keep].reset_index(drop=True)
+        self.key_index.keep(keep)
+        print(f"Removed {len(orphaned)} variants that are no longer present in any database.")
+
+    def compact_table(self) -> None:
+        """
+        Converts the table to compact dtypes without changing its values: text key columns
+        (e.g. chromosome and alleles) become categoricals, integer columns (e.g. positions
+        and integer annotations) are downcast to the smallest integer type that holds them,
+        and the variant and validation indicator columns are stored as uint8. Object
+        columns get their inferred dtypes first, so the result does not depend on how the
+        table was built (e.g. concatenated onto an empty object table by single_pass).
+        Numeric key columns (e.g. positions with missing values) are never categorized.
+        """
+        indicator_cols = [db.name for db in self.variant_dbs + self.validation_dbs if db.name in self.table.columns]
+        self.table = self.table.infer_objects()
+        for col in self.table.columns:
+            series = self.table[col]
+            if col in indicator_cols:
+                self.table[col] = series.fillna(0).astype(np.uint8)
+            elif pd.api.types.is_integer_dtype(series.dtype) or (series.dtype == object and pd.api.types.infer_dtype(series) == "integer"):
+                self.table[col] = pd.to_numeric(series, downcast="integer")
+            elif col in self.key_cols and not isinstance(series.dtype, pd.CategoricalDtype) and not pd.api.types.is_numeric_dtype(series.dtype):
+                self.table[col] = series.astype("category")
+
+    def memory_usage_report(self) -> pd.DataFrame:
+        """
+        Returns the memory used by each table column (in bytes, including object contents),
+        with a final "total" row.
+        """
+        usage = self.table.memory_usage(index=False, deep=True)
+        report = pd.DataFrame({"dtype": self.table.dtypes.astype(str), "bytes": usage})
+        report.loc["total"] = ["", int(usage.sum())]
+        return report
+
     def save_table(self, file_path: str, file_format:str="csv") -> None:
         """
-        Saves the extended table to a file in the specified format.
+        Saves the extended table to a file in the specified format using the execution backend.
+        """
+        with self.tracer.span("save_table", format=file_format) as span:
+            span.rows_in = len(self.table)
+            self.backend.save_table(self, file_path, file_format)
+
+    def pandas_save_table(self, file_path: str, file_format:str="csv") -> None:
+        """
+        Saves the in-memory extended table to a file in the specified format.
+
+        Text formats are written in chunks of rows. The "parquet" and "arrow" formats write a
+        directory partitioned by chromosome and sorted by position, and "tsv.bgz" writes a
+        position-sorted, bgzip-compressed TSV with a ".idx" sidecar index (see read_bgzip_region).
         """
+        self.check_region_cols(file_format)
         if file_format == "csv":
-            self.table.to_csv(file_path, index=False)
+            self.table.to_csv(file_path, index=False, chunksize=100_000)
             print(f"Table saved to {file_path} in CSV format.")
         elif file_format == "xlsx":
+            if len(self.table) >= EXCEL_MAX_ROWS:
+                raise ValueError(f"Table has {len(self.table)} rows, which exceeds the Excel limit. Use another format.")
             self.table.to_excel(file_path, index=False)
             print(f"Table saved to {file_path} in Excel format.")
         elif file_format == "tsv":
-            self.table.to_csv(file_path, sep='\t', index=False)
+            self.table.to_csv(file_path, sep='\t', index=False, chunksize=100_000)
             print(f"Table saved to {file_path} in TSV format.")
+        elif file_format == "tsv.bgz":
+            write_bgzip_tsv(self.table, file_path, self.chrom_col, self.pos_col)
+            print(f"Table saved to {file_path} in bgzip-compressed TSV format.")
+        elif file_format == "parquet":
+            write_parquet(self.table, file_path, self.chrom_col, self.pos_col)
+            print(f"Table saved to {file_path} in Parquet format.")
+        elif file_format == "arrow":
+            write_arrow(self.table, file_path, self.chrom_col, self.pos_col)
+            self.store = TableStore(file_path)
+            print(f"Table saved to {file_path} in Arrow IPC format.")
         else:
-            raise ValueError("Unsupported file format. Supported formats are: csv, xlsx, tsv.")
+            raise ValueError(f"Unsupported file format. Supported formats are: {', '.join(SAVE_FORMATS)}.")
+
+    def check_region_cols(self, file_format: str) -> None:
+        """
+        Raises a ValueError if the format is sorted by region and the table has no
+        chromosome or position column.
+        """
+        if file_format in REGION_FORMATS and (self.chrom_col is None or self.pos_col is None):
+            raise ValueError(f"The {file_format} format needs chromosome and position columns. Set chrom_col and pos_col.")
+
+    def open_store(self, file_path: str) -> None:
+        """
+        Opens a table saved in the "arrow" format for region queries, without loading it.
+        """
+        self.store = TableStore(file_path)
+        print(f"Table store opened from {file_path}.")
+
+    def query(self, chrom: any, start: int, end: int, sources: list[str] | None = None, annotations: list[str] | None = None) -> pd.DataFrame:
+        """
+        Returns the saved variants of a region (start <= position <= end), reading only
+        the blocks and columns needed from the store opened with open_store (or written by
+        save_table in the "arrow" format).
+
+        :param chrom: The chromosome.
+        :param start: First position of the region (inclusive).
+        :param end: Last position of the region (inclusive).
+        :param sources: Indicator columns (variant or validation db names) to return, or None for all.
+        :param annotations: Annotation columns to return, or None for all.
+        """
+        if self.store is None:
+            raise ValueError("No table store is open. Save the table in the arrow format or call open_store first.")
+        saved_cols = self.store.columns
+        if sources is None:
+            sources = [col for col in saved_cols if col not in self.key_cols and col not in self.ann_cols]
+        if annotations is None:
+            annotations = [col for col in saved_cols if col in self.ann_cols]
+        return self.store.query(chrom, start, end, self.key_cols + sources + annotations)
 
     def validate_table(self) -> None:
         """
-        Validates the extended table against registered validation databases.
+        Validates the extended table against registered validation databases using the
+        execution backend.
+        """
+        with self.tracer.span("validate_table"):
+            self.backend.validate_table(self)
+
+    def pandas_validate_table(self) -> None:
+        """
+        Validates the in-memory extended table against registered validation databases.
         This method checks for any discrepancies or errors in the data.
+        Rule-based validation databases are checked one at a time (each with its own span),
+        by looking up the key codes already held by the key index, so the table keys are
+        never encoded again or joined.
         """
+        engine = ValidationEngine(self.key_index)
         for db in self.validation_dbs:
-            db.validate(self.table)
+            with self.tracer.span("validate", db=db.name) as span:
+                span.rows_in = span.rows_out = len(self.table)
+                engine.validate(self.table, [db])
             print(f"Table validated against {db.name}.")
 
     def get_table(self) -> pd.DataFrame:
@@ -155,6 +607,7 @@ class ExtendedTable:
         Clears the current state of the extended table.
         """
         self.table = pd.DataFrame()
+        self.key_index.rebuild(self.table)
         self.variant_dbs = []
         self.validation_dbs = []
         print("Extended table cleared.")
\ No newline at end of file
@@ -1,18 +1,68 @@
-import pandas as pd
 import importlib
+import json
 import os
 import sys
 from db import Db, VariantsDb, ValidationDb
+from instrumentation import NULL_TRACER, Tracer
+
+# Name of the file caching the discovered dbs, in the dbs directory.
+MANIFEST_FILE_NAME = ".instructions_manifest.json"
 
 
 class InstructionsProvider:
-    def __init__(self, dbs_path: str):
+    """
+    Discovers the dbs of a dbs directory and provides their merged instructions.
+
+    Instructions modules are imported lazily, the first time the instructions of a db are
+    needed, so the (possibly heavy) imports of a source's module only run for the sources
+    used by a build. Loaded and merged instructions are memoized.
+
+    The db directories and their table files are listed once and recorded in a manifest
+    file, which later runs reuse for as long as the modification times of the directories
+    are unchanged.
+    """
+    def __init__(self, dbs_path: str, tracer: Tracer | None = None, manifest_path: str | None = None):
+        """
+        Initializes an instructions provider.
+
+        :param dbs_path: The dbs directory.
+        :param tracer: Tracer recording the instructions loading.
+        :param manifest_path: File caching the discovered dbs (defaults to ".instructions_manifest.json" in the dbs directory).
+        """
+        self.tracer = tracer if tracer is not None else NULL_TRACER
         # Add the base DBs directory to sys.path
-        sys.path.append(dbs_path)
+        if dbs_path not in sys.path:
+            sys.path.append(dbs_path)
         self.dbs_path, self.variants_dbs_path, self.validation_dbs_path = check_dbs_dir_structure(dbs_path)
-        self.variants_instructions_map = self.get_db_instructions("default")
-        self.validation_instructions_map = self.get_db_instructions("default", "validation")
-        
+        self.manifest_path = manifest_path if manifest_path is not None else os.path.join(dbs_path, MANIFEST_FILE_NAME)
+        self.manifest: dict[str, any] | None = None
+        self._variants_instructions_map: dict[str, any] | None = None
+        self._validation_instructions_map: dict[str, any] | None = None
+        self._db_instructions: dict[tuple[str, str], dict[str, any]] = {}
+        self._final_instructions: dict[tuple[str, str], dict[str, any]] = {}
+
+    @property
+    def variants_instructions_map(self) -> dict[str, any]:
+        if self._variants_instructions_map is None:
+            self._variants_instructions_map = self.get_db_instructions("default")
+        return self._variants_instructions_map
+
+    @variants_instructions_map.setter
+    def variants_instructions_map(self, instructions: dict[str, any]) -> None:
+        self._variants_instructions_map = instructions
+        self._final_instructions.clear()
+
+    @property
+    def validation_instructions_map(self) -> dict[str, any]:
+        if self._validation_instructions_map is None:
+            self._validation_instructions_map = self.get_db_instructions("default", "validation")
+        return self._validation_instructions_map
+
+    @validation_instructions_map.setter
+    def validation_instructions_map(self, instructions: dict[str, any]) -> None:
+        self._validation_instructions_map = instructions
+        self._final_instructions.clear()
+
     def get_variants_instructions_map(self):
         return self.variants_instructions_map
     
@@ -27,6 +77,8 @@ class InstructionsProvider:
         Loads the instructions from the specified database.
         Returns the instructions as a dictionary.
         """
+        if (db_type, db_name) in self._db_instructions:
+            return self._db_instructions[(db_type, db_name)]
         try:
             # Construct the path to the instructions module.
             instructions_path = os.path.join(self.dbs_path, db_type, db_name, "instructions.py")
@@ -37,7 +89,8 @@ class InstructionsProvider:
             rel_path = os.path.relpath(instructions_path, self.dbs_path)
             module_name = rel_path.replace(os.sep, ".").replace(".py", "")
             
-            instructions_module = importlib.import_module(module_name)
+            with self.tracer.span("load_instructions", db=db_name, db_type=db_type):
+                instructions_module = importlib.import_module(module_name)
             # Get the instructions from the module.
             instructions = getattr(instructions_module, "instructions", None)
             if instructions is None:
@@ -46,29 +99,22 @@ class InstructionsProvider:
             if not isinstance(instructions, dict):
                 raise TypeError(f"Instructions for '{db_name}' must be a dictionary.")
             
+            self._db_instructions[(db_type, db_name)] = instructions
             return instructions
         except ModuleNotFoundError as e:
             raise ImportError(f"Failed to import instructions module: {e}")
         
     def get_final_instructions(self, db_name: str, db_type: str = "variants"):
-        db_instructions = self.get_db_instructions(db_name, db_type)
-        default_instructions = (self.variants_instructions_map.copy() if db_type == "variants"
-                               else self.validation_instructions_map.copy())
-
-        def recursive_merge(default, override):
-            merged = default.copy()
-            for key, value in override.items():
-                # If both the default value and the override value are dictionaries,
-                # then recursively merge them.
-                if key in merged and isinstance(merged[key], dict) and isinstance(value, dict):
-                    merged[key] = recursive_merge(merged[key], value)
-                else:
-                    # Otherwise, override the default with the db-specific value.
-                    merged[key] = value
-            return merged
-
-        merged_instructions = recursive_merge(default_instructions, db_instructions)
-        return merged_instructions
+        """
+        Returns the instructions of a db merged over the default instructions of its type.
+        The result is memoized, so every db is merged once.
+        """
+        if (db_type, db_name) not in self._final_instructions:
+            default_instructions = (self.variants_instructions_map if db_type == "variants"
+                                    else self.validation_instructions_map)
+            self._final_instructions[(db_type, db_name)] = merge_instructions(
+                default_instructions, self.get_db_instructions(db_name, db_type))
+        return self._final_instructions[(db_type, db_name)]
 
 
     def get_annotations_names(self):
@@ -78,13 +124,75 @@ class InstructionsProvider:
         """
         Returns a list of database names in the specified directory.
         """
+        return list(self.get_manifest_entry(db_type)["dbs"])
+
+    def get_manifest_entry(self, db_type: str = "variants") -> dict[str, any]:
+        """
+        Returns the discovered dbs of a type, as {"mtime_ns": <directory mtime>, "dbs":
+        {<name>: {"mtime_ns": <db directory mtime>, "table": <table file name or None>}}}.
+        The directory is listed again only when its modification time changed since the
+        manifest was written.
+        """
+        if db_type not in ("variants", "validation"):
+            raise ValueError(f"Invalid db_type '{db_type}'. Must be 'variants' or 'validation'.")
         dbs_path = self.variants_dbs_path if db_type == "variants" else self.validation_dbs_path
+        if dbs_path is None:
+            return {"mtime_ns": None, "dbs": {}}
         if not os.path.isdir(dbs_path):
             raise NotADirectoryError(f"Path '{dbs_path}' is not a directory.")
-        
-        dbs_names = [name for name in os.listdir(dbs_path)
-                     if os.path.isdir(os.path.join(dbs_path, name)) and name != "default" and not name.startswith("__")]
-        return dbs_names
+
+        if self.manifest is None:
+            self.manifest = self._read_manifest()
+        entry = self.manifest.get(db_type)
+        mtime_ns = os.stat(dbs_path).st_mtime_ns
+        if entry is None or entry["mtime_ns"] != mtime_ns:
+            dbs = {}
+            for name in sorted(os.listdir(dbs_path)):
+                db_dir = os.path.join(dbs_path, name)
+                if os.path.isdir(db_dir) and name != "default" and not name.startswith("__"):
+                    dbs[name] = scan_db_dir(db_dir)
+            entry = self.manifest[db_type] = {"mtime_ns": mtime_ns, "dbs": dbs}
+            self._write_manifest()
+        return entry
+
+    def get_table_path(self, db_name: str, db_type: str = "variants") -> str:
+        """
+        Returns the path of the table file of a db (the first file starting with
+        "variants_table"), from the manifest if the db directory is unchanged.
+        """
+        dbs_path = self.variants_dbs_path if db_type == "variants" else self.validation_dbs_path
+        db_dir = os.path.join(dbs_path, db_name)
+        entry = self.get_manifest_entry(db_type)
+        db_entry = entry["dbs"].get(db_name)
+        if db_entry is None or db_entry["mtime_ns"] != os.stat(db_dir).st_mtime_ns:
+            db_entry = entry["dbs"][db_name] = scan_db_dir(db_dir)
+            self._write_manifest()
+        if db_entry["table"] is None:
+            raise FileNotFoundError(f"Database file not found in {db_dir}. Expected a file starting with 'variants_table'.")
+        return os.path.join(db_dir, db_entry["table"])
+
+    def _read_manifest(self) -> dict[str, any]:
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return manifest if manifest.get("dbs_path") == os.path.abspath(self.dbs_path) else {}
+
+    def _write_manifest(self) -> None:
+        """
+        Writes the manifest atomically. It is only a cache, so read-only dbs directories
+        are not an error.
+        """
+        self.manifest["dbs_path"] = os.path.abspath(self.dbs_path)
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self.manifest, f, indent=2)
+            os.replace(tmp_path, self.manifest_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
     
     def get_key_columns(self):
         """
@@ -100,21 +208,9 @@ class InstructionsProvider:
         Creates a Db instance for the specified database.
         """
         try:
-            if db_type == "variants":
-                db_path = self.variants_dbs_path
-            elif db_type == "validation":
-                db_path = self.validation_dbs_path
-            else:
+            if db_type not in ("variants", "validation"):
                 raise ValueError(f"Invalid db_type '{db_type}'. Must be 'variants' or 'validation'.")
-            # Construct the path to the database directory
-            db_dir = os.path.join(db_path, db_name)
-            # Look for a file named variants_table with any extension
-            potential_files = [f for f in os.listdir(db_dir) if f.startswith("variants_table")]
-            if not potential_files:
-                raise FileNotFoundError(f"Database file not found in {db_dir}. Expected a file starting with 'variants_table'.")
-            
-            # Use the first matching file
-            db_path = os.path.join(db_dir, potential_files[0])
+            db_path = self.get_table_path(db_name, db_type)
             if not os.path.isfile(db_path):
                 raise FileNotFoundError(f"Database file not found at {db_path}.")
             
@@ -137,30 +233,29 @@ class InstructionsProvider:
             return None
 
 
+def merge_instructions(default: dict[str, any], override: dict[str, any]) -> dict[str, any]:
+    """
+    Returns the default instructions recursively overridden by the db instructions.
+    """
+    merged = default.copy()
+    for key, value in override.items():
+        # If both the default value and the override value are dictionaries,
+        # then recursively merge them.
+        if key in merged and isinstance(merged[key], dict) and isinstance(value, dict):
+            merged[key] = merge_instructions(merged[key], value)
+        else:
+            # Otherwise, override the default with the db-specific value.
+            merged[key] = value
+    return merged
 
-if __name__ == "__main__":
-    dbs_path = "/Users/znave/Desktop/DBs"
-    instructions_provider = InstructionsProvider(dbs_path)
-    # Example usage
-    print(instructions_provider.get_variants_instructions_map())
-    
-    # Example DataFrame
-    data = pd.DataFrame({
-        "ref": ["G", "A", "T", "T"],
-        "alt": ["A", "C", "G", "C"]
-    })
-    instructions_provider.set_variants_db_instructions("default")
-    
-    # Apply pre-processing
-    processed_data = instructions_provider.variants_instructions_map["pre_processor"](data)
 
-    annotations = instructions_provider.variants_instructions_map["annotations"]
-    print(f"Instructions map: {instructions_provider.get_variants_instructions_map()}")
-    # Apply annotation functions
-    annotations["isADARFixable"]["compute_function"](processed_data)
-    annotations["isApoBecFixable"]["compute_function"](processed_data)
-    
-    print(processed_data)
+def scan_db_dir(db_dir: str) -> dict[str, any]:
+    """
+    Returns the manifest entry of a db directory: its modification time and the name of
+    its table file (the first file starting with "variants_table", or None).
+    """
+    tables = sorted(name for name in os.listdir(db_dir) if name.startswith("variants_table"))
+    return {"mtime_ns": os.stat(db_dir).st_mtime_ns, "table": tables[0] if tables else None}
 
 
 def check_dbs_dir_structure(dbs_path: str):
@@ -197,3 +292,22 @@ def check_dbs_dir_structure(dbs_path: str):
     else:
         validation_path = None
     return (dbs_path, variants_path, validation_path)
+
+
+if __name__ == "__main__":
+    # Example usage: python instructions_provider.py <dbs_dir>
+    # (a synthetic dbs directory can be created with "python benchmark.py generate <dbs_dir>").
+    if len(sys.argv) != 2:
+        print("Usage: python instructions_provider.py <dbs_dir>")
+        sys.exit(1)
+    instructions_provider = InstructionsProvider(sys.argv[1])
+    print(f"Instructions map: {instructions_provider.get_variants_instructions_map()}")
+    print(f"Key columns: {instructions_provider.get_key_columns()}")
+
+    # Pre-process and annotate the first rows of the first variants db.
+    db = instructions_provider.create_db_instance(instructions_provider.get_dbs_names()[0])
+    db.upload_db()
+    processed_data = db.pre_process().head()
+    for annotation in db.instructions["annotations"].values():
+        annotation["compute_function"](processed_data)
+    print(processed_data)
@@ -0,0 +1,234 @@
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+def get_rss() -> int | None:
+    """
+    Returns the current resident set size of the process in bytes, or None where it
+    cannot be read.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Span:
+    """
+    A timed stage of the build. rows_in, rows_out and bytes_read are set by the
+    instrumented code when they are known.
+    """
+    def __init__(self, name: str, tags: dict[str, any], parent: "Span | None" = None) -> None:
+        self.name = name
+        self.tags = tags
+        self.parent = parent
+        self.thread_id = threading.get_ident()
+        self.start = 0.0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.rows_in: int | None = None
+        self.rows_out: int | None = None
+        self.bytes_read: int | None = None
+        self.memory_delta_bytes: int | None = None
+
+    def to_dict(self) -> dict[str, any]:
+        return {
+            "name": self.name,
+            "tags": self.tags,
+            "parent": self.parent.name if self.parent is not None else None,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "bytes_read": self.bytes_read,
+            "memory_delta_bytes": self.memory_delta_bytes,
+        }
+
+
+class Tracer:
+    """
+    Records spans of the build stages (wall and CPU time, rows in and out, bytes read and
+    RSS delta, tagged with the db and annotation names) and exports them as a JSON trace
+    or a Prometheus textfile.
+
+    CPU time is the process CPU time, so it includes the native threads of pandas,
+    pyarrow or DuckDB. Spans recorded in worker processes are not sent back: the parent
+    records the time it waits for them.
+
+    When profile_dir is set, the user compute functions run under cProfile and one
+    pstats file per annotation and db is written there by write_profiles (readable with
+    pstats, snakeviz or gprof2dot). Profiled sections are serialized, since only one
+    profiler can be active at a time.
+    """
+    def __init__(self, enabled: bool = True, profile_dir: str | None = None) -> None:
+        """
+        Initializes a tracer.
+
+        :param enabled: Whether spans are recorded.
+        :param profile_dir: Directory for the cProfile output of compute functions, or None to not profile.
+        """
+        self.enabled = enabled
+        self.profile_dir = profile_dir
+        self.spans: list[Span] = []
+        self.origin = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profile_lock = threading.Lock()
+        self._profiles: dict[str, cProfile.Profile] = {}
+
+    def __getstate__(self) -> dict[str, any]:
+        # Tracers are sent to worker processes with their dbs, without the recorded data.
+        return {"enabled": self.enabled, "profile_dir": self.profile_dir}
+
+    def __setstate__(self, state: dict[str, any]) -> None:
+        self.__init__(state["enabled"], state["profile_dir"])
+
+    def get_tags(self) -> dict[str, any]:
+        """
+        Returns the tags of the innermost open span of the current thread, to tag spans
+        recorded on other threads.
+        """
+        stack = getattr(self._local, "stack", None)
+        return dict(stack[-1].tags) if stack else {}
+
+    @contextmanager
+    def span(self, name: str, **tags):
+        """
+        Records a span around a block. The yielded Span can be given rows_in, rows_out
+        and bytes_read.
+
+        :param name: The stage name, e.g. "upload_db".
+        :param tags: Tags of the span, e.g. db="clinvar". Tags of enclosing spans are inherited.
+        """
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        parent = stack[-1] if stack else None
+        span = Span(name, {**(parent.tags if parent is not None else {}), **tags}, parent)
+        if not self.enabled:
+            yield span
+            return
+        rss = get_rss()
+        span.start = time.perf_counter()
+        cpu_start = time.process_time()
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+            span.wall_seconds = time.perf_counter() - span.start
+            span.cpu_seconds = time.process_time() - cpu_start
+            end_rss = get_rss()
+            if rss is not None and end_rss is not None:
+                span.memory_delta_bytes = end_rss - rss
+            with self._lock:
+                self.spans.append(span)
+
+    def profile(self, name: str):
+        """
+        Returns a context manager that runs a block under the cProfile profiler of a
+        name when profiling is enabled, and does nothing otherwise.
+        """
+        if self.profile_dir is None:
+            return nullcontext()
+        return self._profile(name)
+
+    @contextmanager
+    def _profile(self, name: str):
+        with self._profile_lock:
+            profiler = self._profiles.setdefault(name, cProfile.Profile())
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+
+    def write_profiles(self) -> None:
+        """
+        Writes the collected cProfile statistics to profile_dir, one "<name>.prof" file
+        per profiled name.
+        """
+        if self.profile_dir is None:
+            return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        for name, profiler in self._profiles.items():
+            file_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+            profiler.dump_stats(os.path.join(self.profile_dir, f"{file_name}.prof"))
+        print(f"Profiles written to {self.profile_dir}.")
+
+    def write_json(self, file_path: str) -> None:
+        """
+        Writes the spans in the Chrome trace event format, which chrome://tracing and
+        Perfetto display as a timeline. Span metrics are stored in the event arguments.
+        """
+        pid = os.getpid()
+        events = []
+        for span in self.spans:
+            args = {key: value for key, value in span.to_dict().items() if key not in ("name", "tags", "wall_seconds")}
+            events.append({
+                "name": span.name,
+                "cat": "build",
+                "ph": "X",
+                "ts": (span.start - self.origin) * 1e6,
+                "dur": span.wall_seconds * 1e6,
+                "pid": pid,
+                "tid": span.thread_id,
+                "args": {**span.tags, **args},
+            })
+        with open(file_path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        print(f"Trace written to {file_path}.")
+
+    def write_prometheus(self, file_path: str, prefix: str = "variant_table") -> None:
+        """
+        Writes the span metrics, summed per stage and tags, in the Prometheus text format
+        for the node_exporter textfile collector. The file is replaced atomically so that
+        the collector never reads a partial file.
+        """
+        metrics = {
+            "calls_total": ("counter", "Number of times the stage ran.", lambda span: 1),
+            "wall_seconds_total": ("counter", "Wall time spent in the stage.", lambda span: span.wall_seconds),
+            "cpu_seconds_total": ("counter", "Process CPU time spent in the stage.", lambda span: span.cpu_seconds),
+            "rows_in_total": ("counter", "Rows consumed by the stage.", lambda span: span.rows_in),
+            "rows_out_total": ("counter", "Rows produced by the stage.", lambda span: span.rows_out),
+            "bytes_read_total": ("counter", "Bytes read by the stage.", lambda span: span.bytes_read),
+            "memory_delta_bytes": ("gauge", "Sum of the RSS changes over the stage.", lambda span: span.memory_delta_bytes),
+        }
+        lines = []
+        for metric, (metric_type, help_text, get_value) in metrics.items():
+            values: dict[tuple, float] = {}
+            for span in self.spans:
+                value = get_value(span)
+                if value is None:
+                    continue
+                labels = tuple(sorted({"stage": span.name, **{key: str(v) for key, v in span.tags.items()}}.items()))
+                values[labels] = values.get(labels, 0) + value
+            if not values:
+                continue
+            name = f"{prefix}_stage_{metric}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in values.items():
+                label_text = ",".join(f'{key}="{escape_label(v)}"' for key, v in labels)
+                lines.append(f"{name}{{{label_text}}} {value}")
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, file_path)
+        print(f"Metrics written to {file_path}.")
+
+
+def escape_label(value: str) -> str:
+    """
+    Escapes a Prometheus label value.
+    """
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+# Tracer of the objects that are not attached to a build tracer.
+NULL_TRACER = Tracer(enabled=False)
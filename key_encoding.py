@@ -0,0 +1,282 @@
+import itertools
+import pickle
+import numpy as np
+import pandas as pd
+
+# Layout of a packed key, from the most significant bit:
+# 1 overflow flag (0) | 9 bits chromosome code | 30 bits position | 24 bits alleles.
+CHROM_BITS = 9
+POS_BITS = 30
+ALLELE_BITS = 24
+OVERFLOW_FLAG = np.uint64(1 << 63)
+
+# Alleles of up to INLINE_LENGTH bases (A, C, G or T) are packed inline, ordered by
+# length, then base by base. A ref/alt pair of inline alleles is packed as
+# ref_code * len(INLINE_ALLELES) + alt_code, the allele codes above INLINE_PAIRS are
+# ids of longer (or other) allele pairs in the allele dictionary.
+INLINE_LENGTH = 5
+INLINE_ALLELES = np.array(["".join(bases) for length in range(INLINE_LENGTH + 1)
+                           for bases in itertools.product("ACGT", repeat=length)], dtype=object)
+INLINE_INDEX = pd.Index(INLINE_ALLELES, dtype=object)
+INLINE_PAIRS = len(INLINE_ALLELES) ** 2
+
+
+class KeyEncoder:
+    """
+    Encodes chrom/pos/ref/alt variant keys into uint64 codes, losslessly.
+
+    The chromosome is mapped to a small code through the chromosome dictionary and packed
+    with the position and the alleles (see the layout above), so packed codes sort by
+    chromosome code, position and alleles. Allele pairs that do not fit inline are
+    numbered in the allele dictionary, and keys that do not fit the layout at all (more
+    than 512 chromosomes, positions outside [0, 2^30), non-integer positions or a full
+    allele dictionary) are numbered in the overflow dictionary and flagged by the top bit.
+
+    Equal keys always get equal codes, and different keys different codes, so the codes
+    can replace the key columns in joins, deduplication and indexing. The dictionaries
+    only grow, so the codes of one encoder stay valid for its lifetime and are only
+    comparable with codes of the same encoder. Every dictionary is a list of its entries
+    with a dict from entry to id, so new entries are added in time proportional to their
+    number.
+    """
+    def __init__(self, key_cols: list[str], chrom_col: str, pos_col: str) -> None:
+        """
+        Initializes an encoder with empty dictionaries.
+
+        :param key_cols: The four key columns. The two that are not chrom_col or pos_col are the ref and alt alleles, in order.
+        :param chrom_col: The chromosome column.
+        :param pos_col: The position column.
+        """
+        if not can_encode_keys(key_cols, chrom_col, pos_col):
+            raise ValueError(f"Key columns {key_cols} are not chromosome, position, ref and alt columns.")
+        self.key_cols: list[str] = key_cols
+        allele_cols = [col for col in key_cols if col not in (chrom_col, pos_col)]
+        # Position in the key columns of the chromosome, position, ref and alt columns.
+        self.roles: list[int] = [key_cols.index(col) for col in [chrom_col, pos_col] + allele_cols]
+        # Dictionary entries (chromosomes, (ref, alt) pairs and full keys) in id order.
+        self.chroms: list = []
+        self.alleles: list[tuple] = []
+        self.overflow: list[tuple] = []
+        self._ids: dict[str, dict[any, int]] = {"chroms": {}, "alleles": {}, "overflow": {}}
+
+    def __getstate__(self) -> dict[str, any]:
+        # The id maps are rebuilt on unpickling, as unpickled NaN keys are new objects.
+        state = self.__dict__.copy()
+        del state["_ids"]
+        return state
+
+    def __setstate__(self, state: dict[str, any]) -> None:
+        self.__dict__.update(state)
+        self._index_dictionaries()
+
+    def encode(self, df: pd.DataFrame, key_cols: list[str] | None = None) -> np.ndarray:
+        """
+        Encodes the keys of a DataFrame into one uint64 per row, adding unseen chromosomes
+        and alleles to the dictionaries.
+
+        :param df: A DataFrame containing the key columns.
+        :param key_cols: The key columns of df (e.g. of a validation db), matched to the encoder's key columns by position. Defaults to the encoder's key columns.
+        """
+        key_cols = key_cols if key_cols is not None else self.key_cols
+        chrom, pos, ref, alt = (df[key_cols[role]] for role in self.roles)
+        rows = len(df)
+        # Integer chromosomes and positions are encoded by value, whether they are stored
+        # as int, nullable int, float (e.g. read from a file with missing values) or object.
+        chrom_ints = integer_values(chrom)
+        if chrom_ints is not None:
+            chrom = integer_series(*chrom_ints, chrom.index)
+        pos_ints = integer_values(pos)
+        if pos_ints is not None:
+            pos = integer_series(*pos_ints, pos.index)
+
+        chrom_codes = self._dictionary_codes("chroms", [chrom])
+        fits = chrom_codes < (1 << CHROM_BITS)
+        positions = np.zeros(rows, dtype=np.int64)
+        if pos_ints is not None:
+            positions, missing = pos_ints
+            fits &= ~missing & (positions >= 0) & (positions < (1 << POS_BITS))
+        else:
+            fits[:] = False
+
+        ref_codes = inline_allele_codes(ref)
+        alt_codes = inline_allele_codes(alt)
+        inline = (ref_codes >= 0) & (alt_codes >= 0)
+        allele_codes = ref_codes * len(INLINE_ALLELES) + alt_codes
+        long_rows = np.flatnonzero(fits & ~inline)
+        if len(long_rows) > 0:
+            allele_codes[long_rows] = INLINE_PAIRS + self._dictionary_codes("alleles", [ref.iloc[long_rows], alt.iloc[long_rows]])
+            fits &= allele_codes < (1 << ALLELE_BITS)
+
+        codes = ((chrom_codes.astype(np.uint64) << np.uint64(POS_BITS + ALLELE_BITS))
+                 | (positions.astype(np.uint64) << np.uint64(ALLELE_BITS))
+                 | allele_codes.astype(np.uint64))
+        overflow_rows = np.flatnonzero(~fits)
+        if len(overflow_rows) > 0:
+            keys = [column.iloc[overflow_rows] for column in (chrom, pos, ref, alt)]
+            codes[overflow_rows] = OVERFLOW_FLAG | self._dictionary_codes("overflow", keys).astype(np.uint64)
+        return codes
+
+    def decode(self, codes: np.ndarray) -> pd.DataFrame:
+        """
+        Decodes key codes back into the key columns.
+
+        :param codes: Codes returned by encode.
+        """
+        codes = np.asarray(codes, dtype=np.uint64)
+        is_overflow = codes >= OVERFLOW_FLAG
+        packed = np.flatnonzero(~is_overflow)
+        packed_codes = codes[packed]
+        allele_codes = (packed_codes & np.uint64((1 << ALLELE_BITS) - 1)).astype(np.int64)
+        chrom_codes = (packed_codes >> np.uint64(POS_BITS + ALLELE_BITS)).astype(np.int64)
+
+        chrom = np.empty(len(codes), dtype=object)
+        chrom[packed] = np.asarray(self.chroms, dtype=object)[chrom_codes]
+        pos = np.zeros(len(codes), dtype=np.int64)
+        pos[packed] = (packed_codes >> np.uint64(ALLELE_BITS)).astype(np.int64) & ((1 << POS_BITS) - 1)
+        ref = np.empty(len(codes), dtype=object)
+        alt = np.empty(len(codes), dtype=object)
+        inline = allele_codes < INLINE_PAIRS
+        ref[packed[inline]] = INLINE_ALLELES[allele_codes[inline] // len(INLINE_ALLELES)]
+        alt[packed[inline]] = INLINE_ALLELES[allele_codes[inline] % len(INLINE_ALLELES)]
+        pairs = [self.alleles[i] for i in (allele_codes[~inline] - INLINE_PAIRS).tolist()]
+        ref[packed[~inline]] = [pair[0] for pair in pairs]
+        alt[packed[~inline]] = [pair[1] for pair in pairs]
+
+        columns = [chrom, pos, ref, alt]
+        overflow = np.flatnonzero(is_overflow)
+        if len(overflow) > 0:
+            keys = [self.overflow[i] for i in (codes[overflow] & ~OVERFLOW_FLAG).astype(np.int64).tolist()]
+            columns[1] = pos.astype(object)
+            for level, column in enumerate(columns):
+                column[overflow] = [key[level] for key in keys]
+
+        data = {self.key_cols[role]: column for role, column in zip(self.roles, columns)}
+        return pd.DataFrame(data, columns=self.key_cols).infer_objects()
+
+    def _dictionary_codes(self, name: str, columns: list[pd.Series]) -> np.ndarray:
+        """
+        Returns the id of every row of the columns in one of the dictionaries ("chroms",
+        "alleles" or "overflow"), adding unseen entries in order of first appearance.
+        """
+        row_codes, values = factorize_rows(columns)
+        entries = values[0].tolist() if len(values) == 1 else list(zip(*values))
+        ids, dictionary = self._ids[name], getattr(self, name)
+        codes = np.array([ids.get(entry, -1) for entry in entries], dtype=np.int64)
+        unseen = np.flatnonzero(codes < 0)
+        if len(unseen) > 0:
+            codes[unseen] = np.arange(len(dictionary), len(dictionary) + len(unseen))
+            new_entries = [entries[i] for i in unseen]
+            ids.update(zip(new_entries, codes[unseen].tolist()))
+            dictionary.extend(new_entries)
+        return codes[row_codes]
+
+    def _index_dictionaries(self) -> None:
+        """
+        Rebuilds the id maps of the dictionaries, with the missing values of the entries
+        replaced by np.nan (see factorize_rows).
+        """
+        self.chroms = [canonical_missing(chrom) for chrom in self.chroms]
+        self.alleles = [tuple(canonical_missing(value) for value in pair) for pair in self.alleles]
+        self.overflow = [tuple(canonical_missing(value) for value in key) for key in self.overflow]
+        self._ids = {name: dict(zip(getattr(self, name), range(len(getattr(self, name)))))
+                     for name in ("chroms", "alleles", "overflow")}
+
+    def save(self, file_path: str) -> None:
+        """
+        Saves the key layout and dictionaries to a pickle file.
+        """
+        with open(file_path, "wb") as f:
+            pickle.dump({"key_cols": self.key_cols, "roles": self.roles, "chroms": self.chroms,
+                         "alleles": self.alleles, "overflow": self.overflow}, f)
+
+    def load(self, file_path: str) -> None:
+        """
+        Loads dictionaries previously written by save, replacing the current ones.
+        """
+        with open(file_path, "rb") as f:
+            state = pickle.load(f)
+        if state["key_cols"] != self.key_cols or state["roles"] != self.roles:
+            raise ValueError(f"Saved key encoding of {state['key_cols']} does not match {self.key_cols}.")
+        self.chroms, self.alleles, self.overflow = list(state["chroms"]), list(state["alleles"]), list(state["overflow"])
+        self._index_dictionaries()
+
+
+def can_encode_keys(key_cols: list[str], chrom_col: str | None, pos_col: str | None) -> bool:
+    """
+    Returns whether key columns are chromosome, position and two allele columns, the
+    layout a KeyEncoder packs.
+    """
+    return len(set(key_cols)) == 4 and chrom_col in key_cols and pos_col in key_cols and chrom_col != pos_col
+
+
+def inline_allele_codes(alleles: pd.Series) -> np.ndarray:
+    """
+    Returns the inline code of every allele, or -1 for alleles that are not inline.
+    """
+    row_codes, values = factorize_rows([alleles])
+    return INLINE_INDEX.get_indexer(values[0]).astype(np.int64)[row_codes]
+
+
+def integer_values(column: pd.Series) -> tuple[np.ndarray, np.ndarray] | None:
+    """
+    Returns the int64 values and the missing-value mask of a column holding integers
+    (int, nullable int, float without fractional values or object of those), or None
+    for other columns. Missing values are 0 in the values.
+    """
+    if column.dtype == object:
+        if len(column) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+        if pd.api.types.infer_dtype(column, skipna=True) not in ("integer", "floating", "mixed-integer-float"):
+            return None
+        column = pd.to_numeric(column)
+    if pd.api.types.is_bool_dtype(column.dtype):
+        return None
+    if pd.api.types.is_integer_dtype(column.dtype):
+        missing = column.isna().to_numpy()
+        return column.to_numpy(dtype=np.int64, na_value=0), missing
+    if pd.api.types.is_float_dtype(column.dtype):
+        floats = column.to_numpy(dtype=np.float64, na_value=np.nan)
+        missing = np.isnan(floats)
+        floats = np.where(missing, 0.0, floats)
+        if not (np.all(floats == np.trunc(floats)) and np.all(np.abs(floats) < 2.0 ** 63)):
+            return None
+        return floats.astype(np.int64), missing
+    return None
+
+
+def integer_series(values: np.ndarray, missing: np.ndarray, index: pd.Index) -> pd.Series:
+    """
+    Returns integer values as a column of Python ints, with NaN for missing values, so
+    equal integers are equal keys however the column was stored.
+    """
+    column = values.astype(object)
+    column[missing] = np.nan
+    return pd.Series(column, index=index, dtype=object)
+
+
+def factorize_rows(columns: list[pd.Series]) -> tuple[np.ndarray, list[np.ndarray]]:
+    """
+    Numbers the distinct rows of aligned columns (missing values included) in order of
+    first appearance, and returns the number of every row with the values of the
+    distinct rows, one object array per column. Every column is factorized on its own, so
+    string columns are not converted to Python objects row by row. Missing values are
+    returned as np.nan, so equal keys with missing values are equal tuples.
+    """
+    row_codes = np.zeros(len(columns[0]), dtype=np.int64)
+    for column in columns:
+        codes, uniques = pd.factorize(column, use_na_sentinel=False)
+        row_codes, _ = pd.factorize(row_codes * len(uniques) + codes)
+    first_rows = np.flatnonzero(~pd.Series(row_codes).duplicated().to_numpy())
+    values = []
+    for column in columns:
+        column_values = np.array(column.iloc[first_rows], dtype=object)
+        column_values[pd.isna(column_values)] = np.nan
+        values.append(column_values)
+    return row_codes, values
+
+
+def canonical_missing(value: any) -> any:
+    """
+    Returns np.nan for a missing value (None, NaN or NA), and the value otherwise.
+    """
+    return np.nan if value is None or (not isinstance(value, (str, tuple)) and pd.isna(value)) else value
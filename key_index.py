@@ -0,0 +1,195 @@
+import os
+import numpy as np
+import pandas as pd
+from key_encoding import KeyEncoder, integer_values
+
+
+class KeyIndex:
+    """
+    Persistent index from composite variant keys to row positions in the extended table.
+
+    Every key (e.g. chrom/pos/ref/alt) is encoded into a single uint64, so lookups and
+    appends are vectorized operations on integer arrays instead of per-row tuple work.
+    With a KeyEncoder the codes are exact and can be decoded back into the keys, without
+    one the key columns are hashed (for key columns the encoder cannot pack).
+
+    Codes are stored in a buffer that grows geometrically, and the lookup tables are kept
+    in levels over consecutive row ranges: appended rows get a level of their own, and
+    the newest levels are merged whenever a level is not smaller than the one before it.
+    There are thus O(log n) levels, every row is re-indexed O(log n) times, and appending
+    a chunk costs time in the chunk size rather than in the table size.
+    """
+    def __init__(self, key_cols: list[str], encoder: KeyEncoder | None = None, growth: float = 1.5) -> None:
+        """
+        Initializes an empty key index.
+
+        :param key_cols: The columns that make up the composite variant key.
+        :param encoder: The key encoder, shared with the indexes whose codes are compared with this one's, or None to hash the keys.
+        :param growth: Factor by which the code buffer grows when it is full.
+        """
+        self.key_cols: list[str] = key_cols
+        self.encoder: KeyEncoder | None = encoder
+        self.growth = growth
+        self._codes: np.ndarray = np.empty(0, dtype=np.uint64)
+        self._length = 0
+        # Lookup levels, as (first row, hash table, row of every entry or None when the
+        # entries are the rows themselves), covering the rows before _indexed.
+        self._levels: list[tuple[int, pd.Index, np.ndarray | None]] = []
+        self._indexed = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def get_codes(self) -> np.ndarray:
+        """
+        Returns the key codes of all indexed rows, in table order.
+        """
+        return self._codes[:self._length]
+
+    def encode_keys(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Encodes (or hashes) the key columns of a DataFrame into one uint64 per row.
+
+        :param df: A DataFrame containing all key columns.
+        """
+        if self.encoder is not None:
+            return self.encoder.encode(df, self.key_cols)
+        # Object columns holding strings must hash like their string counterparts, so let
+        # pandas infer the real dtypes first.
+        keys = df[self.key_cols].infer_objects()
+        # Integer keys must hash alike whether they are downcast (compact tables), nullable,
+        # floats (e.g. read from a file with missing values) or objects (e.g. an empty table
+        # filled by concat), so they are all hashed as Int64, with missing values as NA.
+        for col in self.key_cols:
+            ints = integer_values(keys[col])
+            if ints is not None:
+                keys[col] = pd.Series(pd.arrays.IntegerArray(*ints), index=keys.index)
+        return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+    def decode_keys(self, codes: np.ndarray | None = None) -> pd.DataFrame:
+        """
+        Decodes key codes back into the key columns.
+
+        :param codes: Key codes as returned by encode_keys, or None for the indexed rows.
+        """
+        if self.encoder is None:
+            raise ValueError("Hashed keys cannot be decoded.")
+        codes = codes if codes is not None else self.get_codes()
+        return self.encoder.decode(codes).set_axis(self.key_cols, axis=1)
+
+    def lookup(self, codes: np.ndarray) -> np.ndarray:
+        """
+        Returns the row position of every key code, or -1 for keys not in the index.
+        Keys that appear in more than one row (e.g. in tables loaded from disk) resolve to
+        their first row.
+
+        :param codes: Key codes as returned by encode_keys.
+        """
+        self._update_levels()
+        positions = np.full(len(codes), -1, dtype=np.intp)
+        missing = np.arange(len(codes))
+        # Older levels hold earlier rows, so the first level that has a key wins.
+        for start, lookup, rows in self._levels:
+            found = lookup.get_indexer(codes[missing] if len(missing) < len(codes) else codes)
+            hits = found >= 0
+            positions[missing[hits]] = start + (found[hits] if rows is None else rows[found[hits]])
+            missing = missing[~hits]
+            if len(missing) == 0:
+                break
+        return positions
+
+    def _update_levels(self) -> None:
+        """
+        Indexes the rows appended since the last lookup as a new level, then merges the
+        newest levels while a level is not smaller than the one before it.
+        """
+        if self._indexed < self._length:
+            self._levels.append(self._build_level(self._indexed, self._length))
+            self._indexed = self._length
+        while len(self._levels) > 1 and self._level_size(-2) <= self._level_size(-1):
+            self._levels.pop()
+            start = self._levels.pop()[0]
+            self._levels.append(self._build_level(start, self._indexed))
+
+    def _level_size(self, level: int) -> int:
+        end = self._levels[level + 1][0] if level + 1 < 0 else self._indexed
+        return end - self._levels[level][0]
+
+    def _build_level(self, start: int, end: int) -> tuple[int, pd.Index, np.ndarray | None]:
+        """
+        Builds the hash table of the rows [start, end). Duplicate keys resolve to their
+        first row.
+        """
+        lookup = pd.Index(self._codes[start:end])
+        if lookup.is_unique:
+            return start, lookup, None
+        first = ~lookup.duplicated()
+        return start, lookup[first], np.flatnonzero(first)
+
+    def _reset(self, codes: np.ndarray) -> None:
+        """
+        Replaces the indexed codes, dropping the lookup levels.
+        """
+        self._codes = np.asarray(codes, dtype=np.uint64)
+        self._length = len(self._codes)
+        self._levels = []
+        self._indexed = 0
+
+    def append(self, codes: np.ndarray) -> np.ndarray:
+        """
+        Appends new (not yet indexed) key codes and returns their row positions.
+
+        :param codes: Key codes of the rows appended to the table, in table order.
+        """
+        start, end = self._length, self._length + len(codes)
+        if end > len(self._codes):
+            grown = np.empty(max(end, int(len(self._codes) * self.growth) + 1), dtype=np.uint64)
+            grown[:start] = self._codes[:start]
+            self._codes = grown
+        self._codes[start:end] = codes
+        self._length = end
+        return np.arange(start, end)
+
+    def rebuild(self, df: pd.DataFrame) -> None:
+        """
+        Rebuilds the index from scratch so it matches the rows of the given table.
+
+        :param df: The table to index.
+        """
+        self._reset(self.encode_keys(df) if not df.empty else np.empty(0, dtype=np.uint64))
+
+    def keep(self, mask: np.ndarray) -> None:
+        """
+        Drops the keys of removed table rows, keeping the index aligned with the table.
+
+        :param mask: Boolean mask over the indexed rows, True for the rows that are kept.
+        """
+        self._reset(self.get_codes()[mask])
+
+    def save(self, file_path: str) -> None:
+        """
+        Saves the key codes to a .npy file, and the dictionaries of the key encoder next
+        to it (see get_encoder_path).
+        """
+        np.save(file_path, self.get_codes())
+        if self.encoder is not None:
+            self.encoder.save(get_encoder_path(file_path))
+
+    def load(self, file_path: str) -> None:
+        """
+        Loads key codes (and encoder dictionaries) previously written by save.
+        """
+        if self.encoder is not None:
+            if not os.path.exists(get_encoder_path(file_path)):
+                raise ValueError(f"Key index {file_path} was saved without a key encoding.")
+            self.encoder.load(get_encoder_path(file_path))
+        elif os.path.exists(get_encoder_path(file_path)):
+            raise ValueError(f"Key index {file_path} was saved with a key encoding.")
+        self._reset(np.load(file_path))
+
+
+def get_encoder_path(file_path: str) -> str:
+    """
+    Returns the path of the key encoder dictionaries saved with a key index file.
+    """
+    return os.path.splitext(file_path)[0] + ".encoder.pkl"
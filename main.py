@@ -1,6 +1,13 @@
 from instructions_provider import InstructionsProvider
-from extended_table import ExtendedTable
+from extended_table import ExtendedTable, SAVE_FORMATS
+from source_cache import SourceCache
+from sharded_build import build_sharded
+from distributed_build import build_distributed, parse_address
+from annotation_cache import AnnotationCache
+from backends import BACKENDS, create_backend
+from instrumentation import Tracer
 from db import Db, VariantsDb, ValidationDb
+import argparse
 import os
 import sys
 
@@ -18,7 +25,81 @@ def get_dbs_dir():
 
 
 
+def select_dbs(found: list[str], selected: list[str] | None) -> list[str]:
+    """
+    Returns the selected db names, or all found ones if none are selected.
+    """
+    if selected is None:
+        return found
+    missing = [name for name in selected if name not in found]
+    if missing:
+        print(f"Databases {missing} were not found in the directory.")
+        sys.exit(1)
+    return selected
+
+
+def parse_args():
+    """
+    Parses the command line options of the build.
+    """
+    parser = argparse.ArgumentParser(description="Build an extended variant annotation table.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes used to load and pre-process the variant databases concurrently.")
+    parser.add_argument("--prefetch", type=int, default=1,
+                        help="Number of databases (or chunks of a streamed database) read and pre-processed ahead of the merge on background threads. 0 disables prefetching.")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Directory used to cache pre-processed databases between runs.")
+    parser.add_argument("--cache-max-gb", type=float, default=None,
+                        help="Maximum size of the cache directory in GB. Least recently used entries are evicted first.")
+    parser.add_argument("--annotation-cache-dir", default=None,
+                        help="Directory used to persist memoized annotation values between runs.")
+    parser.add_argument("--annotation-workers", type=int, default=1,
+                        help="Number of threads used to compute independent annotations concurrently.")
+    parser.add_argument("--output-format", choices=SAVE_FORMATS, default="tsv",
+                        help="Format of the saved table. parquet and arrow write a directory partitioned by chromosome.")
+    parser.add_argument("--shard-by", default=None,
+                        help="Build in shards of this column (e.g. the chromosome column), each on its own worker process.")
+    parser.add_argument("--shard-bin-size", type=int, default=None,
+                        help="Also split shards into position bins of this size.")
+    parser.add_argument("--shard-output-dir", default=None,
+                        help="Save every shard to this directory instead of concatenating the shards.")
+    parser.add_argument("--distributed", action="store_true",
+                        help="Build with a coordinator that hands (database, shard) work units to worker processes. Uses --shard-by, --shard-bin-size and --shard-output-dir.")
+    parser.add_argument("--distributed-workers", type=int, default=1,
+                        help="Number of distributed workers started on this machine. Remote workers join with \"python distributed_build.py worker HOST:PORT\".")
+    parser.add_argument("--coordinator-address", default="localhost:0",
+                        help="host:port the coordinator listens on (e.g. 0.0.0.0:5000 for remote workers). Workers authenticate with the VARIANT_TABLE_AUTHKEY environment variable.")
+    parser.add_argument("--distributed-shards", type=int, default=None,
+                        help="Number of shard buckets of the distributed build (defaults to 4 per local worker).")
+    parser.add_argument("--distributed-work-dir", default=None,
+                        help="Directory for the partial tables of the distributed build, on a filesystem shared with the remote workers.")
+    parser.add_argument("--state-dir", default=None,
+                        help="Directory holding the saved table state. If it already contains a build, only changed databases are merged again.")
+    parser.add_argument("--backend", choices=BACKENDS, default=None,
+                        help="Execution backend of the build. duckdb merges out of core and streams the table to the output file. Defaults to the \"backend\" key of the default variant instructions, or pandas.")
+    parser.add_argument("--backend-memory-limit", default=None,
+                        help="Memory limit of the duckdb backend (e.g. 8GB).")
+    parser.add_argument("--backend-temp-dir", default=None,
+                        help="Local directory the duckdb backend spills to.")
+    parser.add_argument("--chrom-col", default=None,
+                        help="Chromosome key column, used to sort, partition and shard by region. Defaults to the \"chrom_col\" key of the default variant instructions, or \"chrom\" if it is a key column.")
+    parser.add_argument("--pos-col", default=None,
+                        help="Position key column, used to sort by region and bin shards. Defaults to the \"pos_col\" key of the default variant instructions, or \"pos\" if it is a key column.")
+    parser.add_argument("--sources", nargs="+", default=None,
+                        help="Variant databases to build the table from (defaults to all). The instructions of the other databases are not loaded.")
+    parser.add_argument("--validation-sources", nargs="+", default=None,
+                        help="Validation databases to validate the table against (defaults to all).")
+    parser.add_argument("--trace-file", default=None,
+                        help="Write the spans of the build stages to this JSON file (Chrome trace event format).")
+    parser.add_argument("--metrics-file", default=None,
+                        help="Write the stage metrics to this file in the Prometheus textfile format.")
+    parser.add_argument("--profile-dir", default=None,
+                        help="Profile the annotation compute functions with cProfile and write the statistics to this directory.")
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
     dbs_dir = input("Please enter the path to the databases directory: ")
     while (not os.path.isdir(dbs_dir)):
         print(f"Directory \"{dbs_dir}\" does not exist. Please check the path and try again or press 'X' to exit.")
@@ -26,17 +107,30 @@ def main():
         if usr_input.lower() == 'x':
             sys.exit(0)
         dbs_dir = usr_input
-    sys.path.append(dbs_dir)
-
-    instructions_provider = InstructionsProvider(dbs_dir)
+    tracer = Tracer(profile_dir=args.profile_dir)
+    try:
+        build(args, dbs_dir, tracer)
+    finally:
+        if args.trace_file is not None:
+            tracer.write_json(args.trace_file)
+        if args.metrics_file is not None:
+            tracer.write_prometheus(args.metrics_file)
+        tracer.write_profiles()
+
+
+def build(args, dbs_dir: str, tracer: Tracer):
+    """
+    Builds the extended table of a dbs directory.
+    """
+    instructions_provider = InstructionsProvider(dbs_dir, tracer)
 
 
 
 
     # itereate over the directories in the dbs_dir
-    variants_dbs = instructions_provider.get_dbs_names()
+    variants_dbs = select_dbs(instructions_provider.get_dbs_names(), args.sources)
     print(f"Databases found in the directory: {variants_dbs}")
-    validation_dbs = instructions_provider.get_dbs_names("validation")
+    validation_dbs = select_dbs(instructions_provider.get_dbs_names("validation"), args.validation_sources)
     print(f"Validation databases found in the directory: {validation_dbs}")
 
     annotations_cols = instructions_provider.get_annotations_names()
@@ -54,21 +148,70 @@ def main():
 
 
 
-    # Create an ExtendedTable instance
-    extended_table = ExtendedTable(key_cols=key_cols, instructions_provider=instructions_provider, variant_dbs=variant_db_instances, validation_dbs=validation_db_instances, ann_cols=annotations_cols)
-
-    extended_table.merge_all_dbs()
-    extended_table.validate_table()
-    print("All databases merged into the extended table.")
-    print(f"Extended table: \n{extended_table.table}")
+    source_cache = None
+    if args.cache_dir is not None:
+        max_bytes = int(args.cache_max_gb * 1024 ** 3) if args.cache_max_gb is not None else None
+        source_cache = SourceCache(args.cache_dir, max_bytes)
 
-    usr_input = input("Do you want to save the table to a file? (y/n): ")
-    if usr_input.lower() == 'y':
-        # Save the file in the current pwd
-        file_path = os.path.join(os.getcwd(), "extended_table.tsv")
-        extended_table.save_table(file_path, "tsv")
+    backend_name = args.backend or instructions_provider.get_variants_instructions_map().get("backend", "pandas")
+    save = None
+    if backend_name == "pandas":
+        backend = create_backend(backend_name)
     else:
-        print("Table not saved.")
+        if args.shard_by is not None or args.state_dir is not None or args.distributed:
+            print("--shard-by, --distributed and --state-dir are only supported by the pandas backend.")
+            sys.exit(1)
+        # Out-of-core backends only build the table while saving it, so ask up front.
+        save = input("Do you want to save the table to a file? (y/n): ").lower() == 'y'
+        if not save:
+            print(f"Table not built, as the {backend_name} backend builds the table while saving it.")
+            return
+        backend = create_backend(backend_name, memory_limit=args.backend_memory_limit, temp_directory=args.backend_temp_dir)
+    variants_instructions = instructions_provider.get_variants_instructions_map()
+    chrom_col = args.chrom_col or variants_instructions.get("chrom_col")
+    pos_col = args.pos_col or variants_instructions.get("pos_col")
+    try:
+        backend.check_format(args.output_format)
+
+        # Create an ExtendedTable instance
+        extended_table = ExtendedTable(key_cols=key_cols, instructions_provider=instructions_provider, variant_dbs=variant_db_instances, validation_dbs=validation_db_instances, ann_cols=annotations_cols, workers=args.workers, source_cache=source_cache, annotation_cache=AnnotationCache(args.annotation_cache_dir), annotation_workers=args.annotation_workers, chrom_col=chrom_col, pos_col=pos_col, backend=backend, tracer=tracer, prefetch=args.prefetch)
+        extended_table.check_region_cols(args.output_format)
+
+        if args.distributed:
+            build_distributed(extended_table, local_workers=args.distributed_workers, address=parse_address(args.coordinator_address),
+                              shards=args.distributed_shards, shard_col=args.shard_by, bin_size=args.shard_bin_size,
+                              work_dir=args.distributed_work_dir, output_dir=args.shard_output_dir, output_format=args.output_format)
+            if args.shard_output_dir is not None:
+                return
+        elif args.shard_by is not None:
+            build_sharded(extended_table, workers=args.workers, shard_col=args.shard_by, bin_size=args.shard_bin_size,
+                          output_dir=args.shard_output_dir, output_format=args.output_format)
+            if args.shard_output_dir is not None:
+                return
+        elif args.state_dir is not None and os.path.isfile(os.path.join(args.state_dir, "manifest.json")):
+            extended_table.load_state(args.state_dir)
+            extended_table.rebuild_incremental()
+            extended_table.validate_table()
+        else:
+            extended_table.merge_all_dbs()
+            extended_table.validate_table()
+        if args.state_dir is not None:
+            extended_table.save_state(args.state_dir)
+        print("All databases merged into the extended table.")
+        if backend_name == "pandas":
+            print(f"Extended table: \n{extended_table.table}")
+            print(f"Memory usage: \n{extended_table.memory_usage_report()}")
+
+        if save is None:
+            save = input("Do you want to save the table to a file? (y/n): ").lower() == 'y'
+        if save:
+            # Save the file in the current pwd
+            file_path = os.path.join(os.getcwd(), f"extended_table.{args.output_format}")
+            extended_table.save_table(file_path, args.output_format)
+        else:
+            print("Table not saved.")
+    finally:
+        backend.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
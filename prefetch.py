@@ -0,0 +1,98 @@
+import queue
+import threading
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from db import Db
+
+# Markers of the items passed from the reader thread of prefetch_iter.
+_ITEM, _DONE, _ERROR = range(3)
+
+
+def load_db(db: Db) -> None:
+    """
+    Uploads and pre-processes a db unless it is already loaded. Streaming dbs are left
+    to be read chunk by chunk (see prefetch_iter).
+    """
+    if db.df is None and db.chunk_size is None:
+        db.upload_pre_processed()
+    elif db.df is not None and not db.pre_processed:
+        db.pre_process()
+
+
+def prefetch_dbs(dbs: Iterable[Db], depth: int = 1) -> Iterator[Db]:
+    """
+    Yields the dbs in order, each uploaded and pre-processed, while background threads
+    already read and decode the next ones.
+
+    At most `depth` dbs are loaded ahead of the one being consumed, so no more than
+    depth + 1 decoded sources are held in memory at a time (provided the consumer
+    clears each db before asking for the next one). Reading, decompression and parsing
+    mostly release the GIL, so they overlap with the consumer's work.
+
+    :param dbs: The dbs to load.
+    :param depth: Number of dbs loaded ahead.
+    """
+    dbs = iter(dbs)
+    pending: deque = deque()
+    with ThreadPoolExecutor(max_workers=max(depth, 1), thread_name_prefix="prefetch") as executor:
+        def submit() -> None:
+            db = next(dbs, None)
+            if db is not None:
+                pending.append((db, executor.submit(load_db, db)))
+
+        for _ in range(max(depth, 1)):
+            submit()
+        while pending:
+            db, future = pending.popleft()
+            future.result()
+            # Start reading the next db before handing this one over.
+            submit()
+            yield db
+
+
+def prefetch_iter(items: Iterable, depth: int = 1) -> Iterator:
+    """
+    Iterates over an iterable (e.g. the chunks of Db.iter_chunks) on a background thread,
+    keeping up to `depth` items ready in a bounded queue. The reader blocks while the
+    queue is full, which bounds the memory held by items read ahead. Exceptions of the
+    reader are raised in the consumer.
+
+    :param items: The iterable to read ahead.
+    :param depth: Maximum number of items waiting in the queue.
+    """
+    ready: queue.Queue = queue.Queue(maxsize=max(depth, 1))
+    stop = threading.Event()
+
+    def put(entry: tuple) -> bool:
+        # Wait for room in the queue, giving up once the consumer has stopped.
+        while not stop.is_set():
+            try:
+                ready.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read() -> None:
+        try:
+            for item in items:
+                if not put((_ITEM, item)):
+                    return
+            put((_DONE, None))
+        except BaseException as e:
+            put((_ERROR, e))
+
+    reader = threading.Thread(target=read, name="prefetch-reader", daemon=True)
+    reader.start()
+    try:
+        while True:
+            kind, value = ready.get()
+            if kind == _DONE:
+                return
+            if kind == _ERROR:
+                raise value
+            yield value
+    finally:
+        stop.set()
+        reader.join()
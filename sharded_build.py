@@ -0,0 +1,211 @@
+import copy
+import os
+import pickle
+import shutil
+import tempfile
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+import pandas as pd
+from annotation_cache import AnnotationCache
+from db import Db, VariantsDb, get_rule_columns
+from extended_table import ExtendedTable
+from instrumentation import Tracer
+
+
+def get_shard_ids(df: pd.DataFrame, shard_col: str, pos_col: str, bin_size: int | None = None) -> pd.Series:
+    """
+    Returns the shard of every row: the value of the shard column, followed by the
+    position bin when a bin size is given (e.g. "1_12" for chromosome 1, bin 12).
+    """
+    shard_ids = df[shard_col].astype(str)
+    if bin_size is not None:
+        shard_ids = shard_ids + "_" + (df[pos_col] // bin_size).astype(str)
+    return shard_ids
+
+
+def get_shard_col(extended_table: ExtendedTable, shard_col: str | None, bin_size: int | None) -> str:
+    """
+    Returns the column to shard by, defaulting to the chromosome column. Raises a
+    ValueError if there is no such column, or no position column to bin by.
+    """
+    shard_col = shard_col if shard_col is not None else extended_table.chrom_col
+    if shard_col is None:
+        raise ValueError("The table has no chromosome column to shard by. Pass a shard column.")
+    if bin_size is not None and extended_table.pos_col is None:
+        raise ValueError("Sharding by position bins needs a position column. Set pos_col.")
+    return shard_col
+
+
+def get_shard_path(work_dir: str, shard: str, part: str) -> str:
+    """
+    Returns the path of a db's partition for a shard inside the work directory.
+    """
+    return os.path.join(work_dir, quote(shard, safe=""), f"{part}.pkl")
+
+
+def get_partition_cols(extended_table: ExtendedTable, db: Db) -> list[str] | None:
+    """
+    Returns the columns of a db that its shards need: the input columns of a variant db,
+    the key and rule columns of a rule-based validation db, or None (all columns) for a
+    validation db with a validator function.
+    """
+    if isinstance(db, VariantsDb):
+        return extended_table.get_input_cols(db)
+    if db.rules is not None:
+        return list(dict.fromkeys(db.key_cols + get_rule_columns(db.rules)))
+    return None
+
+
+def iter_db_chunks(db: Db, columns: list[str] | None) -> Iterator[pd.DataFrame]:
+    """
+    Yields the given columns of the pre-processed db chunk by chunk when it is streamed,
+    or as one frame.
+    """
+    if db.df is None and db.chunk_size is not None:
+        for chunk in db.iter_chunks():
+            yield chunk if columns is None else chunk[columns]
+    else:
+        yield db.load_columns(columns)
+
+
+def partition_db(db: Db, part: str, columns: list[str] | None, shard_col: str, pos_col: str, bin_size: int | None, work_dir: str) -> list[str]:
+    """
+    Loads and pre-processes a db and appends its rows to one file per shard, chunk by chunk
+    when the db is streamed. Returns the shards the db has rows in.
+
+    :param db: The db to partition.
+    :param part: Name of the db's files inside every shard directory.
+    :param columns: The columns to keep, or None for all columns.
+    """
+    shards = []
+    for df in iter_db_chunks(db, columns):
+        for shard, rows in df.groupby(get_shard_ids(df, shard_col, pos_col, bin_size), sort=False):
+            path = get_shard_path(work_dir, shard, part)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Every chunk is pickled after the previous ones (see read_shard_file).
+            with open(path, "ab") as f:
+                pickle.dump(rows.reset_index(drop=True), f)
+            if shard not in shards:
+                shards.append(shard)
+    return shards
+
+
+def read_shard_file(path: str) -> pd.DataFrame:
+    """
+    Returns the rows of a db's partition for a shard, written by partition_db.
+    """
+    frames = []
+    with open(path, "rb") as f:
+        while True:
+            try:
+                frames.append(pickle.load(f))
+            except EOFError:
+                break
+    return pd.concat(frames, ignore_index=True)
+
+
+def build_shard(extended_table: ExtendedTable, shard: str, work_dir: str, output_path: str | None, output_format: str) -> str:
+    """
+    Runs the merge, annotation and validation pipeline on one shard. The shard table is
+    saved to output_path in output_format, or pickled into the work directory when no
+    output path is given. Returns the path of the written table.
+
+    The shard uses the merge strategy and annotation settings of the extended table. Its
+    dbs are the pre-processed partitions, so the source cache (used when partitioning) is
+    not consulted again. Spans recorded in the shard stay in the worker (see Tracer), and
+    profiles are written to a subdirectory of the profile directory per shard.
+    """
+    def load_shard(db: Db, part: str) -> Db:
+        shard_db = copy.copy(db)
+        path = get_shard_path(work_dir, shard, part)
+        if os.path.isfile(path):
+            shard_db.df = read_shard_file(path)
+        else:
+            columns = get_partition_cols(extended_table, db)
+            shard_db.df = pd.DataFrame(columns=columns if columns is not None else db.key_cols)
+        shard_db.pre_processed = True
+        return shard_db
+
+    tracer = extended_table.tracer
+    if tracer.profile_dir is not None:
+        tracer = Tracer(tracer.enabled, os.path.join(tracer.profile_dir, quote(shard, safe="")))
+    shard_table = ExtendedTable(
+        key_cols=extended_table.key_cols,
+        instructions_provider=extended_table.instructions_provider,
+        variant_dbs=[load_shard(db, f"variants-{i}") for i, db in enumerate(extended_table.variant_dbs)],
+        validation_dbs=[load_shard(db, f"validation-{i}") for i, db in enumerate(extended_table.validation_dbs)],
+        ann_cols=extended_table.ann_cols,
+        merge_strategy=extended_table.merge_strategy,
+        annotation_cache=AnnotationCache(extended_table.annotation_cache.cache_dir),
+        annotation_workers=extended_table.annotation_scheduler.workers,
+        compact=extended_table.compact,
+        chrom_col=extended_table.chrom_col,
+        pos_col=extended_table.pos_col,
+        tracer=tracer,
+    )
+    shard_table.merge_all_dbs()
+    shard_table.validate_table()
+    tracer.write_profiles()
+    if output_path is None:
+        output_path = os.path.join(work_dir, quote(shard, safe=""), "table.pkl")
+        shard_table.table.to_pickle(output_path)
+    else:
+        shard_table.save_table(output_path, output_format)
+    return output_path
+
+
+def build_sharded(extended_table: ExtendedTable, workers: int = 1, shard_col: str | None = None, bin_size: int | None = None, output_dir: str | None = None, output_format: str = "tsv") -> None:
+    """
+    Builds the extended table in shards (by chromosome, or by chromosome and position bin)
+    on a process pool. The merge is keyed on the variant key, so shards are independent.
+
+    Every db is first loaded once and split into per-shard files. Each shard then runs
+    the whole merge, annotation and validation pipeline in its own worker, so worker
+    memory is bounded by the shard size. When output_dir is given, every shard is saved
+    there as "<shard>.<output_format>"; otherwise the shards are concatenated into
+    extended_table.table.
+
+    :param extended_table: The table to build, with its dbs registered.
+    :param workers: Number of worker processes.
+    :param shard_col: The column to shard by (defaults to the chromosome column).
+    :param bin_size: Optional position bin size, to split chromosomes further.
+    :param output_dir: Directory for the shard outputs, or None to concatenate them.
+    :param output_format: Format of the shard outputs, one of the save_table formats.
+    """
+    shard_col = get_shard_col(extended_table, shard_col, bin_size)
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="shards-", dir=output_dir)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Partition every db by shard.
+            futures = [executor.submit(partition_db, db, f"variants-{i}", get_partition_cols(extended_table, db),
+                                       shard_col, extended_table.pos_col, bin_size, work_dir)
+                       for i, db in enumerate(extended_table.variant_dbs)]
+            futures += [executor.submit(partition_db, db, f"validation-{i}", get_partition_cols(extended_table, db),
+                                        shard_col, extended_table.pos_col, bin_size, work_dir)
+                        for i, db in enumerate(extended_table.validation_dbs)]
+            shards = list(dict.fromkeys(shard for future in futures for shard in future.result()))
+            print(f"Databases partitioned into {len(shards)} shards.")
+
+            # Build every shard independently.
+            futures = []
+            for shard in shards:
+                output_path = (os.path.join(output_dir, f"{quote(shard, safe='')}.{output_format}")
+                               if output_dir is not None else None)
+                futures.append(executor.submit(build_shard, extended_table, shard, work_dir, output_path, output_format))
+            paths = [future.result() for future in futures]
+
+        if output_dir is None:
+            extended_table.table = pd.concat([pd.read_pickle(path) for path in paths], ignore_index=True)
+            extended_table.key_index.rebuild(extended_table.table)
+            if extended_table.compact:
+                extended_table.compact_table()
+            for db in extended_table.variant_dbs:
+                extended_table.record_source(db)
+            print(f"Sharded build finished: {len(extended_table.table)} variants in {len(shards)} shards.")
+        else:
+            print(f"Sharded build finished: {len(shards)} shards saved to {output_dir}.")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,162 @@
+import functools
+import hashlib
+import os
+import pandas as pd
+
+
+def instructions_fingerprint(instructions: dict[str, any]) -> str:
+    """
+    Returns a stable hash of merged db instructions. Functions are hashed by their
+    qualified name, compiled code and the contents of the file defining them, so editing
+    a pre_processor or a module global it reads (e.g. a threshold) changes the fingerprint.
+
+    :param instructions: The instructions, as returned by InstructionsProvider.get_final_instructions.
+    """
+    digest = hashlib.sha256()
+
+    def update(value: any) -> None:
+        if isinstance(value, dict):
+            digest.update(b"{")
+            for key in sorted(value, key=str):
+                update(key)
+                update(value[key])
+            digest.update(b"}")
+        elif isinstance(value, (list, tuple)):
+            digest.update(b"[")
+            for item in value:
+                update(item)
+            digest.update(b"]")
+        elif hasattr(value, "__code__"):
+            digest.update(f"{value.__module__}.{value.__qualname__}".encode())
+            update_code(value.__code__)
+            digest.update(file_fingerprint(value.__code__.co_filename).encode())
+        else:
+            digest.update(repr(value).encode())
+
+    def update_code(code) -> None:
+        digest.update(code.co_code)
+        digest.update(repr(code.co_names).encode())
+        for const in code.co_consts:
+            if hasattr(const, "co_code"):
+                update_code(const)
+            else:
+                digest.update(repr(const).encode())
+
+    update(instructions)
+    return digest.hexdigest()
+
+
+def file_fingerprint(file_path: str) -> str:
+    """
+    Returns the hash of a file's contents, or an empty string if there is no such file
+    (e.g. functions defined interactively). Hashes are memoized per path, size and
+    modification time.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return ""
+    return _file_fingerprint(os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=256)
+def _file_fingerprint(file_path: str, size: int, mtime_ns: int) -> str:
+    with open(file_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def source_fingerprint(db_path: str, instructions: dict[str, any]) -> str:
+    """
+    Returns the fingerprint of a db source: its file path, size and modification time
+    combined with the fingerprint of its instructions and the contents of the
+    instructions.py files of the db and of the default db next to it.
+
+    :param db_path: Path to the db file.
+    :param instructions: The merged instructions of the db.
+    """
+    stat = os.stat(db_path)
+    digest = hashlib.sha256()
+    digest.update(os.path.abspath(db_path).encode())
+    digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    digest.update(instructions_fingerprint(instructions).encode())
+    db_dir = os.path.dirname(os.path.abspath(db_path))
+    for instructions_path in (os.path.join(db_dir, "instructions.py"),
+                              os.path.join(os.path.dirname(db_dir), "default", "instructions.py")):
+        digest.update(file_fingerprint(instructions_path).encode())
+    return digest.hexdigest()
+
+
+class SourceCache:
+    """
+    On-disk cache of pre-processed db frames, stored as uncompressed Feather (Arrow IPC)
+    files so that they can be memory-mapped on later runs. Entries are keyed by the
+    source fingerprint and evicted least-recently-used first once the cache grows past
+    max_bytes.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int | None = None) -> None:
+        """
+        Initializes a source cache.
+
+        :param cache_dir: Directory holding the cached files (created if missing).
+        :param max_bytes: Maximum total size of the cache, or None for no limit.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_path(self, db) -> str:
+        """
+        Returns the cache file path for a db.
+        """
+        return os.path.join(self.cache_dir, f"{source_fingerprint(db.db_path, db.instructions)}.feather")
+
+    def get(self, db) -> pd.DataFrame | None:
+        """
+        Returns the cached pre-processed frame of a db, or None if it is not cached.
+        """
+        from pyarrow import feather
+
+        path = self.get_path(db)
+        if not os.path.isfile(path):
+            return None
+        # Touch the entry so that eviction drops the least recently used files first.
+        os.utime(path)
+        return feather.read_table(path, memory_map=True).to_pandas()
+
+    def put(self, db, df: pd.DataFrame) -> None:
+        """
+        Stores the pre-processed frame of a db and evicts old entries if needed.
+        Frames that cannot be represented in Arrow are not cached.
+        """
+        import pyarrow as pa
+        from pyarrow import feather
+
+        path = self.get_path(db)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            feather.write_feather(df.reset_index(drop=True), tmp_path, compression="uncompressed")
+        except (pa.ArrowException, ValueError, TypeError) as e:
+            print(f"Database '{db.name}' was not cached: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used entries until the cache fits in max_bytes.
+        """
+        if self.max_bytes is None:
+            return
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".feather"):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
@@ -0,0 +1,308 @@
+import numpy as np
+import pandas as pd
+
+INT_DTYPES = [np.dtype(np.int8), np.dtype(np.int16), np.dtype(np.int32), np.dtype(np.int64)]
+
+
+class TableBuffers:
+    """
+    Column buffers that the extended table is appended into.
+
+    Every column is a NumPy array with spare capacity, grown geometrically, so appending
+    rows copies only the new rows (and the table once per growth step) instead of
+    concatenating the whole table on every merge. Categorical columns are stored as codes
+    with their categories, indicator columns as uint8, and with downcast, integer columns
+    in the smallest integer type that holds them, so the buffers already hold the compact
+    dtypes of ExtendedTable.compact_table. Unseen categories get the next code as they
+    arrive, and are sorted (as astype("category") does) by the next to_frame.
+
+    to_frame returns a DataFrame view of the buffers. Numeric and categorical columns are
+    not copied, and a column viewed by a returned frame is copied before it is updated in
+    place (e.g. indicator bits), so returned frames never change afterwards. Other columns
+    (e.g. strings) are materialized again on every call.
+    """
+    def __init__(self, category_cols: list[str] | None = None, indicator_cols: list[str] | None = None, downcast: bool = False, growth: float = 1.5) -> None:
+        """
+        Initializes empty table buffers.
+
+        :param category_cols: Text columns stored as categoricals.
+        :param indicator_cols: Indicator columns stored as uint8.
+        :param downcast: Whether integer columns are stored in the smallest integer type that holds them.
+        :param growth: Factor by which the capacity grows when the buffers are full.
+        """
+        self.category_cols = set(category_cols or [])
+        self.indicator_cols = set(indicator_cols or [])
+        self.downcast = downcast
+        self.growth = growth
+        self.columns: list[str] = []
+        self.data: dict[str, np.ndarray] = {}
+        # Categories of the categorical columns in code order, and the code of every category.
+        self.categories: dict[str, list] = {}
+        self.category_codes: dict[str, dict[any, int]] = {}
+        # pandas dtypes of the columns that are not stored as their NumPy dtype (e.g. "str").
+        self.dtypes: dict[str, any] = {}
+        # Arrays handed out by to_frame for the columns that are materialized on every call,
+        # and dtypes handed out for the categorical columns.
+        self._exported: dict[str, any] = {}
+        # Columns whose buffers are viewed by a frame returned by to_frame.
+        self._shared: set[str] = set()
+        # Categorical columns with categories added since they were last sorted.
+        self._unsorted: set[str] = set()
+        self.length = 0
+        self.capacity = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __contains__(self, col: str) -> bool:
+        return col in self.data
+
+    def sync(self, df: pd.DataFrame) -> None:
+        """
+        Makes the buffers hold the values of a frame. Columns that are still views of the
+        buffers (e.g. the frame is the last output of to_frame) are kept, all others are
+        copied in, so a frame that was changed since to_frame is picked up correctly.
+        """
+        if len(df) != self.length:
+            for mapping in (self.data, self.categories, self.category_codes, self.dtypes, self._exported):
+                mapping.clear()
+            self._shared.clear()
+            self._unsorted.clear()
+            self.length = len(df)
+            self.capacity = self._grown_capacity(len(df))
+        for col in df.columns:
+            if not self._is_view(col, df[col]):
+                self._load_column(col, df[col])
+        for col in [col for col in self.data if col not in df.columns]:
+            self._drop_column(col)
+        self.columns = list(df.columns)
+
+    def add_column(self, col: str, dtype: any = np.int64) -> None:
+        """
+        Adds a column filled with zeros (uint8 for indicator columns).
+        """
+        dtype = np.uint8 if col in self.indicator_cols else dtype
+        self.data[col] = np.zeros(self.capacity, dtype=dtype)
+        self.columns.append(col)
+
+    def set_values(self, col: str, positions: np.ndarray, value: any) -> None:
+        """
+        Sets the value of a column at the given rows, in place. A column viewed by a frame
+        returned by to_frame is copied first.
+        """
+        if col in self._shared:
+            self.data[col] = self.data[col].copy()
+            self._shared.discard(col)
+        self.data[col][positions] = value
+
+    def append(self, df: pd.DataFrame) -> None:
+        """
+        Appends the rows of a frame. Columns missing from the frame are filled with 0
+        (missing for categorical columns), and columns that are not in the buffers are
+        ignored, like reindexing the frame to the table columns.
+        """
+        rows = len(df)
+        if rows == 0:
+            return
+        self._reserve(self.length + rows)
+        start, end = self.length, self.length + rows
+        for col in self.columns:
+            if start == 0 and col in self.category_cols and col in df.columns and not pd.api.types.is_numeric_dtype(df[col].dtype):
+                # Columns of an empty table get their storage from the first rows.
+                self.dtypes.pop(col, None)
+                self._set_categories(col, [])
+                self.data[col] = np.empty(self.capacity, dtype=codes_dtype(0))
+            if col in self.categories:
+                values = np.asarray(df[col], dtype=object) if col in df.columns else np.full(rows, np.nan, dtype=object)
+                self.data[col][start:end] = self._encode(col, values)
+                continue
+            if col in df.columns:
+                series = df[col]
+                values = series.to_numpy()
+            else:
+                series, values = None, np.zeros(rows, dtype=np.uint8)
+            if start == 0:
+                if series is not None and not isinstance(series.dtype, np.dtype):
+                    self.dtypes[col] = series.dtype
+                else:
+                    self.dtypes.pop(col, None)
+            dtype = self._fit_dtype(col, values)
+            if dtype != self.data[col].dtype:
+                # Only the stored rows are converted, the rest of the buffer may be unset.
+                converted = np.empty(self.capacity, dtype=dtype)
+                converted[:start] = self.data[col][:start]
+                self.data[col] = converted
+            self.data[col][start:end] = values
+        self.length = end
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Returns the table as a DataFrame viewing the buffers.
+        """
+        data = {}
+        for col in self.columns:
+            if col in self._unsorted:
+                self._sort_categories(col)
+            values = self.data[col][:self.length]
+            if col in self.categories:
+                if col not in self._exported:
+                    self._exported[col] = pd.CategoricalDtype(pd.Index(self.categories[col]))
+                data[col] = pd.Categorical.from_codes(values, dtype=self._exported[col], validate=False)
+            elif col in self.dtypes:
+                data[col] = self._exported[col] = pd.array(values, dtype=self.dtypes[col])
+            else:
+                data[col] = values
+        self._shared = set(self.columns)
+        return pd.DataFrame(data, columns=self.columns, copy=False)
+
+    def _is_view(self, col: str, series: pd.Series) -> bool:
+        """
+        Returns whether a frame column is the view of the buffers that to_frame returned.
+        """
+        if col not in self.data:
+            return False
+        if col in self.categories:
+            return series.dtype == self._exported.get(col) and shares_start(series.array.codes, self.data[col])
+        if col in self.dtypes:
+            return series.array is self._exported.get(col)
+        return isinstance(series.dtype, np.dtype) and shares_start(series.to_numpy(), self.data[col])
+
+    def _load_column(self, col: str, series: pd.Series) -> None:
+        """
+        Copies a frame column into a new buffer, in its stored dtype.
+        """
+        self._drop_column(col)
+        if col in self.indicator_cols:
+            values = series.fillna(0).to_numpy(dtype=np.uint8)
+        elif col in self.category_cols and len(series) > 0 and not pd.api.types.is_numeric_dtype(series.dtype):
+            categorical = series if isinstance(series.dtype, pd.CategoricalDtype) else series.astype("category")
+            self._set_categories(col, list(categorical.cat.categories))
+            values = categorical.array.codes
+        else:
+            if not isinstance(series.dtype, np.dtype):
+                self.dtypes[col] = series.dtype
+            values = series.to_numpy()
+            if self.downcast and values.dtype.kind in "iu" and len(values) > 0:
+                values = values.astype(smallest_int_dtype(values.min(), values.max()))
+        self.data[col] = np.empty(self.capacity, dtype=values.dtype)
+        self.data[col][:self.length] = values
+
+    def _drop_column(self, col: str) -> None:
+        for mapping in (self.data, self.categories, self.category_codes, self.dtypes, self._exported):
+            mapping.pop(col, None)
+        self._shared.discard(col)
+        self._unsorted.discard(col)
+
+    def _set_categories(self, col: str, categories: list) -> None:
+        self.categories[col] = categories
+        self.category_codes[col] = dict(zip(categories, range(len(categories))))
+        self._exported.pop(col, None)
+
+    def _encode(self, col: str, values: np.ndarray) -> np.ndarray:
+        """
+        Returns the category codes of values, giving unseen values the next codes. The
+        values are factorized first, so categories are looked up once per distinct value.
+        """
+        row_codes, uniques = pd.factorize(values)
+        categories, category_codes = self.categories[col], self.category_codes[col]
+        # The extra last entry maps the missing-value code -1 to itself.
+        codes = np.array([category_codes.get(value, -1) for value in uniques] + [-1], dtype=np.int64)
+        unseen = np.flatnonzero(codes[:-1] < 0)
+        if len(unseen) > 0:
+            codes[unseen] = np.arange(len(categories), len(categories) + len(unseen))
+            new_categories = list(np.asarray(uniques, dtype=object)[unseen])
+            category_codes.update(zip(new_categories, codes[unseen].tolist()))
+            categories.extend(new_categories)
+            self._unsorted.add(col)
+            self._exported.pop(col, None)
+        dtype = codes_dtype(len(categories))
+        if dtype.itemsize > self.data[col].dtype.itemsize:
+            widened = np.empty(self.capacity, dtype=dtype)
+            widened[:self.length] = self.data[col][:self.length]
+            self.data[col] = widened
+        return codes[row_codes]
+
+    def _sort_categories(self, col: str) -> None:
+        """
+        Sorts the categories of a column (unless they are not comparable) and recodes its
+        rows into a new buffer.
+        """
+        self._unsorted.discard(col)
+        categories = pd.Index(self.categories[col])
+        try:
+            order = categories.argsort()
+        except TypeError:
+            return
+        # The extra last entry maps the missing-value code -1 to itself.
+        recode = np.full(len(categories) + 1, -1, dtype=np.int64)
+        recode[order] = np.arange(len(categories))
+        recoded = np.empty(self.capacity, dtype=self.data[col].dtype)
+        recoded[:self.length] = recode[self.data[col][:self.length]]
+        self.data[col] = recoded
+        self._shared.discard(col)
+        self._set_categories(col, list(np.asarray(self.categories[col], dtype=object)[order]))
+
+    def _fit_dtype(self, col: str, values: np.ndarray) -> np.dtype:
+        """
+        Returns the dtype a column needs to also hold the appended values. The first rows
+        of an empty column set its dtype.
+        """
+        current = self.data[col].dtype if self.length > 0 else None
+        if values.dtype.kind in "iu" and len(values) > 0 and (self.downcast or col in self.indicator_cols):
+            low, high = values.min(), values.max()
+            if current is not None and current.kind in "iu":
+                if np.iinfo(current).min <= low and high <= np.iinfo(current).max:
+                    return current
+                low, high = min(low, np.iinfo(current).min), max(high, np.iinfo(current).max)
+            elif current is not None and current.kind != "b":
+                return np.result_type(current, values.dtype)
+            if col in self.indicator_cols and 0 <= low and high <= 255 and current in (None, np.dtype(np.uint8)):
+                return np.dtype(np.uint8)
+            return smallest_int_dtype(low, high)
+        if current is None:
+            return values.dtype
+        return np.result_type(current, values.dtype)
+
+    def _reserve(self, rows: int) -> None:
+        """
+        Grows the buffers geometrically until they hold at least the given number of rows.
+        """
+        if rows <= self.capacity:
+            return
+        self.capacity = self._grown_capacity(rows)
+        for col, buffer in self.data.items():
+            grown = np.empty(self.capacity, dtype=buffer.dtype)
+            grown[:self.length] = buffer[:self.length]
+            self.data[col] = grown
+
+    def _grown_capacity(self, rows: int) -> int:
+        return max(rows, int(self.capacity * self.growth) + 1)
+
+
+def smallest_int_dtype(low: int, high: int) -> np.dtype:
+    """
+    Returns the smallest signed integer dtype holding the range [low, high], like
+    pd.to_numeric(..., downcast="integer").
+    """
+    for dtype in INT_DTYPES:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return dtype
+    return np.dtype(np.uint64) if low >= 0 else np.dtype(np.int64)
+
+
+def codes_dtype(n_categories: int) -> np.dtype:
+    """
+    Returns the dtype pandas uses for the codes of a categorical with n categories.
+    """
+    for dtype in INT_DTYPES:
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return INT_DTYPES[-1]
+
+
+def shares_start(values: np.ndarray, buffer: np.ndarray) -> bool:
+    """
+    Returns whether an array is a view of the start of a buffer.
+    """
+    return (isinstance(values, np.ndarray) and values.dtype == buffer.dtype
+            and values.__array_interface__["data"][0] == buffer.__array_interface__["data"][0])
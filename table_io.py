@@ -0,0 +1,326 @@
+import io
+import json
+import os
+import struct
+import zlib
+import numpy as np
+import pandas as pd
+
+# Maximum uncompressed payload of a BGZF block, as used by bgzip.
+BGZF_BLOCK_SIZE = 0xff00
+# The empty block that terminates every BGZF file.
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def sort_by_region(df: pd.DataFrame, chrom_col: str, pos_col: str) -> pd.DataFrame:
+    """
+    Returns the table sorted by chromosome and position (stable, so ties keep table order).
+    """
+    return df.sort_values([chrom_col, pos_col], kind="stable", ignore_index=True)
+
+
+def iter_chromosomes(df: pd.DataFrame, chrom_col: str):
+    """
+    Yields (chromosome, rows) for every chromosome of a table sorted by region.
+    """
+    chroms = df[chrom_col].to_numpy()
+    if len(chroms) == 0:
+        return
+    starts = np.flatnonzero(np.r_[True, chroms[1:] != chroms[:-1]])
+    ends = np.r_[starts[1:], len(chroms)]
+    for start, end in zip(starts, ends):
+        yield chroms[start], df.iloc[start:end]
+
+
+def get_partition_dir(root: str, chrom_col: str, chrom: any) -> str:
+    """
+    Returns the hive-style partition directory of a chromosome.
+    """
+    return os.path.join(root, f"{chrom_col}={chrom}")
+
+
+def write_parquet(df: pd.DataFrame, root: str, chrom_col: str, pos_col: str, row_group_size: int = 1_000_000) -> None:
+    """
+    Writes the table as a Parquet dataset partitioned by chromosome (hive-style
+    <chrom_col>=<chrom> directories). Rows are sorted by position, so the row group
+    statistics let readers skip row groups outside a region. Chromosomes are converted to
+    Arrow one at a time, so the whole table is never copied at once.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(root, exist_ok=True)
+    for chrom, rows in iter_chromosomes(sort_by_region(df, chrom_col, pos_col), chrom_col):
+        partition_dir = get_partition_dir(root, chrom_col, chrom)
+        os.makedirs(partition_dir, exist_ok=True)
+        table = pa.Table.from_pandas(rows.drop(columns=[chrom_col]), preserve_index=False)
+        pq.write_table(table, os.path.join(partition_dir, "part-0.parquet"),
+                       row_group_size=row_group_size, write_statistics=True)
+
+
+def write_arrow(df: pd.DataFrame, root: str, chrom_col: str, pos_col: str, batch_size: int = 65_536) -> None:
+    """
+    Writes the table as Arrow IPC files partitioned by chromosome (hive-style
+    <chrom_col>=<chrom> directories), sorted by position and split into record batches
+    of batch_size rows. Files are uncompressed so that readers can memory-map them.
+
+    A sidecar "index.json" records, for every chromosome, its file and the first and
+    last position of each record batch, which TableStore uses to answer region queries.
+    """
+    import pyarrow as pa
+
+    os.makedirs(root, exist_ok=True)
+    index: dict[str, any] = {"chrom_col": chrom_col, "pos_col": pos_col, "columns": list(df.columns), "chromosomes": {}}
+    for chrom, rows in iter_chromosomes(sort_by_region(df, chrom_col, pos_col), chrom_col):
+        partition_dir = get_partition_dir(root, chrom_col, chrom)
+        os.makedirs(partition_dir, exist_ok=True)
+        file_path = os.path.join(partition_dir, "part-0.arrow")
+        table = pa.Table.from_pandas(rows.drop(columns=[chrom_col]), preserve_index=False)
+        with pa.OSFile(file_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table, max_chunksize=batch_size)
+        positions = rows[pos_col].to_numpy()
+        starts = np.arange(0, len(positions), batch_size)
+        ends = np.minimum(starts + batch_size, len(positions)) - 1
+        index["chromosomes"][str(chrom)] = {
+            "path": os.path.relpath(file_path, root),
+            "batches": [[int(positions[start]), int(positions[end])] for start, end in zip(starts, ends)],
+        }
+    with open(os.path.join(root, "index.json"), "w") as f:
+        json.dump(index, f)
+
+
+class TableStore:
+    """
+    Region queries over a table saved in the "arrow" format.
+
+    Only the record batches whose position range overlaps the queried region are read,
+    and only the requested columns are converted, from memory-mapped files that stay
+    open between queries.
+    """
+    def __init__(self, root: str) -> None:
+        """
+        Opens a saved table.
+
+        :param root: The directory written by write_arrow.
+        """
+        with open(os.path.join(root, "index.json")) as f:
+            self.index: dict[str, any] = json.load(f)
+        self.root = root
+        self.chrom_col: str = self.index["chrom_col"]
+        self.pos_col: str = self.index["pos_col"]
+        self.columns: list[str] = self.index["columns"]
+        self._readers: dict[str, any] = {}
+        self._batch_ranges: dict[str, np.ndarray] = {
+            chrom: np.array(entry["batches"], dtype=np.int64).reshape(-1, 2)
+            for chrom, entry in self.index["chromosomes"].items()
+        }
+
+    def query(self, chrom: any, start: int, end: int, columns: list[str] | None = None) -> pd.DataFrame:
+        """
+        Returns the rows of a chromosome with start <= position <= end.
+
+        :param chrom: The chromosome.
+        :param start: First position of the region (inclusive).
+        :param end: Last position of the region (inclusive).
+        :param columns: Columns to return (the chromosome and position are always included), or None for all.
+        """
+        import pyarrow as pa
+
+        chrom = str(chrom)
+        if columns is None:
+            columns = self.columns
+        unknown = [col for col in columns if col not in self.columns]
+        if unknown:
+            raise KeyError(f"Columns {unknown} are not in the saved table.")
+        read_cols = [self.pos_col] + [col for col in columns if col not in (self.chrom_col, self.pos_col)]
+        out_cols = [self.chrom_col] + read_cols
+
+        if chrom not in self._batch_ranges:
+            return pd.DataFrame(columns=out_cols)
+        ranges = self._batch_ranges[chrom]
+        batch_ids = np.flatnonzero((ranges[:, 0] <= end) & (ranges[:, 1] >= start))
+        if len(batch_ids) == 0:
+            return pd.DataFrame(columns=out_cols)
+
+        reader = self._get_reader(chrom)
+        batches = [reader.get_batch(int(i)).select(read_cols) for i in batch_ids]
+        df = pa.Table.from_batches(batches).to_pandas()
+        positions = df[self.pos_col].to_numpy()
+        df = df[(positions >= start) & (positions <= end)].reset_index(drop=True)
+        df.insert(0, self.chrom_col, chrom)
+        return df[out_cols]
+
+    def _get_reader(self, chrom: str):
+        """
+        Returns the (cached) memory-mapped IPC reader of a chromosome.
+        """
+        import pyarrow as pa
+
+        if chrom not in self._readers:
+            path = os.path.join(self.root, self.index["chromosomes"][chrom]["path"])
+            self._readers[chrom] = pa.ipc.open_file(pa.memory_map(path, "r"))
+        return self._readers[chrom]
+
+
+class BgzfWriter:
+    """
+    Minimal writer for BGZF, the blocked gzip format produced by bgzip. The output is a
+    regular gzip file that tabix and htslib readers can also seek into by virtual offset.
+    """
+    def __init__(self, file_path: str, level: int = 6) -> None:
+        self.file = open(file_path, "wb")
+        self.level = level
+        self.buffer = bytearray()
+
+    def tell(self) -> int:
+        """
+        Returns the virtual offset of the next byte written: the compressed offset of the
+        current block shifted left by 16 bits, plus the offset inside the block.
+        """
+        return (self.file.tell() << 16) | len(self.buffer)
+
+    def write(self, data: bytes) -> None:
+        self.buffer += data
+        while len(self.buffer) >= BGZF_BLOCK_SIZE:
+            self._write_block(bytes(self.buffer[:BGZF_BLOCK_SIZE]))
+            del self.buffer[:BGZF_BLOCK_SIZE]
+
+    def flush(self) -> None:
+        """
+        Writes the buffered data as a block, so that the next write starts a new block.
+        """
+        if self.buffer:
+            self._write_block(bytes(self.buffer))
+            self.buffer.clear()
+
+    def close(self) -> None:
+        self.flush()
+        self.file.write(BGZF_EOF)
+        self.file.close()
+
+    def _write_block(self, data: bytes) -> None:
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        block_size = 18 + len(compressed) + 8
+        header = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00" + struct.pack("<H", block_size - 1)
+        self.file.write(header + compressed + struct.pack("<II", zlib.crc32(data), len(data)))
+
+
+class BgzfReader:
+    """
+    Minimal reader for the BGZF files written by BgzfWriter (and bgzip), which decompresses
+    only the blocks between two virtual offsets.
+    """
+    def __init__(self, file_path: str) -> None:
+        self.file = open(file_path, "rb")
+
+    def read(self, start: int, end: int) -> bytes:
+        """
+        Returns the uncompressed bytes from virtual offset start up to virtual offset end.
+        """
+        self.file.seek(start >> 16)
+        chunks = []
+        while True:
+            block_offset = self.file.tell()
+            data = self._read_block()
+            if block_offset >= end >> 16:
+                chunks.append(data[:end & 0xffff])
+                break
+            chunks.append(data)
+        return b"".join(chunks)[start & 0xffff:]
+
+    def close(self) -> None:
+        self.file.close()
+
+    def _read_block(self) -> bytes:
+        header = self.file.read(12)
+        if len(header) < 12 or header[:4] != b"\x1f\x8b\x08\x04":
+            raise ValueError(f"{self.file.name} is not a BGZF file.")
+        extra_size = struct.unpack("<H", header[10:12])[0]
+        extra = self.file.read(extra_size)
+        # The BSIZE subfield ("BC") holds the total block size minus one.
+        pos = 0
+        while extra[pos:pos + 2] != b"BC":
+            pos += 4 + struct.unpack("<H", extra[pos + 2:pos + 4])[0]
+        block_size = struct.unpack("<H", extra[pos + 4:pos + 6])[0] + 1
+        compressed = self.file.read(block_size - 12 - extra_size)
+        return zlib.decompress(compressed[:-8], -15)
+
+
+def write_bgzip_tsv(df: pd.DataFrame, file_path: str, chrom_col: str, pos_col: str, chunk_rows: int = 100_000) -> None:
+    """
+    Writes the table as a BGZF-compressed TSV sorted by chromosome and position, plus a
+    "<file_path>.idx" JSON sidecar index read by read_bgzip_region. For every chromosome,
+    the index lists blocks of rows as [first position, last position, start virtual offset,
+    end virtual offset], which is enough to seek to a region without decompressing the
+    whole file. Rows with a missing position are written but not indexed. Rows are serialized in chunks of
+    chunk_rows, so no text buffer for the whole table is built.
+    """
+    df = sort_by_region(df, chrom_col, pos_col)
+    writer = BgzfWriter(file_path)
+    index: dict[str, any] = {"chrom_col": chrom_col, "pos_col": pos_col, "columns": list(df.columns), "blocks": {}}
+    writer.write(("\t".join(map(str, df.columns)) + "\n").encode())
+    writer.flush()
+    for chrom, rows in iter_chromosomes(df, chrom_col):
+        blocks = index["blocks"].setdefault(str(chrom), [])
+        positions = rows[pos_col].to_numpy()
+        for start in range(0, len(rows), chunk_rows):
+            chunk = rows.iloc[start:start + chunk_rows]
+            data = chunk.to_csv(sep="\t", index=False, header=False).encode()
+            # Index one entry per BGZF block worth of lines, at line boundaries.
+            line_ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10) + 1
+            line_starts = np.r_[0, line_ends[:-1]]
+            first_line = 0
+            while first_line < len(line_starts):
+                limit = line_starts[first_line] + BGZF_BLOCK_SIZE
+                last_line = max(first_line, np.searchsorted(line_ends, limit, side="right") - 1)
+                block_start = writer.tell()
+                writer.write(data[line_starts[first_line]:line_ends[last_line]])
+                block_positions = positions[start + first_line:start + last_line + 1]
+                # Missing positions sort last, after the block's indexed positions.
+                block_positions = block_positions[~pd.isna(block_positions)]
+                if len(block_positions):
+                    blocks.append([int(block_positions[0]), int(block_positions[-1]), block_start, writer.tell()])
+                first_line = last_line + 1
+        writer.flush()
+    writer.close()
+    with open(f"{file_path}.idx", "w") as f:
+        json.dump(index, f)
+
+
+def read_bgzip_region(file_path: str, chrom: any, start: int, end: int, columns: list[str] | None = None) -> pd.DataFrame:
+    """
+    Returns the rows of a chromosome with start <= position <= end from a table written by
+    write_bgzip_tsv. Only the blocks whose position range overlaps the region are
+    decompressed.
+
+    :param file_path: The file written by write_bgzip_tsv (its ".idx" index must be next to it).
+    :param chrom: The chromosome.
+    :param start: First position of the region (inclusive).
+    :param end: Last position of the region (inclusive).
+    :param columns: Columns to return (the chromosome and position are always included), or None for all.
+    """
+    with open(f"{file_path}.idx") as f:
+        index: dict[str, any] = json.load(f)
+    chrom_col, pos_col, all_cols = index["chrom_col"], index["pos_col"], index["columns"]
+    if columns is None:
+        columns = all_cols
+    unknown = [col for col in columns if col not in all_cols]
+    if unknown:
+        raise KeyError(f"Columns {unknown} are not in the saved table.")
+    out_cols = [chrom_col, pos_col] + [col for col in columns if col not in (chrom_col, pos_col)]
+
+    blocks = [block for block in index["blocks"].get(str(chrom), []) if block[0] <= end and block[1] >= start]
+    if not blocks:
+        return pd.DataFrame(columns=out_cols)
+    # The blocks of a chromosome are written one after the other, so one range holds them.
+    reader = BgzfReader(file_path)
+    try:
+        data = reader.read(blocks[0][2], blocks[-1][3])
+    finally:
+        reader.close()
+    df = pd.read_csv(io.BytesIO(data), sep="\t", header=None, names=all_cols, usecols=out_cols, dtype={chrom_col: str})
+    positions = df[pos_col].to_numpy()
+    df = df[(positions >= start) & (positions <= end)].reset_index(drop=True)
+    return df[out_cols]
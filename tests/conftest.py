@@ -0,0 +1,59 @@
+import contextlib
+import io
+import os
+import sys
+import pytest
+
+# The modules live in the repository root, which is not an installed package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import generate_dbs
+from extended_table import ExtendedTable
+from instructions_provider import InstructionsProvider
+
+
+@pytest.fixture(autouse=True)
+def isolate_instructions():
+    """
+    InstructionsProvider imports the instructions of every dbs directory as the
+    "variants" and "validation" packages, so every test starts without the packages and
+    dbs directories of the previous ones.
+    """
+    path = list(sys.path)
+    yield
+    sys.path[:] = path
+    for name in [name for name in sys.modules if name.split(".")[0] in ("variants", "validation")]:
+        del sys.modules[name]
+
+
+@pytest.fixture
+def make_dbs(tmp_path):
+    """
+    Returns a function generating a synthetic dbs directory (see benchmark.generate_dbs).
+    """
+    def make(name: str = "dbs", **kwargs) -> str:
+        kwargs = {"sources": 3, "rows": 600, "overlap": 0.5, "validation_rows": 300, **kwargs}
+        with contextlib.redirect_stdout(io.StringIO()):
+            return generate_dbs(str(tmp_path / name), **kwargs)
+    return make
+
+
+def create_table(dbs_dir: str, **kwargs) -> ExtendedTable:
+    """
+    Returns an extended table over all variant and validation dbs of a dbs directory.
+    """
+    provider = InstructionsProvider(dbs_dir)
+    variant_dbs = [provider.create_db_instance(name) for name in sorted(provider.get_dbs_names())]
+    validation_dbs = [provider.create_db_instance(name, "validation") for name in sorted(provider.get_dbs_names("validation"))]
+    return ExtendedTable(provider.get_key_columns(), provider, variant_dbs, validation_dbs, provider.get_annotations_names(), **kwargs)
+
+
+def build_table(dbs_dir: str, **kwargs) -> ExtendedTable:
+    """
+    Merges and validates the extended table of a dbs directory, without the progress output.
+    """
+    table = create_table(dbs_dir, **kwargs)
+    with contextlib.redirect_stdout(io.StringIO()):
+        table.merge_all_dbs()
+        table.validate_table()
+    return table
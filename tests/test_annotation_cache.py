@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+from annotation_cache import AnnotationCache
+
+
+def make_annotation(calls: list[int]) -> dict[str, any]:
+    def compute(df):
+        calls.append(len(df))
+        df["double"] = df["pos"] * 2
+        df["label"] = "p" + df["pos"].astype(str)
+    return {"inputs": ["pos"], "outputs": ["double", "label"], "compute_function": compute}
+
+
+def test_values_are_memoized_across_frames_and_runs(tmp_path):
+    calls = []
+    annotation = make_annotation(calls)
+    cache = AnnotationCache(str(tmp_path))
+    first = pd.DataFrame({"pos": [1, 1, 2, 2, 3, 1]})
+    cache.compute("double", annotation, first)
+    second = pd.DataFrame({"pos": [3, 3, 4, 4, 1]})
+    cache.compute("double", annotation, second)
+    assert calls == [3, 1]
+    assert second["double"].tolist() == [6, 6, 8, 8, 2]
+    assert second["label"].tolist() == ["p3", "p3", "p4", "p4", "p1"]
+
+    # A new cache over the same directory reuses the persisted values.
+    third = pd.DataFrame({"pos": [4, 2, 2, 4]})
+    AnnotationCache(str(tmp_path)).compute("double", annotation, third)
+    assert calls == [3, 1]
+    assert third["double"].tolist() == [8, 4, 4, 8]
+
+
+def test_full_memo_keeps_output_dtypes():
+    calls = []
+    annotation = make_annotation(calls)
+    cache = AnnotationCache(max_entries=2)
+    cache.compute("double", annotation, pd.DataFrame({"pos": [1, 1, 2, 2]}))
+    df = pd.DataFrame({"pos": [1, 1, 2, 3, 3, 4, 4]})
+    cache.compute("double", annotation, df)
+    assert df["double"].tolist() == [2, 2, 4, 6, 6, 8, 8]
+    assert df["double"].dtype == np.int64
+    assert df["label"].tolist() == ["p1", "p1", "p2", "p3", "p3", "p4", "p4"]
+
+
+def test_nearly_distinct_inputs_are_not_memoized():
+    calls = []
+    annotation = make_annotation(calls)
+    cache = AnnotationCache()
+    df = pd.DataFrame({"pos": np.arange(100)})
+    cache.compute("double", annotation, df)
+    assert calls == [100]
+    assert df["double"].tolist() == list(range(0, 200, 2))
+    assert cache._memos == {}
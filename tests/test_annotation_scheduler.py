@@ -0,0 +1,59 @@
+import pandas as pd
+import pytest
+from annotation_scheduler import AnnotationScheduler
+
+
+def write(col: str, value: any):
+    def compute(df):
+        df[col] = value
+    return compute
+
+
+def test_undeclared_annotations_run_before_their_declared_readers():
+    # Legacy annotations without inputs, and a declared one reading the second of them.
+    annotations = {
+        "U1": {"compute_function": write("U1", 1)},
+        "U2": {"compute_function": write("U2", 2)},
+        "D": {"compute_function": lambda df: df.__setitem__("D", df["U2"] + 1), "inputs": ["U2"]},
+    }
+    scheduler = AnnotationScheduler()
+    assert scheduler.plan(annotations, ["U1", "U2", "D"]) == [["U1"], ["U2"], ["D"]]
+    assert scheduler.get_input_cols(annotations, ["U1", "U2", "D"]) == []
+    df = pd.DataFrame({"ref": ["A", "C"]})
+    scheduler.run(annotations, ["U1", "U2", "D"], df)
+    assert df["D"].tolist() == [3, 3]
+
+
+def test_undeclared_annotation_before_a_chain_of_readers():
+    annotations = {
+        "U": {"compute_function": write("U", 1)},
+        "D1": {"compute_function": write("D1", 1), "inputs": ["U"]},
+        "D2": {"compute_function": write("D2", 1), "inputs": ["D1"]},
+        "X": {"compute_function": write("X", 1), "inputs": ["ref"]},
+    }
+    assert AnnotationScheduler().plan(annotations, ["U", "D1", "D2", "X"]) == [["X"], ["U"], ["D1"], ["D2"]]
+
+
+def test_declared_annotations_run_in_dependency_levels():
+    annotations = {
+        "total": {"compute_function": lambda df: df.__setitem__("total", df["a"] + df["b"]), "inputs": ["a", "b"]},
+        "a": {"compute_function": lambda df: df.__setitem__("a", df["pos"] * 2), "inputs": ["pos"]},
+        "b": {"compute_function": lambda df: df.__setitem__("b", df["pos"] + 1), "inputs": ["pos"]},
+        "unused": {"compute_function": write("unused", 0), "inputs": ["pos"]},
+    }
+    scheduler = AnnotationScheduler(workers=2)
+    assert scheduler.plan(annotations, ["total"]) == [["a", "b"], ["total"]]
+    assert scheduler.get_input_cols(annotations, ["total"]) == ["pos"]
+    df = pd.DataFrame({"pos": [1, 2]})
+    scheduler.run(annotations, ["total"], df)
+    assert df["total"].tolist() == [4, 7]
+    assert "unused" not in df
+
+
+def test_cyclic_declared_annotations_are_rejected():
+    annotations = {
+        "a": {"compute_function": write("a", 0), "inputs": ["b"]},
+        "b": {"compute_function": write("b", 0), "inputs": ["a"]},
+    }
+    with pytest.raises(ValueError, match="cyclic"):
+        AnnotationScheduler().plan(annotations, ["a"])
@@ -0,0 +1,28 @@
+import contextlib
+import io
+import pandas as pd
+import pytest
+from conftest import create_table
+
+pytest.importorskip("duckdb")
+
+
+def build_csv(dbs_dir: str, path: str, backend: str) -> pd.DataFrame:
+    table = create_table(dbs_dir, backend=backend)
+    # Streamed sources take the chunked path of both backends.
+    table.variant_dbs[2].chunk_size = 100
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            table.merge_all_dbs()
+            table.validate_table()
+            table.save_table(path, "csv")
+    finally:
+        table.backend.close()
+    return pd.read_csv(path)
+
+
+def test_duckdb_backend_matches_pandas(make_dbs, tmp_path):
+    dbs_dir = make_dbs()
+    expected = build_csv(dbs_dir, str(tmp_path / "pandas.csv"), "pandas")
+    table = build_csv(dbs_dir, str(tmp_path / "duckdb.csv"), "duckdb")
+    pd.testing.assert_frame_equal(table, expected)
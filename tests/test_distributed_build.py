@@ -0,0 +1,87 @@
+import contextlib
+import io
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import pandas as pd
+import pytest
+from benchmark import generate_dbs
+from distributed_build import DistributedWorker, build_distributed, run_worker
+from extended_table import ExtendedTable
+from instructions_provider import InstructionsProvider
+
+AUTHKEY = b"test"
+
+
+@pytest.fixture(scope="module")
+def dbs_dir(tmp_path_factory) -> str:
+    return generate_dbs(str(tmp_path_factory.mktemp("dbs")), sources=3, rows=2000, overlap=0.5, validation_rows=1000)
+
+
+def create_table(dbs_dir: str) -> ExtendedTable:
+    provider = InstructionsProvider(dbs_dir)
+    variant_dbs = [provider.create_db_instance(name) for name in sorted(provider.get_dbs_names())]
+    validation_dbs = [provider.create_db_instance(name, "validation") for name in provider.get_dbs_names("validation")]
+    return ExtendedTable(provider.get_key_columns(), provider, variant_dbs, validation_dbs, provider.get_annotations_names())
+
+
+def sorted_table(table: ExtendedTable, columns: list[str]) -> pd.DataFrame:
+    return table.table[columns].astype(str).sort_values(table.key_cols).reset_index(drop=True)
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def run_worker_when_listening(address: tuple[str, int], killed: bool) -> None:
+    """
+    Runs a worker once the coordinator listens. A killed worker exits abruptly when it
+    receives its first work unit.
+    """
+    if killed:
+        DistributedWorker.run_unit = lambda self, unit, payload: os._exit(1)
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            run_worker(address, AUTHKEY, name="killed" if killed else "healthy")
+            return
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def test_distributed_build_with_killed_worker_matches_sequential_build(dbs_dir):
+    sequential = create_table(dbs_dir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        sequential.merge_all_dbs()
+        sequential.validate_table()
+
+    address = ("localhost", get_free_port())
+    exit_codes = []
+
+    def start_workers():
+        # The killed worker takes a unit and dies before a healthy worker connects, so
+        # its unit must be reassigned.
+        for killed in (True, False):
+            process = multiprocessing.Process(target=run_worker_when_listening, args=(address, killed))
+            process.start()
+            process.join()
+            exit_codes.append(process.exitcode)
+
+    distributed = create_table(dbs_dir)
+    workers = threading.Thread(target=start_workers)
+    workers.start()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        build_distributed(distributed, local_workers=0, address=address, authkey=AUTHKEY, shards=3, heartbeat_timeout=10)
+    workers.join()
+
+    assert exit_codes == [1, 0]
+    assert "worker 'killed' was lost" in output.getvalue()
+    columns = list(sequential.table.columns)
+    pd.testing.assert_frame_equal(sorted_table(distributed, columns), sorted_table(sequential, columns))
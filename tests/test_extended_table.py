@@ -0,0 +1,105 @@
+import contextlib
+import io
+import os
+import pandas as pd
+import pytest
+from conftest import build_table, create_table
+from extended_table import ExtendedTable
+
+
+def set_missing_position(dbs_dir: str, source: str, row: int) -> None:
+    path = os.path.join(dbs_dir, "variants", source, "variants_table.csv")
+    df = pd.read_csv(path)
+    df.loc[row, "pos"] = None
+    df.to_csv(path, index=False)
+
+
+def test_merge_strategies_build_the_same_table(make_dbs):
+    dbs_dir = make_dbs()
+    set_missing_position(dbs_dir, "src_1", 3)
+    sequential = build_table(dbs_dir).table
+    single_pass = build_table(dbs_dir, merge_strategy="single_pass").table
+
+    assert sequential["pos"].dtype == "float64"
+    pd.testing.assert_frame_equal(single_pass, sequential)
+
+
+def test_workers_leave_chunked_dbs_to_streaming(make_dbs):
+    dbs_dir = make_dbs()
+    expected = build_table(dbs_dir).table
+
+    table = create_table(dbs_dir, workers=2)
+    chunked = table.variant_dbs[1]
+    chunked.chunk_size = 100
+    with contextlib.redirect_stdout(io.StringIO()):
+        table.load_all_dbs()
+        assert chunked.df is None
+        assert all(db.df is not None for db in table.variant_dbs if db is not chunked)
+        table.merge_all_dbs()
+        table.validate_table()
+    pd.testing.assert_frame_equal(table.table, expected)
+
+
+def test_region_columns_are_found_by_name(tmp_path):
+    table = ExtendedTable(["pos", "chrom", "ref", "alt"], None)
+    assert (table.chrom_col, table.pos_col) == ("chrom", "pos")
+    assert table.key_index.encoder is not None
+
+    table = ExtendedTable(["variant_id"], None)
+    assert (table.chrom_col, table.pos_col) == (None, None)
+    assert table.key_index.encoder is None
+    table.table = pd.DataFrame({"variant_id": ["a", "b"]})
+    with pytest.raises(ValueError):
+        table.save_table(str(tmp_path / "table.tsv.bgz"), "tsv.bgz")
+
+
+def test_incremental_rebuild_matches_a_full_build(make_dbs, tmp_path):
+    dbs_dir = make_dbs()
+    state_dir = str(tmp_path / "state")
+    with contextlib.redirect_stdout(io.StringIO()):
+        build_table(dbs_dir).save_state(state_dir)
+
+    # Drop rows from a source and add new variants to it.
+    path = os.path.join(dbs_dir, "variants", "src_1", "variants_table.csv")
+    df = pd.read_csv(path).iloc[100:]
+    added = pd.DataFrame({"chrom": ["chrY"] * 3, "pos": [1, 2, 3], "ref": ["A"] * 3, "alt": ["G"] * 3, "qual": [0.5] * 3})
+    pd.concat([df, added]).to_csv(path, index=False)
+
+    table = create_table(dbs_dir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        table.load_state(state_dir)
+        table.rebuild_incremental()
+        table.validate_table()
+    expected = build_table(dbs_dir).table
+
+    keys = ["chrom", "pos", "ref", "alt"]
+    rebuilt = table.table.astype(str).sort_values(keys, ignore_index=True)
+    pd.testing.assert_frame_equal(rebuilt, expected.astype(str).sort_values(keys, ignore_index=True))
+    assert (table.key_index.lookup(table.key_index.encode_keys(table.table)) == range(len(table.table))).all()
+
+
+def test_region_queries_read_the_saved_rows(make_dbs, tmp_path):
+    table = build_table(make_dbs())
+    with contextlib.redirect_stdout(io.StringIO()):
+        table.save_table(str(tmp_path / "table"), "arrow")
+
+    df = table.table.astype({"chrom": str})
+    for chrom, start, end in [("chr1", 1, 10_000_000), ("chr2", 100, 400), ("chr1", 0, 0)]:
+        region = table.query(chrom, start, end, sources=["src_0"], annotations=["ann_1"])
+        expected = df[(df["chrom"] == chrom) & (df["pos"] >= start) & (df["pos"] <= end)].sort_values("pos", kind="stable")
+        assert list(region.columns) == table.key_cols + ["src_0", "ann_1"]
+        assert region["pos"].tolist() == expected["pos"].tolist()
+        assert region["ann_1"].tolist() == expected["ann_1"].tolist()
+        assert region["src_0"].tolist() == expected["src_0"].tolist()
+
+
+def test_prefetching_builds_the_same_table(make_dbs):
+    dbs_dir = make_dbs()
+    expected = build_table(dbs_dir).table
+
+    table = create_table(dbs_dir, prefetch=2)
+    table.variant_dbs[0].chunk_size = 70
+    with contextlib.redirect_stdout(io.StringIO()):
+        table.merge_all_dbs()
+        table.validate_table()
+    pd.testing.assert_frame_equal(table.table, expected)
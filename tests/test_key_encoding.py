@@ -0,0 +1,58 @@
+import pickle
+import numpy as np
+import pandas as pd
+from key_encoding import OVERFLOW_FLAG, KeyEncoder
+
+KEY_COLS = ["chrom", "pos", "ref", "alt"]
+
+
+def make_keys() -> pd.DataFrame:
+    """
+    Returns keys covering every layout: inline alleles, long alleles, and overflow keys
+    (a position out of range, a missing position and more than 512 chromosomes).
+    """
+    keys = pd.DataFrame({
+        "chrom": ["1", "1", "2", "X", "X", "1"],
+        "pos": [100, 100, 2500, 2 ** 31, np.nan, 7],
+        "ref": ["A", "ACGTACGT", "G", "C", "T", "N"],
+        "alt": ["T", "A", "GAAAAAAAAA", "A", "C", "A"],
+    })
+    many_chroms = pd.DataFrame({"chrom": [f"contig_{i}" for i in range(600)], "pos": range(600), "ref": "A", "alt": "C"})
+    return pd.concat([keys, many_chroms], ignore_index=True)
+
+
+def test_encode_decode_round_trip():
+    keys = make_keys()
+    encoder = KeyEncoder(KEY_COLS, "chrom", "pos")
+    codes = encoder.encode(keys)
+
+    assert len(np.unique(codes)) == len(keys)
+    # Only the keys that do not fit the packed layout are in the overflow dictionary.
+    assert (codes[[3, 4]] >= OVERFLOW_FLAG).all()
+    assert (codes[[0, 1, 2, 5]] < OVERFLOW_FLAG).all()
+    decoded = encoder.decode(codes)
+    pd.testing.assert_frame_equal(decoded.astype(str), keys.astype(str))
+    np.testing.assert_array_equal(encoder.encode(decoded), codes)
+
+
+def test_integer_keys_encode_alike_in_any_dtype():
+    keys = make_keys().iloc[[0, 1, 2, 5]].reset_index(drop=True)
+    encoder = KeyEncoder(KEY_COLS, "chrom", "pos")
+    codes = encoder.encode(keys.astype({"pos": np.int64}))
+    for dtype in [np.int32, np.float64, "Int64", object]:
+        np.testing.assert_array_equal(encoder.encode(keys.astype({"pos": dtype})), codes)
+
+
+def test_dictionaries_survive_save_and_pickle(tmp_path):
+    keys = make_keys()
+    encoder = KeyEncoder(KEY_COLS, "chrom", "pos")
+    codes = encoder.encode(keys)
+
+    loaded = KeyEncoder(KEY_COLS, "chrom", "pos")
+    encoder.save(str(tmp_path / "encoder.pkl"))
+    loaded.load(str(tmp_path / "encoder.pkl"))
+    for other in [loaded, pickle.loads(pickle.dumps(encoder))]:
+        # Known keys (including the one with a missing position) keep their codes.
+        np.testing.assert_array_equal(other.encode(keys), codes)
+        assert len(other.overflow) == len(encoder.overflow)
+
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+from key_encoding import KeyEncoder
+from key_index import KeyIndex
+from test_key_encoding import KEY_COLS, make_keys
+
+
+def test_key_index_lookup_after_appends():
+    keys = make_keys()
+    index = KeyIndex(KEY_COLS, KeyEncoder(KEY_COLS, "chrom", "pos"))
+    for start in range(0, len(keys), 50):
+        chunk_codes = index.encode_keys(keys.iloc[start:start + 50])
+        assert (index.lookup(chunk_codes) == -1).all()
+        index.append(chunk_codes)
+
+    np.testing.assert_array_equal(index.lookup(index.encode_keys(keys)), np.arange(len(keys)))
+    pd.testing.assert_frame_equal(index.decode_keys().astype(str), keys.astype(str))
+
+
+def test_hashed_keys_match_across_integer_dtypes():
+    keys = pd.DataFrame({"chrom": ["1", "2", "3"], "pos": [100, 200, 300], "ref": "A", "alt": "G"})
+    index = KeyIndex(KEY_COLS)
+    index.append(index.encode_keys(keys))
+    with_missing = pd.concat([keys, pd.DataFrame({"chrom": ["4"], "pos": [np.nan], "ref": "A", "alt": "G"})], ignore_index=True)
+    np.testing.assert_array_equal(index.lookup(index.encode_keys(with_missing)), [0, 1, 2, -1])
+    np.testing.assert_array_equal(index.lookup(index.encode_keys(keys.astype({"pos": "Int64"}))), [0, 1, 2])
+
+
+def test_duplicate_keys_resolve_to_first_row():
+    index = KeyIndex(["id"])
+    index.append(np.array([5, 7, 5], dtype=np.uint64))
+    index.append(np.array([7, 9], dtype=np.uint64))
+    np.testing.assert_array_equal(index.lookup(np.array([5, 7, 9, 1], dtype=np.uint64)), [0, 1, 4, -1])
@@ -0,0 +1,48 @@
+import contextlib
+import io
+import os
+import pandas as pd
+from conftest import build_table, create_table
+from sharded_build import build_sharded
+
+KEY_COLS = ["chrom", "pos", "ref", "alt"]
+
+
+def keep_chromosome(dbs_dir: str, db_type: str, name: str, chrom: str) -> None:
+    path = os.path.join(dbs_dir, db_type, name, "variants_table.csv")
+    df = pd.read_csv(path)
+    df[df["chrom"].astype(str) == chrom].to_csv(path, index=False)
+
+
+def sorted_rows(table: pd.DataFrame) -> pd.DataFrame:
+    return table.astype(str).sort_values(KEY_COLS, ignore_index=True)
+
+
+def test_sharded_build_matches_a_sequential_build(make_dbs):
+    dbs_dir = make_dbs()
+    # Most shards have no rows from the validation db.
+    keep_chromosome(dbs_dir, "validation", "truth", "chr1")
+    expected = build_table(dbs_dir).table
+
+    table = create_table(dbs_dir)
+    table.variant_dbs[1].chunk_size = 100
+    table.validation_dbs[0].chunk_size = 50
+    with contextlib.redirect_stdout(io.StringIO()):
+        build_sharded(table, workers=2, bin_size=200_000)
+
+    assert table.table["truth"].sum() > 0
+    pd.testing.assert_frame_equal(sorted_rows(table.table), sorted_rows(expected))
+
+
+def test_sharded_build_creates_the_output_dir(make_dbs, tmp_path):
+    dbs_dir = make_dbs()
+    expected = build_table(dbs_dir).table
+
+    output_dir = tmp_path / "out" / "shards"
+    with contextlib.redirect_stdout(io.StringIO()):
+        build_sharded(create_table(dbs_dir), workers=2, output_dir=str(output_dir), output_format="tsv")
+
+    paths = sorted(output_dir.glob("*.tsv"))
+    assert paths
+    table = pd.concat([pd.read_csv(path, sep="\t") for path in paths], ignore_index=True)
+    assert len(table) == len(expected)
@@ -0,0 +1,28 @@
+import os
+import pandas as pd
+from conftest import build_table, create_table
+from source_cache import SourceCache, source_fingerprint
+
+
+def test_cached_build_matches_an_uncached_build(make_dbs, tmp_path):
+    dbs_dir = make_dbs()
+    expected = build_table(dbs_dir).table
+    cache = SourceCache(str(tmp_path / "cache"))
+
+    first = build_table(dbs_dir, source_cache=cache).table
+    assert all(cache.get(db) is not None for db in create_table(dbs_dir).variant_dbs)
+    second = build_table(dbs_dir, source_cache=cache).table
+
+    pd.testing.assert_frame_equal(first, expected)
+    pd.testing.assert_frame_equal(second, expected)
+
+
+def test_fingerprint_follows_the_instructions_file(make_dbs):
+    dbs_dir = make_dbs()
+    db = create_table(dbs_dir).variant_dbs[0]
+    before = source_fingerprint(db.db_path, db.instructions)
+    assert source_fingerprint(db.db_path, db.instructions) == before
+
+    with open(os.path.join(dbs_dir, "variants", "default", "instructions.py"), "a") as f:
+        f.write("\n# edited\n")
+    assert source_fingerprint(db.db_path, db.instructions) != before
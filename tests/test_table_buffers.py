@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+from table_buffers import TableBuffers
+
+
+def make_buffers() -> TableBuffers:
+    buffers = TableBuffers(category_cols=["chrom"], indicator_cols=["src_0", "src_1"], downcast=True, growth=1.5)
+    buffers.sync(pd.DataFrame({"chrom": pd.Series([], dtype=object), "pos": pd.Series([], dtype=np.int64)}))
+    buffers.add_column("src_0")
+    return buffers
+
+
+def test_appends_match_a_concatenation():
+    buffers = make_buffers()
+    frames = [
+        pd.DataFrame({"chrom": ["chr2", "chr1"], "pos": [10, 20], "src_0": [1, 1]}),
+        pd.DataFrame({"chrom": ["chrX", "chr1", None], "pos": [30, 40, 70_000]}),
+    ]
+    for df in frames:
+        buffers.append(df)
+    buffers.add_column("src_1")
+    buffers.set_values("src_1", np.array([1, 4]), 1)
+    table = buffers.to_frame()
+
+    assert table["chrom"].tolist()[:4] == ["chr2", "chr1", "chrX", "chr1"] and pd.isna(table["chrom"][4])
+    # New categories are sorted, as astype("category") does.
+    assert table["chrom"].cat.categories.tolist() == ["chr1", "chr2", "chrX"]
+    assert table["pos"].tolist() == [10, 20, 30, 40, 70_000]
+    assert table["pos"].dtype == np.int32
+    assert table["src_0"].tolist() == [1, 1, 0, 0, 0]
+    assert table["src_1"].tolist() == [0, 1, 0, 0, 1]
+    assert table["src_1"].dtype == np.uint8
+
+
+def test_returned_frames_do_not_change():
+    buffers = make_buffers()
+    buffers.append(pd.DataFrame({"chrom": ["chr1", "chr2"], "pos": [1, 2], "src_0": [1, 0]}))
+    before = buffers.to_frame()
+    snapshot = before.copy()
+
+    buffers.set_values("src_0", np.array([1]), 1)
+    buffers.append(pd.DataFrame({"chrom": ["chr0"] * 10, "pos": np.arange(10)}))
+    after = buffers.to_frame()
+
+    pd.testing.assert_frame_equal(before, snapshot)
+    assert after["src_0"].tolist()[:2] == [1, 1]
+    assert after["chrom"].cat.categories.tolist() == ["chr0", "chr1", "chr2"]
+    assert after["chrom"].tolist()[:2] == ["chr1", "chr2"]
@@ -0,0 +1,37 @@
+import gzip
+import io
+import numpy as np
+import pandas as pd
+from table_io import read_bgzip_region, write_bgzip_tsv
+
+
+def make_table(rows: int = 20_000) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "chrom": rng.choice(["1", "2", "X"], rows),
+        "pos": rng.integers(1, 1_000_000, rows).astype("float64"),
+        "ref": rng.choice(list("ACGT"), rows),
+        "alt": rng.choice(list("ACGT"), rows),
+        "score": rng.random(rows).round(6),
+    })
+    df.loc[[5, 17], "pos"] = np.nan
+    return df
+
+
+def test_bgzip_region_reads_match_the_table(tmp_path):
+    df = make_table()
+    path = str(tmp_path / "table.tsv.bgz")
+    write_bgzip_tsv(df, path, "chrom", "pos", chunk_rows=3_000)
+
+    # The output is a regular gzip file holding the whole table.
+    with gzip.open(path) as f:
+        assert len(pd.read_csv(io.BytesIO(f.read()), sep="\t")) == len(df)
+
+    for chrom, start, end in [("1", 1, 1_000_000), ("2", 250_000, 260_000), ("X", 500_000, 500_000), ("Y", 1, 10)]:
+        region = read_bgzip_region(path, chrom, start, end, columns=["score"])
+        expected = df[(df["chrom"] == chrom) & (df["pos"] >= start) & (df["pos"] <= end)]
+        expected = expected.sort_values("pos", kind="stable")[["chrom", "pos", "score"]]
+        assert list(region.columns) == ["chrom", "pos", "score"]
+        assert region["pos"].tolist() == expected["pos"].tolist()
+        assert region["score"].tolist() == expected["score"].tolist()
+        assert (region["chrom"] == chrom).all()
@@ -0,0 +1,37 @@
+import contextlib
+import io
+import os
+import pandas as pd
+from conftest import build_table, create_table
+from key_index import KeyIndex
+
+KEY_COLS = ["chrom", "pos", "ref", "alt"]
+
+
+def expected_truth(dbs_dir: str, table: pd.DataFrame) -> list[int]:
+    """
+    Returns the expected "truth" indicator of every table row: the variant is in the
+    validation db with a pathogenic (P or LP) clinical significance.
+    """
+    truth = pd.read_csv(os.path.join(dbs_dir, "validation", "truth", "variants_table.csv"))
+    keys = table[KEY_COLS].astype({"chrom": str, "ref": str, "alt": str, "pos": "int64"})
+    merged = keys.merge(truth, on=KEY_COLS, how="left")
+    return merged["clnsig"].isin(["P", "LP"]).astype(int).tolist()
+
+
+def test_rule_based_validation_matches_a_join(make_dbs):
+    dbs_dir = make_dbs()
+    table = build_table(dbs_dir).table
+    assert table["truth"].tolist() == expected_truth(dbs_dir, table)
+    assert 0 < table["truth"].sum() < len(table)
+
+
+
+def test_validation_with_hashed_keys(make_dbs):
+    dbs_dir = make_dbs()
+    table = create_table(dbs_dir)
+    table.key_index = KeyIndex(table.key_cols)
+    with contextlib.redirect_stdout(io.StringIO()):
+        table.merge_all_dbs()
+        table.validate_table()
+    assert table.table["truth"].tolist() == expected_truth(dbs_dir, table.table)